@@ -2,13 +2,26 @@
 
 ''' Plots per-application latencies for a specific number of shards '''
 
+import sys
+import argparse
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.font_manager import FontProperties, fontManager
 
-from pandas import read_csv, concat
+from pandas import concat
 from seaborn import lineplot, FacetGrid
 
+# Shared helpers live in the top-level directory
+sys.path.append('..')
+from results import load_results # pylint: disable=wrong-import-position
+from saturation import KNEE_METHODS, plot_knee # pylint: disable=wrong-import-position
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--mark-knees', action='store_true',
+    help="Mark where each curve saturates (see saturation.py)")
+parser.add_argument('--knee-method', choices=KNEE_METHODS, default='kneedle')
+args = parser.parse_args()
+
 FONT_PATH = '../LinLibertine_Rah.ttf'
 fontManager.addfont(FONT_PATH)
 
@@ -35,8 +48,7 @@ col_order = [val for (_,val) in workloads.items()]
 data = []
 
 for name in workloads:
-    df = read_csv(f'../sharding/{name}.csv', header=0,
-                  comment="#", skipinitialspace=True)
+    df = load_results(f'../sharding/{name}.csv')
     if 'workload' not in df:
         df["workload"] = name
     data.append(df)
@@ -63,6 +75,9 @@ g = FacetGrid(df, col="Workload", hue="worker-type",
               col_order=col_order)
 g.map(lineplot, "throughput", "latency-mean")
 
+if args.mark_knees:
+    g.map_dataframe(plot_knee, "throughput", "latency-mean", method=args.knee_method)
+
 g.set_titles(col_template="{col_name}")
 #g.set_xlabels("Throughput (tsd. transactions/s)")
 g.set_xlabels("Throughput (ktps)")
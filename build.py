@@ -0,0 +1,302 @@
+#! /bin/env python3
+
+''' Builds all figures in parallel, importing the plotting libraries only once per worker.
+    Figures are only rebuilt if their script, parameters, or the files they read have changed. '''
+
+# pylint: disable=import-outside-toplevel
+
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import shlex
+import string
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+FONT_PATH = os.path.join(ROOT, 'LinLibertine_Rah.ttf')
+CACHE_PATH = os.path.join(ROOT, '.build-cache.json')
+
+# Every figure is built in its own directory and written to <name>.pdf.
+# The files a figure depends on are recorded while it is being rendered.
+FIGURES = {
+    'object-creation': {'script': 'plot.py'},
+    'job-length': {'script': 'plot.py'},
+    'micro-throughput': {'script': 'plot.py'},
+    'micro-latency': {'script': 'plot.py'},
+    'sharding': {'script': 'plot.py'},
+    'object-partitioning': {'script': 'plot.py'},
+    'app-latency': {'script': 'plot.py'},
+    'timeout': {'script': 'plot.sh'},
+    'light-replication': {'script': 'plot.sh'},
+}
+
+# Sidecars and caches are derived from (and checked against) the file they were built from
+SIDECAR_SUFFIXES = ['.pyramid.bin', '.pyramid.json', '.bin', '.json', '.lines', '.pkl']
+
+# Directories that only hold data derived from other inputs (e.g., the peak-throughput cube)
+DERIVED_DIRECTORIES = ['.run-store']
+
+# Files opened for reading while a figure is being rendered (None if not recording)
+_opened_files = None
+
+def parse_plot_script(path):
+    ''' Get the python script and arguments that a plot.sh script invokes,
+        so they can be run inside a warm worker instead of a new interpreter '''
+
+    with open(path, 'r', encoding='utf-8') as infile:
+        text = infile.read().replace('\\\n', ' ')
+
+    variables = {}
+
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+
+        assignment = re.fullmatch(r'([A-Za-z_][A-Za-z0-9_]*)=(\S*)', line)
+        if assignment:
+            variables[assignment.group(1)] = assignment.group(2)
+            continue
+
+        words = [string.Template(word).substitute(variables) for word in shlex.split(line)]
+        if words[0].endswith('.py'):
+            return words[0], words[1:]
+
+    raise RuntimeError(f"Could not find a python command in {path}")
+
+def figure_command(name):
+    ''' Get the script (relative to the figure's directory) and arguments for a figure '''
+    figure = FIGURES[name]
+    if figure['script'].endswith('.sh'):
+        return parse_plot_script(os.path.join(ROOT, name, figure['script']))
+    return figure['script'], []
+
+def file_hash(path):
+    ''' Get the SHA-256 of a file's content '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def file_state(path, previous=None):
+    ''' Get the mtime, size, and hash of a file.
+        The hash is reused from the previous state if mtime and size did not change. '''
+    stat = os.stat(path)
+    if previous and (previous['mtime_ns'], previous['size']) == (stat.st_mtime_ns, stat.st_size):
+        return previous
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'sha256': file_hash(path)}
+
+def parameters_hash(name):
+    ''' Hash of everything about how a figure is rendered, other than its input files '''
+    (script, argv) = figure_command(name)
+    return hashlib.sha256(json.dumps([name, script, argv]).encode('utf-8')).hexdigest()
+
+def load_cache():
+    ''' Load the inputs recorded for each figure during the last build '''
+    try:
+        with open(CACHE_PATH, 'r', encoding='utf-8') as infile:
+            return json.load(infile)
+    except (OSError, ValueError):
+        return {}
+
+def save_cache(cache):
+    ''' Store the inputs recorded for each figure '''
+    tmp_path = CACHE_PATH + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as outfile:
+        json.dump(cache, outfile, indent=2, sort_keys=True)
+    os.replace(tmp_path, CACHE_PATH)
+
+def is_up_to_date(name, cache):
+    ''' A figure is up to date if it has been built with the same parameters
+        and none of the files it read have changed since '''
+    entry = cache.get(name)
+    if entry is None or not os.path.exists(os.path.join(ROOT, f'{name}.pdf')):
+        return False
+    if entry['parameters'] != parameters_hash(name):
+        return False
+
+    for (path, previous) in entry['inputs'].items():
+        try:
+            if file_state(os.path.join(ROOT, path), previous)['sha256'] != previous['sha256']:
+                return False
+        except OSError:
+            return False
+
+    return True
+
+def _record_open(event, args):
+    ''' Audit hook that records which files are read while rendering a figure '''
+    if _opened_files is None or event != 'open':
+        return
+
+    (path, mode, flags) = args
+    if path is None or isinstance(path, int):
+        return
+
+    if mode is not None:
+        writing = any(flag in mode for flag in 'wax+')
+    else:
+        writing = flags & (os.O_WRONLY | os.O_RDWR) != 0
+
+    if not writing:
+        _opened_files.add(os.path.abspath(os.fsdecode(path)))
+
+def _source_file(path):
+    for suffix in SIDECAR_SUFFIXES:
+        if path.endswith(suffix) and os.path.exists(path[:-len(suffix)]):
+            return path[:-len(suffix)]
+    return path
+
+def init_worker():
+    ''' Do the expensive imports and register the font once per worker process '''
+    import importlib
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib.font_manager import fontManager
+
+    for module in ['matplotlib.pyplot', 'pandas', 'seaborn']:
+        importlib.import_module(module)
+
+    fontManager.addfont(FONT_PATH)
+
+    # The plot scripts register the font themselves; skip fonts we already know about
+    registered = {os.path.abspath(FONT_PATH)}
+    add_font = fontManager.addfont
+
+    def add_font_once(path):
+        path = os.path.abspath(path)
+        if path not in registered:
+            add_font(path)
+            registered.add(path)
+
+    fontManager.addfont = add_font_once
+
+    sys.addaudithook(_record_open)
+
+def run_script(directory, script, argv):
+    ''' Run a plot script inside the current (warm) interpreter.
+        Returns all files in the repository that the script read. '''
+    global _opened_files # pylint: disable=global-statement
+    import runpy
+    import matplotlib
+    import matplotlib.pyplot as plt
+
+    old_cwd = os.getcwd()
+    old_argv = sys.argv
+    old_path = list(sys.path)
+    old_modules = set(sys.modules)
+
+    os.chdir(directory)
+    sys.argv = [script] + argv
+    sys.path.insert(0, directory)
+    _opened_files = set()
+
+    try:
+        # Keep rcParams changes of one figure from leaking into the next
+        with matplotlib.rc_context():
+            try:
+                runpy.run_path(script, run_name='__main__')
+            except SystemExit as err:
+                if err.code not in (None, 0):
+                    raise RuntimeError(f"{script} exited with code {err.code}") from err
+    finally:
+        opened = _opened_files
+        _opened_files = None
+        plt.close('all')
+        os.chdir(old_cwd)
+        sys.argv = old_argv
+        sys.path[:] = old_path
+
+        # Directories have their own modules with the same name (e.g., extract_metrics).
+        # Shared modules (e.g., results) are reloaded as well, so they are recorded as inputs.
+        for module in set(sys.modules) - old_modules:
+            path = getattr(sys.modules[module], '__file__', None) or ''
+            if os.path.abspath(path).startswith(ROOT + os.sep):
+                opened.add(os.path.abspath(path))
+                del sys.modules[module]
+
+    derived = tuple(os.path.join(ROOT, name) + os.sep for name in DERIVED_DIRECTORIES)
+    inputs = {_source_file(path) for path in opened
+              if path.startswith(ROOT + os.sep) and not path.startswith(derived)}
+    return sorted(os.path.relpath(path, ROOT) for path in inputs
+                  if os.sep + '__pycache__' + os.sep not in path)
+
+def render(name):
+    ''' Build a single figure.
+        Returns the figure name, how long it took, and the files it depends on. '''
+    start = time.time()
+    directory = os.path.join(ROOT, name)
+    (script, argv) = figure_command(name)
+
+    inputs = run_script(directory, script, argv)
+    os.replace(os.path.join(directory, 'output.pdf'), os.path.join(ROOT, f'{name}.pdf'))
+
+    # The figure's own script (e.g., plot.sh) and the font are always inputs
+    inputs = set(inputs) | {os.path.join(name, FIGURES[name]['script']),
+                            os.path.relpath(FONT_PATH, ROOT)}
+    return name, time.time() - start, sorted(inputs)
+
+def _main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('figures', type=str, nargs='*',
+        help="Figures to build (defaults to all of them)")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+        help="Number of worker processes")
+    parser.add_argument('-f', '--force', action='store_true',
+        help="Rebuild figures even if they are up to date")
+    args = parser.parse_args()
+
+    names = args.figures or list(FIGURES)
+    for name in names:
+        if name not in FIGURES:
+            parser.error(f"No such figure: {name}")
+
+    cache = load_cache()
+
+    if not args.force:
+        names = [name for name in names if not is_up_to_date(name, cache)]
+
+    if len(names) == 0:
+        print("All figures are up to date")
+        return
+
+    start = time.time()
+    timings = {}
+    failed = []
+
+    with ProcessPoolExecutor(max_workers=min(args.jobs, len(names)),
+                             initializer=init_worker) as executor:
+        futures = {executor.submit(render, name): name for name in names}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                (_, duration, inputs) = future.result()
+                timings[name] = duration
+                print(f"Built {name}.pdf in {duration:.2f}s")
+
+                previous = cache.get(name, {}).get('inputs', {})
+                cache[name] = {
+                    'parameters': parameters_hash(name),
+                    'inputs': {path: file_state(os.path.join(ROOT, path), previous.get(path))
+                               for path in inputs},
+                }
+            except Exception as err: # pylint: disable=broad-exception-caught
+                failed.append(name)
+                sys.stderr.write(f"ERROR: Failed to build {name}.pdf: {err}\n")
+
+    save_cache(cache)
+
+    print(f"Built {len(timings)} figure(s) in {time.time() - start:.2f}s")
+    for (name, duration) in sorted(timings.items(), key=lambda entry: -entry[1]):
+        print(f"  {name:<24} {duration:6.2f}s")
+
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    _main()
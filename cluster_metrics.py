@@ -0,0 +1,682 @@
+#! /bin/env python3
+
+''' Loads the metrics the cluster reports while a benchmark runs (cluster-metrics.csv).
+
+    Which metrics the rows hold differs between experiments, so every experiment directory
+    lists them in its own extract_metrics.py (see MetricSchema). Everything else is shared.
+    Run this to extract a metric and print its average for a specific time range. '''
+
+# pylint: disable=too-many-locals,too-many-branches,too-many-arguments
+
+import os
+import sys
+import csv
+import json
+import hashlib
+import argparse
+import itertools
+import importlib.util
+import numpy as np
+
+from metric_stats import RunningAggregate, DownsampledSeries
+
+DEFAULT_REPORT_FREQUENCY = 100
+
+# Number of rows parsed at once in streaming mode
+DEFAULT_CHUNK_ROWS = 4096
+
+# Maximum number of points kept for each series in streaming mode
+DEFAULT_SERIES_POINTS = 4096
+
+# Bump this whenever the layout of the binary sidecar changes
+SIDECAR_VERSION = 3
+
+# Aggregates supported by extract_batch()
+AGGREGATES = {
+    'mean': np.mean,
+    'min': np.min,
+    'max': np.max,
+    'p50': lambda values: np.percentile(values, 50),
+    'p99': lambda values: np.percentile(values, 99),
+    'stddev': np.std,
+}
+
+# Number of bytes read at once when indexing the lines of a file
+INDEX_CHUNK_BYTES = 1 << 24
+
+# Line offsets for every file we have seen so far
+_LINE_OFFSETS = {}
+
+class MetricSchema:
+    ''' The layout of each row of a metrics file:
+        all local metrics for every node, then the global metrics '''
+
+    def __init__(self, local_metrics, global_metrics):
+        self.local_metrics = local_metrics
+        self.global_metrics = global_metrics
+
+    def __contains__(self, metric):
+        return metric in self.local_metrics or metric in self.global_metrics
+
+def load_schema(path):
+    ''' Get the schema of a metrics file from the extract_metrics.py of its experiment directory '''
+    module_path = os.path.join(os.path.dirname(os.path.abspath(path)), 'extract_metrics.py')
+    if not os.path.exists(module_path):
+        raise RuntimeError(f"No extract_metrics.py next to {path} that lists its metrics")
+
+    spec = importlib.util.spec_from_file_location('extract_metrics', module_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.SCHEMA
+
+def parse_start_time(line):
+    ''' parse the start time ine first line '''
+    line = line.replace('# start_time: ', '').replace('\n', '')
+    return int(line)
+
+def parse_rows(schema, lines, first_line_no=1):
+    ''' Parse data rows into a (time x node x metric) array of local metrics
+        and a (time x metric) array of global metrics.
+        Also returns how many nodes had joined at each point in time.
+        Nodes that have not joined yet are reported as NaN; use join_mask()
+        to tell them apart from missing values. '''
+
+    num_local_metrics = len(schema.local_metrics)
+    num_global_metrics = len(schema.global_metrics)
+    num_rows = len(lines)
+
+    if num_rows == 0:
+        return (np.zeros((0, 0, num_local_metrics)),
+                np.zeros((0, num_global_metrics)), np.zeros(0, dtype=int))
+
+    # The number of fields tells us how many nodes had joined at that point
+    lengths = np.array([line.count(',') + 1 for line in lines])
+    num_nodes, remainder = np.divmod(lengths - num_global_metrics, num_local_metrics)
+
+    invalid = np.flatnonzero((remainder != 0) | (num_nodes < 0))
+    if len(invalid) > 0:
+        row = invalid[0]
+        raise RuntimeError(f"Line #{row + first_line_no} is invalid: {lines[row]}")
+
+    if np.any(np.diff(num_nodes) < 0):
+        raise RuntimeError("Number of nodes decreased during the run")
+
+    values = np.array(','.join(lines).split(','), dtype=np.float64)
+
+    # Local metrics come first in every row, followed by the global ones
+    local_sizes = num_nodes * num_local_metrics
+    row_starts = np.cumsum(lengths) - lengths
+    pos_in_row = np.arange(len(values)) - np.repeat(row_starts, lengths)
+    is_local = pos_in_row < np.repeat(local_sizes, lengths)
+
+    max_nodes = int(num_nodes[-1])
+    local_data = np.full((num_rows, max_nodes * num_local_metrics), np.nan)
+    local_data[np.arange(max_nodes * num_local_metrics) < local_sizes[:, None]] = values[is_local]
+    global_data = values[~is_local].reshape(num_rows, num_global_metrics)
+
+    local_data = local_data.reshape(num_rows, max_nodes, num_local_metrics)
+    return local_data, global_data, num_nodes
+
+def _parse_file(schema, path):
+    with open(path, 'r', encoding='utf-8') as infile:
+        start_time = parse_start_time(infile.readline())
+        lines = infile.read().splitlines()
+
+    return (start_time, *parse_rows(schema, lines))
+
+def load_metrics(schema, path, use_sidecar=True):
+    ''' Load an entire metrics file at once.
+        Returns the start time, local metrics, global metrics,
+        and the number of nodes that had joined at each point in time '''
+
+    if use_sidecar:
+        header, local_data, global_data = open_metrics(schema, path)
+        return header['start_time'], local_data, global_data, nodes_joined(header)
+
+    return _parse_file(schema, path)
+
+def _sidecar_paths(path):
+    return path + '.bin', path + '.json'
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def write_atomic(path, data):
+    ''' Replace the file at path with data, so that readers never see a partial file '''
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as outfile:
+        outfile.write(data)
+    os.replace(tmp_path, path)
+
+def convert_metrics(schema, path):
+    ''' Convert a metrics file into a binary sidecar (float64 data plus a JSON header)
+        that later loads can memory-map instead of parsing the text again.
+        Returns the header, local metrics, and global metrics '''
+
+    stat = os.stat(path)
+    start_time, local_data, global_data, num_nodes = _parse_file(schema, path)
+
+    # Keep full precision, so that results are the same as when parsing the text
+    local_data = local_data.astype(np.float64)
+    global_data = global_data.astype(np.float64)
+    (num_rows, max_nodes, _) = local_data.shape
+
+    header = {
+        'version': SIDECAR_VERSION,
+        'source': {
+            'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'sha256': _file_hash(path),
+        },
+        'start_time': start_time,
+        'local_metrics': schema.local_metrics,
+        'global_metrics': schema.global_metrics,
+        'num_rows': num_rows,
+        'max_nodes': max_nodes,
+        # The row at which each node started reporting
+        'node_join_rows': [int(row) for row in
+                           np.searchsorted(num_nodes, np.arange(max_nodes), side='right')],
+    }
+
+    bin_path, header_path = _sidecar_paths(path)
+
+    # The header is written last, so it only ever describes a complete data file
+    try:
+        write_atomic(bin_path, local_data.tobytes() + global_data.tobytes())
+        write_atomic(header_path, json.dumps(header, indent=2).encode('utf-8'))
+    except OSError as err:
+        print(f"WARN: Failed to write sidecar for {path}: {err}")
+
+    return header, local_data, global_data
+
+def _open_sidecar(schema, path):
+    bin_path, header_path = _sidecar_paths(path)
+
+    try:
+        with open(header_path, 'r', encoding='utf-8') as infile:
+            header = json.load(infile)
+    except (OSError, ValueError):
+        return None
+
+    if header.get('version') != SIDECAR_VERSION \
+            or header['local_metrics'] != schema.local_metrics \
+            or header['global_metrics'] != schema.global_metrics:
+        return None
+
+    stat = os.stat(path)
+    source = header['source']
+
+    if (stat.st_mtime_ns, stat.st_size) != (source['mtime_ns'], source['size']):
+        # Only rebuild if the content actually changed
+        if stat.st_size != source['size'] or _file_hash(path) != source['sha256']:
+            return None
+
+        source['mtime_ns'] = stat.st_mtime_ns
+        try:
+            write_atomic(header_path, json.dumps(header, indent=2).encode('utf-8'))
+        except OSError:
+            pass
+
+    num_rows = header['num_rows']
+    local_shape = (num_rows, header['max_nodes'], len(schema.local_metrics))
+    global_shape = (num_rows, len(schema.global_metrics))
+    local_size = int(np.prod(local_shape))
+
+    if os.path.getsize(bin_path) != 8 * (local_size + int(np.prod(global_shape))):
+        return None
+
+    # np.memmap cannot map empty arrays
+    if local_size > 0:
+        local_data = np.memmap(bin_path, dtype=np.float64, mode='r', shape=local_shape)
+    else:
+        local_data = np.zeros(local_shape, dtype=np.float64)
+
+    if num_rows > 0:
+        global_data = np.memmap(bin_path, dtype=np.float64, mode='r',
+                                offset=8 * local_size, shape=global_shape)
+    else:
+        global_data = np.zeros(global_shape, dtype=np.float64)
+
+    return header, local_data, global_data
+
+def open_metrics(schema, path):
+    ''' Memory-map the binary sidecar of a metrics file.
+        The sidecar is (re-)built if it is missing or the file has changed since.
+        Returns the header, local metrics, and global metrics '''
+
+    sidecar = _open_sidecar(schema, path)
+    if sidecar is None:
+        sidecar = convert_metrics(schema, path)
+    return sidecar
+
+def join_mask(num_nodes, max_nodes):
+    ''' Get a (time x node) mask that is set for nodes that had joined at the time '''
+    return np.arange(max_nodes) < np.asarray(num_nodes)[:, None]
+
+def nodes_joined(header):
+    ''' Get the number of nodes that had joined at each row described by a sidecar header '''
+    return np.searchsorted(header['node_join_rows'], np.arange(header['num_rows']), side='right')
+
+def _index_path(path):
+    return path + '.lines'
+
+def _scan_newlines(path, size):
+    ''' Get the offset of every newline, reading the file in chunks of bounded size '''
+    newlines = []
+    with open(path, 'rb') as infile:
+        for start in range(0, size, INDEX_CHUNK_BYTES):
+            chunk = infile.read(min(INDEX_CHUNK_BYTES, size - start))
+            newlines.append(np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == ord('\n')) + start)
+    return np.concatenate(newlines) if newlines else np.zeros(0, dtype=np.int64)
+
+def _open_index(path, version):
+    index_path = _index_path(path)
+    try:
+        with open(index_path, 'rb') as infile:
+            stored = tuple(np.frombuffer(infile.read(16), dtype=np.int64))
+    except OSError:
+        return None
+
+    # The file starts with the version of the metrics file it describes
+    if stored != version or os.path.getsize(index_path) < 24:
+        return None
+    return np.memmap(index_path, dtype=np.int64, mode='r', offset=16)
+
+def line_offsets(path):
+    ''' Get the byte offset at which each line of the file starts.
+        The last entry is the size of the file.
+        The index is built once for every version of the file and stored next to it,
+        so that later runs only read the entries they need. '''
+
+    stat = os.stat(path)
+    key = os.path.abspath(path)
+    version = (stat.st_mtime_ns, stat.st_size)
+
+    cached = _LINE_OFFSETS.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    if stat.st_size == 0:
+        raise RuntimeError(f"{path} is empty")
+
+    offsets = _open_index(path, version)
+    if offsets is None:
+        starts = np.concatenate(([0], _scan_newlines(path, stat.st_size) + 1))
+        offsets = np.append(starts[starts < stat.st_size], stat.st_size).astype(np.int64)
+        try:
+            write_atomic(_index_path(path), np.array(version, dtype=np.int64).tobytes() + offsets.tobytes())
+        except OSError as err:
+            print(f"WARN: Failed to write line index for {path}: {err}")
+
+    _LINE_OFFSETS[key] = (version, offsets)
+    return offsets
+
+def row_range(measure_start_time, start_time, end_time, report_frequency):
+    ''' Each row's timestamp is measure_start_time + row * report_frequency,
+        so we can compute the range of rows in [start_time, end_time] directly '''
+    first_row = max(0, -((measure_start_time - start_time) // report_frequency))
+    end_row = max(first_row, (end_time - measure_start_time) // report_frequency + 1)
+    return int(first_row), int(end_row)
+
+def read_rows(path, first_row, end_row):
+    ''' Read the data rows in [first_row, end_row) without reading the rest of the file '''
+
+    offsets = line_offsets(path)
+
+    # The first line is only metadata
+    num_rows = len(offsets) - 2
+    end_row = min(end_row, num_rows)
+    if first_row >= end_row:
+        return []
+
+    with open(path, 'rb') as infile:
+        infile.seek(int(offsets[first_row+1]))
+        chunk = infile.read(int(offsets[end_row+1] - offsets[first_row+1]))
+
+    return chunk.decode('utf-8').splitlines()
+
+def extract_metric(schema, path, metric, start_time, end_time,
+                   report_frequency=DEFAULT_REPORT_FREQUENCY, use_sidecar=True):
+    ''' Get the average of the specified metric in the specified time interval '''
+
+    if metric not in schema.local_metrics:
+        raise RuntimeError(f"No such metric {metric}")
+    metric_idx = schema.local_metrics.index(metric)
+
+    if use_sidecar:
+        header, local_data, _ = open_metrics(schema, path)
+        first_row, end_row = row_range(header['start_time'], start_time, end_time,
+                                       report_frequency)
+        local_data = local_data[first_row:end_row]
+        num_nodes = nodes_joined(header)[first_row:end_row]
+    else:
+        with open(path, 'r', encoding='utf-8') as infile:
+            measure_start_time = parse_start_time(infile.readline())
+
+        first_row, end_row = row_range(measure_start_time, start_time, end_time,
+                                       report_frequency)
+        lines = read_rows(path, first_row, end_row)
+        local_data, _, num_nodes = parse_rows(schema, lines, first_line_no=first_row+1)
+
+    # Only consider nodes that had joined at the time
+    joined = join_mask(num_nodes, local_data.shape[1])
+    data = local_data[:, :, metric_idx][joined]
+
+    if len(data) == 0:
+        raise RuntimeError("No data found in this time range")
+
+    return np.mean(data, dtype=np.float64)
+
+def _aggregate(values):
+    if len(values) == 0:
+        return {name: None for name in AGGREGATES}
+    values = np.asarray(values, dtype=np.float64)
+    return {name: float(func(values)) for (name, func) in AGGREGATES.items()}
+
+def iter_chunks(schema, infile, chunk_rows=DEFAULT_CHUNK_ROWS):
+    ''' Parse an open metrics file (positioned after the header) chunk by chunk,
+        so that only chunk_rows rows are in memory at a time.
+        Yields the first row of each chunk along with the output of parse_rows() '''
+
+    first_row = 0
+    last_num_nodes = 0
+
+    while True:
+        lines = [line.rstrip('\n') for line in itertools.islice(infile, chunk_rows)]
+        if len(lines) == 0:
+            return
+
+        local_data, global_data, num_nodes = parse_rows(schema, lines, first_line_no=first_row+1)
+        if num_nodes[0] < last_num_nodes:
+            raise RuntimeError("Number of nodes decreased during the run")
+        last_num_nodes = num_nodes[-1]
+
+        yield first_row, local_data, global_data, num_nodes
+        first_row += len(lines)
+
+def stream_batch(schema, path, metrics, windows, per_node=True,
+                 report_frequency=DEFAULT_REPORT_FREQUENCY, chunk_rows=DEFAULT_CHUNK_ROWS):
+    ''' Same as extract_batch() but streams over the file in chunks.
+        Memory use does not depend on the length of the file, and percentiles
+        are approximated with a sketch (1% relative error). '''
+
+    for metric in metrics:
+        if metric not in schema:
+            raise RuntimeError(f"No such metric {metric}")
+
+    cluster = [{metric: RunningAggregate() for metric in metrics} for _ in windows]
+    nodes = [{metric: [] for metric in metrics} for _ in windows]
+
+    with open(path, 'r', encoding='utf-8') as infile:
+        measure_start_time = parse_start_time(infile.readline())
+        row_ranges = [row_range(measure_start_time, start_time, end_time, report_frequency)
+                      for (start_time, end_time) in windows]
+        last_row = max((end_row for (_, end_row) in row_ranges), default=0)
+
+        for (first_row, local_data, global_data, num_nodes) in iter_chunks(schema, infile, chunk_rows):
+            if first_row >= last_row:
+                break
+
+            for (window_idx, (window_first, window_end)) in enumerate(row_ranges):
+                low = max(window_first - first_row, 0)
+                high = min(window_end - first_row, len(local_data))
+                if low >= high:
+                    continue
+
+                window_local = local_data[low:high]
+                joined = join_mask(num_nodes[low:high], local_data.shape[1])
+                nodes_in_window = int(num_nodes[high-1])
+
+                for metric in metrics:
+                    if metric in schema.global_metrics:
+                        values = global_data[low:high, schema.global_metrics.index(metric)]
+                        cluster[window_idx][metric].update(values)
+                        continue
+
+                    metric_data = window_local[:, :, schema.local_metrics.index(metric)]
+                    cluster[window_idx][metric].update(metric_data[joined])
+
+                    if per_node:
+                        per_node_data = nodes[window_idx][metric]
+                        while len(per_node_data) < nodes_in_window:
+                            per_node_data.append(RunningAggregate())
+                        for (node_idx, aggregate) in enumerate(per_node_data):
+                            aggregate.update(metric_data[joined[:, node_idx], node_idx])
+
+    results = []
+
+    for (window_idx, (start_time, end_time)) in enumerate(windows):
+        for metric in metrics:
+            record = {'metric': metric, 'start_time': start_time, 'end_time': end_time}
+            aggregate = cluster[window_idx][metric]
+            results.append({**record, 'node': 'all', 'count': aggregate.count,
+                            **aggregate.result()})
+
+            for (node_idx, aggregate) in enumerate(nodes[window_idx][metric]):
+                results.append({**record, 'node': node_idx, 'count': aggregate.count,
+                                **aggregate.result()})
+
+    return results
+
+def stream_metrics(schema, path, metrics, max_points=DEFAULT_SERIES_POINTS,
+                   chunk_rows=DEFAULT_CHUNK_ROWS):
+    ''' Load a downsampled version of the given metrics, streaming over the file in chunks.
+        Each output row is the mean of a bucket of consecutive rows, and there are at most
+        max_points buckets, so memory use does not depend on the length of the file.
+        Returns the start time, the first row of each bucket, and then local metrics,
+        global metrics, and node counts in the same layout as load_metrics().
+        Metrics that were not requested are NaN. '''
+
+    series = {metric: DownsampledSeries(max_points) for metric in metrics}
+    node_join_rows = []
+
+    with open(path, 'r', encoding='utf-8') as infile:
+        start_time = parse_start_time(infile.readline())
+
+        for (first_row, local_data, global_data, num_nodes) in iter_chunks(schema, infile, chunk_rows):
+            for node_idx in range(len(node_join_rows), num_nodes[-1]):
+                node_join_rows.append(
+                    first_row + int(np.searchsorted(num_nodes, node_idx, side='right')))
+
+            for metric in metrics:
+                if metric in schema.global_metrics:
+                    values = global_data[:, schema.global_metrics.index(metric)]
+                else:
+                    values = local_data[:, :, schema.local_metrics.index(metric)]
+                series[metric].update(first_row, values)
+
+    num_buckets = max((len(entry.sums) for entry in series.values()), default=0)
+    rows_per_bucket = max((entry.rows_per_bucket for entry in series.values()), default=1)
+    first_rows = np.arange(num_buckets) * rows_per_bucket
+
+    local_data = np.full((num_buckets, len(node_join_rows), len(schema.local_metrics)), np.nan)
+    global_data = np.full((num_buckets, len(schema.global_metrics)), np.nan)
+
+    for (metric, entry) in series.items():
+        means = entry.means()
+        if metric in schema.global_metrics:
+            global_data[:len(means), schema.global_metrics.index(metric)] = means[:, 0]
+        else:
+            local_data[:len(means), :means.shape[1], schema.local_metrics.index(metric)] = means
+
+    # A node counts as joined if it joined at any point during the bucket
+    last_rows = first_rows + rows_per_bucket - 1
+    node_counts = np.searchsorted(node_join_rows, last_rows, side='right')
+
+    return start_time, first_rows, local_data, global_data, node_counts
+
+def aggregate_rows(schema, local_data, global_data, num_nodes, metrics, per_node=True, window=None):
+    ''' Compute all aggregates for several metrics over a range of rows
+        (in the layout returned by load_metrics()).
+        window holds extra fields for every record, e.g., the start and end time. '''
+
+    joined = join_mask(num_nodes, local_data.shape[1])
+
+    # Per-node results only cover nodes that joined before the window ended
+    nodes_in_window = int(num_nodes[-1]) if len(num_nodes) > 0 else 0
+
+    results = []
+
+    for metric in metrics:
+        record = {'metric': metric, **(window or {})}
+
+        if metric in schema.global_metrics:
+            values = global_data[:, schema.global_metrics.index(metric)]
+            results.append({**record, 'node': 'all', 'count': len(values),
+                            **_aggregate(values)})
+            continue
+
+        metric_data = local_data[:, :, schema.local_metrics.index(metric)]
+        values = metric_data[joined]
+        results.append({**record, 'node': 'all', 'count': len(values),
+                        **_aggregate(values)})
+
+        if per_node:
+            for node_idx in range(nodes_in_window):
+                values = metric_data[joined[:, node_idx], node_idx]
+                results.append({**record, 'node': node_idx, 'count': len(values),
+                                **_aggregate(values)})
+
+    return results
+
+def extract_batch(schema, path, metrics, windows, per_node=True,
+                  report_frequency=DEFAULT_REPORT_FREQUENCY, use_sidecar=True):
+    ''' Compute all aggregates for several metrics and time windows at once.
+        Windows are (start_time, end_time) pairs in milliseconds since the epoch.
+        Returns one record for every metric and window covering the entire cluster,
+        plus one per node for local metrics if per_node is set. '''
+
+    for metric in metrics:
+        if metric not in schema:
+            raise RuntimeError(f"No such metric {metric}")
+
+    # The file is only opened (and parsed, if needed) once for all windows
+    if use_sidecar:
+        header, local_data, global_data = open_metrics(schema, path)
+        measure_start_time = header['start_time']
+        num_nodes = nodes_joined(header)
+    else:
+        measure_start_time, local_data, global_data, num_nodes = _parse_file(schema, path)
+
+    results = []
+
+    for (start_time, end_time) in windows:
+        first_row, end_row = row_range(measure_start_time, start_time, end_time,
+                                       report_frequency)
+        results += aggregate_rows(schema, local_data[first_row:end_row], global_data[first_row:end_row],
+                                  num_nodes[first_row:end_row], metrics, per_node,
+                                  {'start_time': start_time, 'end_time': end_time})
+
+    return results
+
+def write_results(results, outfile, fmt='csv'):
+    ''' Write the output of extract_batch() as CSV or JSON '''
+
+    if fmt == 'json':
+        json.dump(results, outfile, indent=2)
+        outfile.write('\n')
+    elif fmt == 'csv':
+        fields = ['metric', 'start_time', 'end_time', 'node', 'count'] + list(AGGREGATES)
+        writer = csv.DictWriter(outfile, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(results)
+    else:
+        raise RuntimeError(f"Unknown output format {fmt}")
+
+def load_spec(path):
+    ''' Load a batch specification, e.g.,
+        {"metrics": ["cpu-usage", "throughput"], "windows": [[start, end], ...], "per-node": true} '''
+
+    with open(path, 'r', encoding='utf-8') as infile:
+        spec = json.load(infile)
+
+    if 'metrics' not in spec or 'windows' not in spec:
+        raise RuntimeError(f"{path} needs to specify metrics and windows")
+
+    windows = [(int(start), int(end)) for (start, end) in spec['windows']]
+    return spec['metrics'], windows, spec.get('per-node', True)
+
+def _parse_window(window):
+    (start, end) = window.split(':')
+    return (int(start), int(end))
+
+def _main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', type=str)
+    parser.add_argument('metric', type=str, nargs='?')
+    parser.add_argument('start_time', type=int, nargs='?')
+    parser.add_argument('end_time', type=int, nargs='?')
+    parser.add_argument('--report-frequency', type=int, default=DEFAULT_REPORT_FREQUENCY)
+    parser.add_argument('--convert', action='store_true',
+        help="Only (re-)build the binary sidecar of the metrics file")
+    parser.add_argument('--no-sidecar', action='store_true',
+        help="Always parse the text file instead of using the binary sidecar")
+    parser.add_argument('--stream', action='store_true',
+        help="Stream over the file in chunks with bounded memory (implies --no-sidecar)")
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS,
+        help="Number of rows to parse at once in streaming mode")
+    parser.add_argument('--spec', type=str,
+        help="JSON file listing the metrics and windows to extract in batch")
+    parser.add_argument('--metrics', type=str,
+        help="Comma-separated list of metrics to extract in batch")
+    parser.add_argument('--windows', type=str,
+        help="Comma-separated list of start:end windows to extract in batch")
+    parser.add_argument('--no-per-node', action='store_true',
+        help="Only report cluster-wide aggregates in batch mode")
+    parser.add_argument('--format', type=str, choices=['csv', 'json'], default='csv')
+    parser.add_argument('--outfile', type=str,
+        help="Write batch results to this file instead of stdout")
+    args = parser.parse_args()
+
+    try:
+        schema = load_schema(args.path)
+    except RuntimeError as err:
+        sys.stderr.write(f"ERROR: {err}\n")
+        sys.exit(1)
+
+    if args.convert:
+        convert_metrics(schema, args.path)
+        return
+
+    if args.spec or args.metrics or args.windows:
+        if args.spec:
+            metrics, windows, per_node = load_spec(args.spec)
+        elif args.metrics and args.windows:
+            metrics = args.metrics.split(',')
+            windows = [_parse_window(window) for window in args.windows.split(',')]
+            per_node = True
+        else:
+            parser.error("batch mode needs either --spec or both --metrics and --windows")
+
+        if args.stream:
+            results = stream_batch(schema, args.path, metrics, windows,
+                                   per_node=per_node and not args.no_per_node,
+                                   report_frequency=args.report_frequency,
+                                   chunk_rows=args.chunk_rows)
+        else:
+            results = extract_batch(schema, args.path, metrics, windows,
+                                    per_node=per_node and not args.no_per_node,
+                                    report_frequency=args.report_frequency,
+                                    use_sidecar=not args.no_sidecar)
+
+        if args.outfile:
+            with open(args.outfile, 'w', encoding='utf-8', newline='') as outfile:
+                write_results(results, outfile, args.format)
+        else:
+            write_results(results, sys.stdout, args.format)
+        return
+
+    if args.end_time is None:
+        parser.error("metric, start_time, and end_time are required")
+
+    value = extract_metric(schema, args.path, args.metric, args.start_time, args.end_time,
+                           report_frequency=args.report_frequency,
+                           use_sidecar=not args.no_sidecar)
+    print(str(value))
+
+if __name__ == "__main__":
+    _main()
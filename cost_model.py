@@ -0,0 +1,183 @@
+#! /bin/env python3
+
+''' Fits a per-invocation cost model T(n) = a + b * n for every worker type.
+
+    n is the amount of work per function call (operations-per-object in the job-length
+    experiment), a the fixed overhead of a call, and b the marginal cost of every operation.
+    T is one of:
+
+      * cost: time per call at peak throughput, i.e., 1 / throughput (in microseconds),
+      * latency: mean latency of a call at peak throughput (in milliseconds),
+      * runtime: avg-job-runtime (as recorded by the benchmark).
+
+    Runs where the metric is zero were not measured (e.g., avg-job-runtime is only recorded
+    for LambdaStore) and are ignored. As n spans several orders of magnitude, the model is
+    fitted with weighted least squares on the relative error. Neither a nor b can be negative,
+    so the fit is constrained to non-negative values; a parameter that ends up at zero has
+    no standard error. '''
+
+import sys
+import argparse
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from results import load_results
+from peak_cube import peak_throughput
+
+COST_METRICS = {
+    'cost': ('us per call', lambda df: 1e6 / df['throughput']),
+    'latency': ('ms', lambda df: df['latency-mean']),
+    'runtime': ('as recorded', lambda df: df['avg-job-runtime']),
+}
+
+class CostModel:
+    ''' A fitted T(n) = a + b * n, with the standard errors of a and b '''
+
+    def __init__(self, fixed, marginal, fixed_error, marginal_error, work_range):
+        self.fixed = float(fixed)
+        self.marginal = float(marginal)
+        self.fixed_error = float(fixed_error)
+        self.marginal_error = float(marginal_error)
+        # Smallest and largest amount of work the model was fitted on
+        self.work_range = work_range
+
+    def predict(self, work):
+        ''' Expected cost of a call with the given amount of work '''
+        return self.fixed + self.marginal * np.asarray(work, dtype=np.float64)
+
+    def __repr__(self):
+        return (f"CostModel(fixed={self.fixed!r}, marginal={self.marginal!r}, "
+                f"fixed_error={self.fixed_error!r}, marginal_error={self.marginal_error!r}, "
+                f"work_range={self.work_range!r})")
+
+def _non_negative_lstsq(design, target):
+    ''' Least squares with non-negative coefficients.
+        The optimum is the unconstrained fit on some subset of the columns (with the others
+        at zero), so with two columns it is cheapest to try all subsets.
+        Returns the coefficients and the indices of those that are not fixed at zero. '''
+    best = None
+    for num_free in range(design.shape[1], -1, -1):
+        for free in itertools.combinations(range(design.shape[1]), num_free):
+            free = list(free)
+            coefficients = np.zeros(design.shape[1])
+            if free:
+                (coefficients[free], _, _, _) = np.linalg.lstsq(design[:, free], target, rcond=None)
+            if np.any(coefficients < 0):
+                continue
+            error = np.sum((target - design @ coefficients)**2)
+            if best is None or error < best[0]:
+                best = (error, coefficients, free)
+    return best[1], best[2]
+
+def fit_cost_model(work, cost):
+    ''' Fit T(n) = a + b * n, minimizing the relative error of every point '''
+    work = np.asarray(work, dtype=np.float64)
+    cost = np.asarray(cost, dtype=np.float64)
+    valid = np.isfinite(cost) & (cost > 0)
+    (work, cost) = (work[valid], cost[valid])
+
+    if len(np.unique(work)) < 2:
+        raise ValueError("Need at least two different amounts of work to fit a cost model")
+
+    design = np.column_stack([np.ones_like(work), work])
+    weights = 1.0 / cost
+    weighted = design * weights[:, None]
+    (coefficients, free) = _non_negative_lstsq(weighted, cost * weights)
+
+    # Standard errors from the residuals of the weighted fit (only defined with spare points)
+    errors = np.full(2, np.nan)
+    degrees_of_freedom = len(work) - len(free)
+    if free and degrees_of_freedom > 0:
+        residuals = (cost - design @ coefficients) * weights
+        variance = np.sum(residuals**2) / degrees_of_freedom
+        covariance = variance * np.linalg.inv(weighted[:, free].T @ weighted[:, free])
+        errors[free] = np.sqrt(np.diag(covariance))
+
+    return CostModel(coefficients[0], coefficients[1], errors[0], errors[1],
+                     (float(work.min()), float(work.max())))
+
+def fit_worker_types(df, metric='cost', work='operations-per-object', by='worker-type'):
+    ''' Fit a cost model for every worker type, using the run with the peak throughput
+        for every amount of work '''
+    (_, compute) = COST_METRICS[metric]
+    peaks = peak_throughput(df, [by, work])
+    peaks = peaks.assign(cost=compute(peaks))
+
+    models = {}
+    for (name, group) in peaks.groupby(by, sort=True):
+        try:
+            models[name] = fit_cost_model(group[work], group['cost'])
+        except ValueError:
+            continue
+    return models
+
+def crossover(first, second):
+    ''' Amount of work at which two cost models cost the same (None if they never do for n > 0) '''
+    if first.marginal == second.marginal:
+        return None
+    work = (second.fixed - first.fixed) / (first.marginal - second.marginal)
+    return work if work > 0 else None
+
+def crossovers(models):
+    ''' Get all crossover points between pairs of worker types, including which one is cheaper
+        below and above it, and whether it lies within the range both models were fitted on '''
+    records = []
+    for ((first_name, first), (second_name, second)) in itertools.combinations(models.items(), 2):
+        work = crossover(first, second)
+        if work is None:
+            continue
+        (below, above) = (first_name, second_name) if first.fixed < second.fixed \
+            else (second_name, first_name)
+        measured = max(first.work_range[0], second.work_range[0]) <= work \
+            <= min(first.work_range[1], second.work_range[1])
+        records.append({'first': first_name, 'second': second_name, 'crossover': work,
+                        'cheaper-below': below, 'cheaper-above': above, 'measured': measured})
+    return pd.DataFrame(records, columns=['first', 'second', 'crossover', 'cheaper-below',
+                                          'cheaper-above', 'measured'])
+
+def parameters(models, metric):
+    ''' The fitted parameters of all models as a DataFrame '''
+    (unit, _) = COST_METRICS[metric]
+    return pd.DataFrame([{'worker-type': name, 'fixed': model.fixed, 'fixed-stderr': model.fixed_error,
+                          'marginal': model.marginal, 'marginal-stderr': model.marginal_error,
+                          'min-work': model.work_range[0], 'max-work': model.work_range[1],
+                          'unit': unit}
+                         for (name, model) in models.items()])
+
+def _main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('infile', type=str, nargs='?', default='job-length/results.csv')
+    parser.add_argument('--metric', choices=list(COST_METRICS), default='cost',
+        help="What a call costs: time per call at peak throughput, mean latency, or avg-job-runtime")
+    parser.add_argument('--work', type=str, default='operations-per-object',
+        help="Column with the amount of work per call")
+    parser.add_argument('--outfile', type=str,
+        help="Write the fitted parameters to this CSV file")
+    parser.add_argument('--crossover-outfile', type=str,
+        help="Write the crossover points to this CSV file")
+    args = parser.parse_args()
+
+    df = load_results(args.infile)
+    if args.work not in df:
+        sys.stderr.write(f"ERROR: {args.infile} has no column {args.work}\n")
+        sys.exit(1)
+
+    models = fit_worker_types(df, args.metric, args.work)
+    params = parameters(models, args.metric)
+    points = crossovers(models)
+
+    if args.outfile:
+        params.to_csv(args.outfile, index=False)
+    if args.crossover_outfile:
+        points.to_csv(args.crossover_outfile, index=False)
+
+    if not args.outfile and not args.crossover_outfile:
+        print(f"T(n) = fixed + marginal * n, where n is {args.work}\n")
+        print(params.to_string(index=False))
+        print("\nCrossover points (n at which two worker types cost the same):\n")
+        print(points.to_string(index=False))
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,337 @@
+#! /bin/env python3
+
+''' Serves a live dashboard of a metrics file on localhost.
+    Every client only receives the rows that were appended since its last poll '''
+
+# pylint: disable=invalid-name
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import numpy as np
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+from cluster_metrics import DEFAULT_REPORT_FREQUENCY, load_schema
+from live_metrics import MetricsTail, DEFAULT_WINDOW
+
+# Shown by default (if the metrics file has them)
+DASHBOARD_METRICS = [
+    'throughput', 'cpu-usage', 'ready-jobs', 'blocked-jobs',
+    'num-light-replicas', 'num-full-replicas', 'coord-cpu-usage',
+]
+
+DEFAULT_PORT = 8050
+
+# How long a poll waits for new rows before returning an empty delta (in seconds)
+POLL_TIMEOUT = 1.0
+
+# Number of decimals sent to clients
+PRECISION = 3
+
+PAGE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Cluster Metrics</title>
+<style>
+  body { font-family: sans-serif; margin: 1em; }
+  #charts { display: grid; grid-template-columns: repeat(auto-fill, minmax(480px, 1fr)); gap: 1em; }
+  .chart h3 { margin: 0 0 0.2em 0; font-size: 1em; }
+  canvas { width: 100%; height: 200px; border: 1px solid #ccc; }
+</style>
+</head>
+<body>
+<h2>Cluster Metrics <small id="status"></small></h2>
+<div id="charts"></div>
+<script>
+const COLORS = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd',
+                '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf'];
+let meta = null, state = null, dirty = false;
+
+function reset() {
+  state = {generation: -1, cursor: 0, rows: [], series: {}};
+  for (const metric of meta.metrics) state.series[metric] = [];
+}
+
+function append(delta) {
+  if (delta.generation !== state.generation || delta.reset) {
+    const generation = delta.generation;
+    reset();
+    state.generation = generation;
+  }
+  state.rows.push(...delta.rows);
+  for (const metric of meta.metrics) state.series[metric].push(...delta.values[metric]);
+
+  // Only keep as much history as the server does
+  const excess = state.rows.length - meta.capacity;
+  if (excess > 0) {
+    state.rows.splice(0, excess);
+    for (const metric of meta.metrics) state.series[metric].splice(0, excess);
+  }
+  state.cursor = delta.end;
+  dirty = dirty || delta.rows.length > 0 || delta.error !== state.error;
+  state.error = delta.error;
+}
+
+function draw(metric) {
+  const canvas = document.getElementById('chart-' + metric);
+  const width = canvas.width = canvas.clientWidth * devicePixelRatio;
+  const height = canvas.height = canvas.clientHeight * devicePixelRatio;
+  const context = canvas.getContext('2d');
+  const rows = state.rows, values = state.series[metric];
+  if (rows.length < 2) return;
+
+  // Local metrics have one value per node and row, global ones a single value
+  const local = meta.local.includes(metric);
+  const numLines = local ? Math.max(...values.map(row => row.length)) : 1;
+  let max = 0;
+  for (const row of values) for (const value of (local ? row : [row])) if (value !== null) max = Math.max(max, value);
+  max = max || 1;
+
+  const x = index => (rows[index] - rows[0]) / (rows[rows.length - 1] - rows[0]) * (width - 60) + 50;
+  const y = value => height - 20 - value / max * (height - 30);
+
+  context.fillStyle = '#000';
+  context.font = (10 * devicePixelRatio) + 'px sans-serif';
+  context.fillText(max.toPrecision(3), 2, 12 * devicePixelRatio);
+  context.fillText('0', 2, height - 20);
+  const seconds = index => (rows[index] * meta.report_frequency / 1000).toFixed(1) + 's';
+  context.fillText(seconds(0), 50, height - 4);
+  context.fillText(seconds(rows.length - 1), width - 60, height - 4);
+
+  context.lineWidth = devicePixelRatio;
+  for (let line = 0; line < numLines; line++) {
+    context.strokeStyle = COLORS[line % COLORS.length];
+    context.beginPath();
+    let drawing = false;
+    for (let index = 0; index < rows.length; index++) {
+      const value = local ? values[index][line] : values[index];
+      if (value === null || value === undefined) { drawing = false; continue; }
+      if (drawing) context.lineTo(x(index), y(value)); else context.moveTo(x(index), y(value));
+      drawing = true;
+    }
+    context.stroke();
+  }
+}
+
+function render() {
+  if (dirty) {
+    dirty = false;
+    for (const metric of meta.metrics) draw(metric);
+    const nodes = state.series[meta.local[0]];
+    const last = nodes && nodes.length ? nodes[nodes.length - 1].length : 0;
+    const status = document.getElementById('status');
+    status.textContent = '(' + last + ' nodes, ' + (state.cursor * meta.report_frequency / 1000).toFixed(1) + 's)'
+      + (state.error ? ' ERROR: ' + state.error : '');
+    status.style.color = state.error ? '#d62728' : '';
+  }
+  requestAnimationFrame(render);
+}
+
+async function poll() {
+  while (true) {
+    try {
+      const response = await fetch('data?since=' + state.cursor + '&generation=' + state.generation);
+      if (!response.ok) throw new Error(response.statusText);
+      append(await response.json());
+    } catch (err) {
+      document.getElementById('status').textContent = '(disconnected)';
+      await new Promise(resolve => setTimeout(resolve, 1000));
+    }
+  }
+}
+
+async function main() {
+  meta = await (await fetch('meta')).json();
+  const charts = document.getElementById('charts');
+  for (const metric of meta.metrics) {
+    charts.insertAdjacentHTML('beforeend',
+      '<div class="chart"><h3>' + metric + '</h3><canvas id="chart-' + metric + '"></canvas></div>');
+  }
+  reset();
+  requestAnimationFrame(render);
+  poll();
+}
+
+main();
+</script>
+</body>
+</html>
+'''
+
+def _encode(values):
+    ''' Convert an array into nested lists for JSON, with NaN as null '''
+    values = np.round(values.astype(np.float64), PRECISION)
+    return np.where(np.isnan(values), None, values).tolist()
+
+class Dashboard:
+    ''' Follows a metrics file in the background and serves deltas of it '''
+
+    def __init__(self, schema, path, metrics, window=DEFAULT_WINDOW,
+                 report_frequency=DEFAULT_REPORT_FREQUENCY, interval=None):
+        self.schema = schema
+        self.tail = MetricsTail(schema, path, window, report_frequency)
+        self.metrics = metrics
+        # Check for new rows about as often as the benchmark reports them
+        self.interval = interval or report_frequency / 1000
+        self.condition = threading.Condition()
+        # Changes whenever the tail starts over, so that clients know to drop what they have
+        self.generation = 0
+        self.buffer = self.tail.buffer
+        # Why the last poll failed (None if it did not), shown to clients until a poll succeeds
+        self.error = None
+
+    def run(self):
+        ''' Poll the file forever (meant to run in a background thread) '''
+        while True:
+            with self.condition:
+                error = None
+                try:
+                    new_rows = self.tail.poll()
+                except RuntimeError as err:
+                    (error, new_rows) = (str(err), 0)
+                    if error != self.error:
+                        sys.stderr.write(f"ERROR: {err}\n")
+                if self.tail.buffer is not self.buffer:
+                    self.buffer = self.tail.buffer
+                    self.generation += 1
+                if new_rows > 0 or error != self.error:
+                    self.error = error
+                    self.condition.notify_all()
+            time.sleep(self.interval)
+
+    def meta(self):
+        ''' Describe what the dashboard shows '''
+        return {
+            'metrics': self.metrics,
+            'local': [metric for metric in self.metrics if metric in self.schema.local_metrics],
+            'report_frequency': self.tail.report_frequency,
+            'capacity': self.tail.capacity,
+        }
+
+    def delta(self, since, generation, timeout=POLL_TIMEOUT):
+        ''' Get all rows starting at row since, waiting up to timeout seconds for there to be any
+            (or for the error of the last poll to change) '''
+        with self.condition:
+            reset = generation != self.generation or since > self.tail.num_rows
+            if reset:
+                since = 0
+            else:
+                error = self.error
+                self.condition.wait_for(lambda: self.tail.num_rows > since or self.generation != generation
+                                        or self.error != error, timeout)
+                if self.generation != generation:
+                    (reset, since) = (True, 0)
+            (_, rows, local_data, global_data, num_nodes) = self.tail.snapshot(since)
+            error = self.error
+
+        values = {}
+        for metric in self.metrics:
+            if metric in self.schema.local_metrics:
+                # Only send nodes that had joined
+                metric_data = local_data[:, :int(num_nodes[-1]) if len(rows) > 0 else 0,
+                                         self.schema.local_metrics.index(metric)]
+                values[metric] = _encode(metric_data)
+            else:
+                values[metric] = _encode(global_data[:, self.schema.global_metrics.index(metric)])
+
+        return {
+            'generation': self.generation,
+            'reset': reset,
+            'rows': rows.tolist(),
+            'end': int(rows[-1]) + 1 if len(rows) > 0 else since,
+            'values': values,
+            'error': error,
+        }
+
+class _Handler(BaseHTTPRequestHandler):
+    dashboard = None
+
+    def _send(self, body, content_type):
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        ''' Serve the page, its metadata, or a delta '''
+        url = urlparse(self.path)
+
+        if url.path in ['/', '/index.html']:
+            self._send(PAGE, 'text/html; charset=utf-8')
+        elif url.path == '/meta':
+            self._send(json.dumps(self.dashboard.meta()), 'application/json')
+        elif url.path == '/data':
+            query = parse_qs(url.query)
+            (since, generation) = (query.get('since', ['0'])[0], query.get('generation', ['-1'])[0])
+            if not since.isdigit() or not generation.lstrip('-').isdigit():
+                self.send_error(400, "since and generation must be integers")
+                return
+            self._send(json.dumps(self.dashboard.delta(int(since), int(generation))), 'application/json')
+        else:
+            self.send_error(404)
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        # Clients poll several times a second
+        pass
+
+def _main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', type=str)
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--metrics', type=str,
+        help="Comma-separated list of metrics to show (defaults to DASHBOARD_METRICS)")
+    parser.add_argument('--window-minutes', type=float, default=DEFAULT_WINDOW / 60000,
+        help="How much history to keep and show")
+    parser.add_argument('--report-frequency', type=int, default=DEFAULT_REPORT_FREQUENCY)
+    parser.add_argument('--interval', type=float,
+        help="Seconds between checks for new rows (defaults to the report frequency)")
+    args = parser.parse_args()
+
+    if os.path.isdir(args.path):
+        args.path = os.path.join(args.path, 'cluster-metrics.csv')
+
+    try:
+        schema = load_schema(args.path)
+    except RuntimeError as err:
+        sys.stderr.write(f"ERROR: {err}\n")
+        sys.exit(1)
+
+    if args.metrics is None:
+        metrics = [metric for metric in DASHBOARD_METRICS if metric in schema]
+    else:
+        metrics = []
+        for metric in args.metrics.split(','):
+            if metric in schema:
+                metrics.append(metric)
+            else:
+                print(f"WARN: No such metric '{metric}'")
+
+    if not metrics:
+        sys.stderr.write("ERROR: need at least one metric\n")
+        sys.exit(1)
+
+    dashboard = Dashboard(schema, args.path, metrics, int(args.window_minutes * 60000),
+                          args.report_frequency, args.interval)
+    threading.Thread(target=dashboard.run, daemon=True).start()
+
+    _Handler.dashboard = dashboard
+    server = ThreadingHTTPServer((args.host, args.port), _Handler)
+    server.daemon_threads = True
+
+    print(f"Serving dashboard of {args.path} on http://{args.host}:{args.port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    _main()
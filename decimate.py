@@ -0,0 +1,100 @@
+''' Reduce long time series to roughly the resolution of a figure before plotting '''
+
+import numpy as np
+
+DECIMATION_METHODS = ['lttb', 'minmax', 'mean']
+
+def _bucket_bounds(length, num_buckets):
+    return np.linspace(0, length, num_buckets + 1).astype(int)
+
+def _padded_buckets(values, num_buckets, fill):
+    ''' Reshape values into (bucket x position) with padding, so that buckets can be
+        reduced in a vectorized way '''
+    bounds = _bucket_bounds(len(values), num_buckets)
+    sizes = np.diff(bounds)
+    width = sizes.max()
+
+    out = np.full((num_buckets, width), fill, dtype=np.float64)
+    positions = np.arange(width) < sizes[:, None]
+    out[positions] = values
+    return out, bounds
+
+def decimate_minmax(times, values, max_points):
+    ''' Keep the minimum and maximum of every bucket (in time order),
+        so that spikes and dips stay visible '''
+    num_buckets = max(max_points // 2, 1)
+
+    low, bounds = _padded_buckets(np.where(np.isnan(values), np.inf, values), num_buckets, np.inf)
+    high, _ = _padded_buckets(np.where(np.isnan(values), -np.inf, values), num_buckets, -np.inf)
+
+    first = bounds[:-1] + np.argmin(low, axis=1)
+    second = bounds[:-1] + np.argmax(high, axis=1)
+    indices = np.sort(np.stack([first, second], axis=1), axis=1).ravel()
+
+    return times[indices], values[indices]
+
+def decimate_mean(times, values, max_points):
+    ''' Replace every bucket by its mean. Smooths out spikes.
+        values may also be a (time x node) matrix, which is binned along time. '''
+    num_buckets = max(max_points, 1)
+    bounds = _bucket_bounds(len(values), num_buckets)
+    valid = ~np.isnan(values)
+
+    counts = np.add.reduceat(valid, bounds[:-1])
+    sums = np.add.reduceat(np.where(valid, values, 0.0), bounds[:-1])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+    return np.add.reduceat(times, bounds[:-1]) / np.diff(bounds), means
+
+def decimate_lttb(times, values, max_points):
+    ''' Largest-Triangle-Three-Buckets (Steinarsson, 2013).
+        Keeps the first and last point and, for every bucket in between, the point
+        that forms the largest triangle with its neighbours. '''
+    if max_points < 3:
+        return decimate_minmax(times, values, max_points)
+
+    bounds = _bucket_bounds(len(values) - 2, max_points - 2) + 1
+    indices = np.empty(max_points, dtype=int)
+    indices[0] = 0
+    indices[-1] = len(values) - 1
+
+    prev = 0
+    for bucket in range(max_points - 2):
+        start, end = bounds[bucket], bounds[bucket + 1]
+
+        # Average of the next bucket (or the last point)
+        if bucket + 2 < len(bounds):
+            next_start, next_end = bounds[bucket + 1], bounds[bucket + 2]
+        else:
+            next_start, next_end = len(values) - 1, len(values)
+        next_time = np.mean(times[next_start:next_end])
+        next_value = np.nanmean(values[next_start:next_end]) \
+            if np.any(~np.isnan(values[next_start:next_end])) else values[prev]
+
+        areas = np.abs((times[prev] - next_time) * (values[start:end] - values[prev])
+                       - (times[prev] - times[start:end]) * (next_value - values[prev]))
+        if np.all(np.isnan(areas)):
+            prev = start
+        else:
+            prev = start + int(np.nanargmax(areas))
+        indices[bucket + 1] = prev
+
+    return times[indices], values[indices]
+
+def decimate(times, values, max_points, method='minmax'):
+    ''' Reduce a series to at most max_points points using the given method '''
+    times = np.asarray(times)
+    values = np.asarray(values, dtype=np.float64)
+
+    if len(values) <= max_points:
+        return times, values
+
+    if method == 'lttb':
+        return decimate_lttb(times, values, max_points)
+    if method == 'minmax':
+        return decimate_minmax(times, values, max_points)
+    if method == 'mean':
+        return decimate_mean(times, values, max_points)
+
+    raise RuntimeError(f"Unknown decimation method {method}")
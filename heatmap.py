@@ -0,0 +1,37 @@
+''' Draw the (time x node) matrix of a local metric as a heatmap '''
+
+import numpy as np
+from matplotlib.colors import LogNorm
+from matplotlib.ticker import MaxNLocator
+
+from decimate import decimate
+
+def bin_matrix(times, values, max_points, max_nodes):
+    ''' Average a (time x node) matrix down to at most max_points points in time and max_nodes nodes.
+        NaN entries (e.g., nodes that had not joined yet) are ignored.
+        Returns the binned (node x time) matrix. '''
+    _, binned = decimate(times, values, max_points, 'mean')
+    _, binned = decimate(np.arange(values.shape[1]), binned.T, max_nodes, 'mean')
+    return binned
+
+def draw_heatmap(axis, times, values, max_points, max_nodes, log_scale=False, **kwargs):
+    ''' Draw a (time x node) matrix as a single raster with about one cell per pixel
+        (at most max_points columns and max_nodes rows), so that size and render time
+        do not depend on the length of the run or the number of nodes.
+        NaN entries (e.g., nodes that had not joined yet) are left blank. So are values that are
+        not positive on a log scale, which falls back to a linear one if no value is positive.
+        Returns the image, e.g., to add a colorbar. '''
+    binned = np.ma.masked_invalid(bin_matrix(times, values, max_points, max_nodes))
+
+    norm = None
+    if log_scale:
+        positive = np.ma.masked_less_equal(binned, 0.0)
+        if positive.count() > 0:
+            (binned, norm) = (positive, LogNorm())
+
+    end_time = times[-1] if len(times) > 1 else times[0] + 1
+    image = axis.imshow(binned, aspect='auto', interpolation='nearest', norm=norm,
+                        extent=(times[0], end_time, values.shape[1] - 0.5, -0.5), **kwargs)
+    # Label a few nodes only, so that the labels stay readable with many nodes
+    axis.yaxis.set_major_locator(MaxNLocator(integer=True))
+    return image
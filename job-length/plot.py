@@ -2,7 +2,7 @@
 
 # pylint: disable=line-too-long,missing-docstring
 
-import pandas as pd
+import sys
 import numpy as np
 import matplotlib.pyplot as plt
 
@@ -11,6 +11,10 @@ from seaborn import lineplot
 
 from matplotlib.font_manager import FontProperties, fontManager
 
+# Shared helpers live in the top-level directory
+sys.path.append('..')
+from peak_cube import load_peaks, peak_throughput # pylint: disable=wrong-import-position
+
 FONT_PATH = '../LinLibertine_Rah.ttf'
 fontManager.addfont(FONT_PATH)
 
@@ -22,10 +26,8 @@ plt.rcParams.update({
     'figure.figsize': (7,4)
 })
 
-df = pd.read_csv('results.csv', header=0, comment='#', skipinitialspace=True)
-
+df = peak_throughput(load_peaks(['results.csv']), ["operations-per-object", "worker-type"])
 df["throughput"] = df["throughput"] * df["operations-per-object"]
-df = df.groupby(["operations-per-object", "worker-type"])['throughput'].max().reset_index()
 
 df["worker-type"] = np.where((df["worker-type"] == "lambdastore"), "LambdaStore", df["worker-type"])
 df["worker-type"] = np.where((df["worker-type"] == "ol-sock"), "OpenLambda\n(SOCK)", df["worker-type"])
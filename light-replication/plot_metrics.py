@@ -4,15 +4,23 @@
 
 # pylint: disable=too-many-locals,too-many-statements,too-many-branches,fixme
 
-from sys import stderr
 import os
-import copy
 import sys
+import copy
 import argparse
+import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.font_manager import FontProperties, fontManager
 
-from extract_metrics import parse_start_time
+from extract_metrics import SCHEMA, LOCAL_METRICS, GLOBAL_METRICS
+
+sys.path.append('..')
+
+# pylint: disable=wrong-import-position
+from cluster_metrics import DEFAULT_CHUNK_ROWS, load_metrics, stream_metrics, join_mask
+from decimate import DECIMATION_METHODS, decimate
+from heatmap import draw_heatmap
+from live_metrics import MetricsTail, DEFAULT_WINDOW, DEFAULT_INTERVAL
 
 def _main():
     font_path = '../LinLibertine_Rah.ttf'
@@ -34,6 +42,26 @@ def _main():
     parser.add_argument('--outfile', type=str, default='cluster-metrics.pdf')
     parser.add_argument('--height', type=float, default=6)
     parser.add_argument('--width', type=float, default=3)
+    parser.add_argument('--zero-fill', action='store_true',
+        help="Show nodes as zero before they joined instead of leaving a gap")
+    parser.add_argument('--stream', action='store_true',
+        help="Stream over the file in chunks and plot a downsampled version (bounded memory)")
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS,
+        help="Number of rows to parse at once in streaming mode")
+    parser.add_argument('--decimate', type=str, choices=DECIMATION_METHODS,
+        help="Reduce each series before plotting (mean smooths out spikes)")
+    parser.add_argument('--max-points', type=int,
+        help="Maximum number of points per series (defaults to the figure width in pixels)")
+    parser.add_argument('--heatmap', action='store_true',
+        help="Draw the throughput of every node as a (node x time) heatmap instead of the total throughput")
+    parser.add_argument('--follow', action='store_true',
+        help="Keep reading the file while it is written and redraw the output whenever it grows")
+    parser.add_argument('--window-minutes', type=float, default=DEFAULT_WINDOW / 60000,
+        help="How much history to keep and plot in follow mode")
+    parser.add_argument('--refresh', type=float, default=DEFAULT_INTERVAL,
+        help="Seconds between checks for new rows in follow mode")
+    parser.add_argument('--follow-timeout', type=float,
+        help="Stop following once the file has not grown for this many seconds")
     args = parser.parse_args()
 
     plt.rcParams.update({'font.size': args.font_size})
@@ -56,15 +84,8 @@ def _main():
         'num-shards': 'Number of Shards',
     }
 
-    all_local_metrics = [
-        'cpu-usage', 'compute-utilization', 'active-transactions', 'running-jobs', 'blocked-jobs',
-        'ready-jobs', 'num-objects', 'throughput', 'abort-rate', 'job-runtime',
-    ]
-
-    all_global_metrics = [
-        'total-job-runtime', 'total-throughput', 'num-full-replicas',
-        'num-light-replicas', 'num-shards'
-    ]
+    all_local_metrics = LOCAL_METRICS
+    all_global_metrics = GLOBAL_METRICS
 
     all_metrics = all_local_metrics + all_global_metrics
 
@@ -97,7 +118,6 @@ def _main():
     for key in keys:
         print(f"WARN: No such metric '{key}'")
 
-    num_global_metrics = len(all_global_metrics)
     num_local_metrics = len(all_local_metrics)
     num_metrics = len(labels)
 
@@ -107,151 +127,172 @@ def _main():
     # if args.one_plot and num_metrics != 2:
     #     raise RuntimeError("one-plot needs exactly two metrics")
 
-    times = []
-    data = [[] for _ in range(num_metrics)]
-
     if os.path.isdir(args.path):
         path = args.path + '/cluster-metrics.csv'
         print(f'Path is a directory. Trying "{path}" instead.')
     else:
         path = args.path
 
-    with open(path, 'r', encoding='utf-8') as infile:
-        for (line_no, line) in enumerate(infile.readlines()):
-            if line_no == 0:
-                parse_start_time(line)
-                continue
-
-            line = line.replace('\n', '')
-            times.append((line_no-1) * args.report_frequency * 0.001)
-            entries = [float(v) for v in line.split(',')]
-
-            if len(entries) == 0 or (len(entries)-num_global_metrics) % num_local_metrics != 0:
-                stderr.write(f"Line #{line_no} is invalid: {line}\n")
-                sys.exit(1)
-
-            num_nodes = int((len(entries)-num_global_metrics) / num_local_metrics)
+    def render(_start_time, rows, local_data, global_data, node_counts):
+        num_nodes = local_data.shape[1]
+        joined = join_mask(node_counts, num_nodes)
+        times = rows * args.report_frequency * 0.001
 
-            data_points = [[] for _ in range(local_metric_count)]
-
-            for node_idx in range(num_nodes):
-                metric_idx = 0
-                for total_metric_idx in range(num_local_metrics):
-                    if metric_filter[total_metric_idx]:
-                        pos = node_idx * num_local_metrics + total_metric_idx
-                        data_points[metric_idx].append(entries[pos])
-                        metric_idx += 1
-
-            for metric_idx, data_point in enumerate(data_points):
-                data[metric_idx].append(data_point)
-
-            metric_idx = len(data_points)
-            for global_idx in range(num_global_metrics):
-                total_metric_idx = num_local_metrics + global_idx
-                if metric_filter[total_metric_idx]:
-                    pos = num_nodes * num_local_metrics + global_idx
-                    data[metric_idx].append(entries[pos])
-                    metric_idx += 1
+        # Local metrics come first, followed by global metrics
+        data = []
+        for (total_metric_idx, used) in enumerate(metric_filter):
+            if not used:
+                continue
+            if total_metric_idx < num_local_metrics:
+                if args.zero_fill:
+                    data.append(np.where(joined, local_data[:, :, total_metric_idx], 0.0))
+                else:
+                    data.append(local_data[:, :, total_metric_idx])
+            else:
+                data.append(global_data[:, total_metric_idx - num_local_metrics])
+
+        # The heatmap shows how the total throughput is spread across nodes
+        node_throughput = local_data[:, :, LOCAL_METRICS.index('throughput')]
+
+        if len(times) == 0:
+            print("ERROR: No data found")
+            return
+
+        node_labels = []
+        for node_idx in range(num_nodes):
+            node_labels.append(f"Node #{node_idx}")
+
+        if args.one_plot:
+            _fig, axis = plt.subplots(1, 1, figsize=(args.width, args.height))
+            axes = [axis, axis.twinx()]
+        else:
+            _fig, axes = plt.subplots(num_metrics, 1, figsize=(args.width, args.height))
+            if num_metrics == 1:
+                axes = [axes]
+
+        if args.start_at:
+            # remove data until we are at the start point
+            first = np.searchsorted(times, args.start_at, side='left')
+            times = times[first:]
+            data = [metric[first:] for metric in data]
+            node_throughput = node_throughput[first:]
+
+        if args.end_at:
+            last = np.searchsorted(times, args.end_at, side='right')
+            times = times[:last]
+            data = [metric[:last] for metric in data]
+            node_throughput = node_throughput[:last]
+
+        times = times - args.start_at
+
+        num_replicas_metrics = [idx for (idx, metric_name) in enumerate(metrics) if metric_name in ['num-full-replicas', 'num-light-replicas']]
+        total_replicas = sum(data[metric_idx] for metric_idx in num_replicas_metrics)
+
+        # Only plot about as many points as the figure has pixels (if requested)
+        method = args.decimate or ('minmax' if args.max_points else None)
+        max_points = args.max_points or int(args.width * plt.rcParams['figure.dpi'])
+
+        def series(values):
+            if method is None:
+                return times, values
+            return decimate(times, values, max_points, method)
+
+        if args.heatmap:
+            # About one cell per pixel (nodes that had not joined are left blank)
+            max_nodes = int(args.height * plt.rcParams['figure.dpi'])
+            image = draw_heatmap(axes[0], times, node_throughput / 1000, max_points, max_nodes)
+            # Keep the colorbar clear of the ticks of the replica axis on the right
+            colorbar = plt.colorbar(image, cax=axes[0].inset_axes([1.25, 0.0, 0.03, 1.0]))
+            colorbar.set_label("Throughput (ktps)")
+        else:
+            axes[0].plot(*series(data[0] / 1000), linewidth=args.linewidth)
+        axes[1].plot(*series(data[2]), linewidth=args.linewidth, color='green', linestyle='-.', label="Light Replicas")
+        axes[1].plot(*series(total_replicas), linewidth=args.linewidth, color='red', linestyle='--', label="Total Replicas")
 
-    if len(times) == 0:
-        print("ERROR: No data found")
+        if args.heatmap:
+            axes[0].set(ylim=(num_nodes - 0.5, -0.5))
+            axes[0].set_ylabel("Node")
+        else:
+            axes[0].set(ylim=(0, 1.75))
+            axes[0].set_ylabel("Throughput (ktps)")
+        axes[1].set(ylim=(0, None), yticks=[0,2,4,6,8])
+        axes[1].set_ylabel("Num. Replicas")
+        axes[1].set(xlim=(min(times), max(times)))
+        axes[0].set_xlabel("Time (s)")
+        axes[1].legend(frameon=False, loc='lower center', bbox_to_anchor=(0.5, 0.9), ncol=2)
+
+        # for (metric_idx, metric_name) in enumerate(metrics):
+        #     # axis = axes[metric_idx]
+        #     # if metric_name in :
+        #     #     axis = axes[1]
+        #     # else:
+        #     #     axis = axes[0]
+
+        #     if metric_name in all_global_metrics:
+        #         # this is a global metric
+        #         if metric_idx > 0 and args.one_plot:
+        #             axis.plot(times, data[metric_idx], linewidth=args.linewidth, color='red', linestyle='--')
+        #         else:
+        #             axis.plot(times, data[metric_idx], linewidth=args.linewidth)
+        #     else:
+        #         # this is a per node metric
+        #         assert len(times) == len(data[metric_idx])
+        #         per_node = [[] for _ in range(num_nodes)]
+        #         for data_point in data[metric_idx]:
+        #             idx = 0
+        #             for val in data_point:
+        #                 per_node[idx].append(val)
+        #                 idx += 1
+
+        #             while idx < num_nodes:
+        #                 per_node[idx].append(0.0)
+        #                 idx += 1
+
+        #         for (node_idx, node_data) in enumerate(per_node):
+        #             axis.plot(times, node_data, label=node_labels[node_idx],\
+        #                     linewidth=args.linewidth)
+
+        #         axis.legend()
+
+        #     if metric_name in ["job-runtime", "num-objects"]:
+        #         # show runtime in log scale (first instance spawn takes long)
+        #         axis.set_yscale("log")
+
+        #     if metric_idx+1 == len(metrics) or args.one_plot:
+        #         # only label x axis once
+        #         axis.set_xlabel("Time (s)")
+        #     elif not args.one_plot:
+        #         xax = axis.get_xaxis()
+        #         xax.set_visible(False)
+
+        #     if args.one_plot and metric_idx == 1:
+        #         axis.get_yaxis().set_ticks([0,1,2,3,4,5])
+
+
+        plt.tight_layout()
+
+        print(f'Writing output to {args.outfile}')
+        plt.savefig(args.outfile)
+
+    if args.follow:
+        tail = MetricsTail(SCHEMA, path, int(args.window_minutes * 60000), args.report_frequency)
+        try:
+            # Redraw the output whenever new rows were appended
+            for _ in tail.follow(args.refresh, args.follow_timeout):
+                plt.close('all')
+                render(*tail.snapshot())
+        except KeyboardInterrupt:
+            pass
         return
 
-    node_labels = []
-    for node_idx in range(num_nodes):
-        node_labels.append(f"Node #{node_idx}")
-
-    if args.one_plot:
-        _fig, axis = plt.subplots(1, 1, figsize=(args.width, args.height))
-        axes = [axis, axis.twinx()]
+    if args.stream:
+        _start_time, rows, local_data, global_data, node_counts = stream_metrics(
+            SCHEMA, path, metrics, chunk_rows=args.chunk_rows)
     else:
-        _fig, axes = plt.subplots(num_metrics, 1, figsize=(args.width, args.height))
-        if num_metrics == 1:
-            axes = [axes]
-
-    if args.start_at:
-        # remove data until we are at the start point
-        while len(times) > 0 and times[0] < args.start_at:
-            times.pop(0)
-            for metric in data:
-                metric.pop(0)
-
-    if args.end_at:
-        while len(times) > 0 and times[-1] > args.end_at:
-            times.pop()
-            for metric in data:
-                metric.pop()
-
-    for idx in range(len(times)):
-        times[idx]  -= args.start_at
-
-    num_replicas_metrics = [idx for (idx, metric_name) in enumerate(metrics) if metric_name in ['num-full-replicas', 'num-light-replicas']]
-    total_replicas = [sum([data[metric_idx][i] for metric_idx in num_replicas_metrics]) for i in range(len(data[0]))]
-
-    axes[0].plot(times, [data_point / 1000 for data_point in data[0]], linewidth=args.linewidth)
-    axes[1].plot(times, data[2], linewidth=args.linewidth, color='green', linestyle='-.', label="Light Replicas")
-    axes[1].plot(times, total_replicas, linewidth=args.linewidth, color='red', linestyle='--', label="Total Replicas")
-
-    axes[0].set(ylim=(0, 1.75))
-    axes[0].set_ylabel("Throughput (ktps)")
-    axes[1].set(ylim=(0, None), yticks=[0,2,4,6,8])
-    axes[1].set_ylabel("Num. Replicas")
-    axes[1].set(xlim=(min(times), max(times)))
-    axes[0].set_xlabel("Time (s)")
-    axes[1].legend(frameon=False, loc='lower center', bbox_to_anchor=(0.5, 0.9), ncol=2)
-
-    # for (metric_idx, metric_name) in enumerate(metrics):
-    #     # axis = axes[metric_idx]
-    #     # if metric_name in :
-    #     #     axis = axes[1]
-    #     # else:
-    #     #     axis = axes[0]
-
-    #     if metric_name in all_global_metrics:
-    #         # this is a global metric
-    #         if metric_idx > 0 and args.one_plot:
-    #             axis.plot(times, data[metric_idx], linewidth=args.linewidth, color='red', linestyle='--')
-    #         else:
-    #             axis.plot(times, data[metric_idx], linewidth=args.linewidth)
-    #     else:
-    #         # this is a per node metric
-    #         assert len(times) == len(data[metric_idx])
-    #         per_node = [[] for _ in range(num_nodes)]
-    #         for data_point in data[metric_idx]:
-    #             idx = 0
-    #             for val in data_point:
-    #                 per_node[idx].append(val)
-    #                 idx += 1
-
-    #             while idx < num_nodes:
-    #                 per_node[idx].append(0.0)
-    #                 idx += 1
-
-    #         for (node_idx, node_data) in enumerate(per_node):
-    #             axis.plot(times, node_data, label=node_labels[node_idx],\
-    #                     linewidth=args.linewidth)
-
-    #         axis.legend()
-
-    #     if metric_name in ["job-runtime", "num-objects"]:
-    #         # show runtime in log scale (first instance spawn takes long)
-    #         axis.set_yscale("log")
-
-    #     if metric_idx+1 == len(metrics) or args.one_plot:
-    #         # only label x axis once
-    #         axis.set_xlabel("Time (s)")
-    #     elif not args.one_plot:
-    #         xax = axis.get_xaxis()
-    #         xax.set_visible(False)
-
-    #     if args.one_plot and metric_idx == 1:
-    #         axis.get_yaxis().set_ticks([0,1,2,3,4,5])
-
-
-    plt.tight_layout()
-
-    print(f'Writing output to {args.outfile}')
-    plt.savefig(args.outfile)
+        _start_time, local_data, global_data, node_counts = load_metrics(SCHEMA, path)
+        rows = np.arange(len(local_data))
+
+    render(_start_time, rows, local_data, global_data, node_counts)
 
 if __name__ == "__main__":
     _main()
@@ -0,0 +1,265 @@
+#! /bin/env python3
+
+''' Follow a metrics file while the benchmark is still writing it.
+    Only newly appended rows are parsed, and the last few minutes are kept in a ring buffer '''
+
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+from cluster_metrics import DEFAULT_REPORT_FREQUENCY
+from cluster_metrics import load_schema, parse_start_time, parse_rows, aggregate_rows, write_results
+
+# How much history is kept in memory by default (in milliseconds)
+DEFAULT_WINDOW = 10 * 60 * 1000
+
+# How often to check the file for new rows by default (in seconds)
+DEFAULT_INTERVAL = 1.0
+
+# Number of bytes read at once when looking for the last rows of a file
+TAIL_CHUNK_BYTES = 1 << 20
+
+class RingBuffer:
+    ''' The most recent rows of local and global metrics.
+        Grows (in the node dimension only) when nodes join. '''
+
+    def __init__(self, schema, capacity):
+        self.capacity = capacity
+        self.local_data = np.full((capacity, 0, len(schema.local_metrics)), np.nan)
+        self.global_data = np.full((capacity, len(schema.global_metrics)), np.nan)
+        self.num_nodes = np.zeros(capacity, dtype=int)
+        # Total number of rows appended (or skipped) so far, i.e., the row number of the next one
+        self.end = 0
+        # Number of rows that are buffered
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def _grow(self, max_nodes):
+        (capacity, old_nodes, num_metrics) = self.local_data.shape
+        if max_nodes <= old_nodes:
+            return
+        local_data = np.full((capacity, max_nodes, num_metrics), np.nan)
+        local_data[:, :old_nodes] = self.local_data
+        self.local_data = local_data
+
+    def append(self, local_data, global_data, num_nodes):
+        ''' Add consecutive rows in the layout returned by parse_rows() '''
+        num_rows = len(local_data)
+        if num_rows > self.capacity:
+            # Older rows would be overwritten right away
+            skipped = num_rows - self.capacity
+            (local_data, global_data, num_nodes) = \
+                (local_data[skipped:], global_data[skipped:], num_nodes[skipped:])
+            self.skip(skipped)
+            num_rows = self.capacity
+
+        self._grow(local_data.shape[1])
+        positions = (self.end + np.arange(num_rows)) % self.capacity
+
+        self.local_data[positions] = np.nan
+        self.local_data[positions, :local_data.shape[1]] = local_data
+        self.global_data[positions] = global_data
+        self.num_nodes[positions] = num_nodes
+        self.end += num_rows
+        self.size = min(self.size + num_rows, self.capacity)
+
+    def skip(self, num_rows):
+        ''' Count rows that were never appended (e.g., because they would not have been kept).
+            Buffered rows are dropped, as the rows before and after a gap cannot be told apart. '''
+        self.end += num_rows
+        self.size = 0
+
+    def snapshot(self, first_row=0):
+        ''' Get a copy of the buffered rows (starting at first_row, if still buffered) in time order.
+            Returns the row numbers, local metrics, global metrics, and node counts '''
+        rows = np.arange(max(self.end - len(self), first_row), self.end)
+        positions = rows % self.capacity
+        return (rows, self.local_data[positions], self.global_data[positions],
+                self.num_nodes[positions])
+
+class MetricsTail:
+    ''' Parses rows as they are appended to a metrics file, remembering how far it has read '''
+
+    def __init__(self, schema, path, window=DEFAULT_WINDOW, report_frequency=DEFAULT_REPORT_FREQUENCY):
+        self.schema = schema
+        self.path = path
+        self.report_frequency = report_frequency
+        self.capacity = max(window // report_frequency, 1)
+        self._reset()
+
+    def _reset(self):
+        # Byte offset of the first line that has not been parsed yet
+        self.offset = 0
+        self.start_time = None
+        self.last_num_nodes = 0
+        # Device, inode, size, and modification time of the file at the last poll
+        self.stat = None
+        self.buffer = RingBuffer(self.schema, self.capacity)
+
+    @property
+    def num_rows(self):
+        ''' Number of rows parsed (or skipped) so far '''
+        return self.buffer.end
+
+    def _replaced(self, stat):
+        ''' Whether the file is no longer the one that was read so far (or a longer version of it) '''
+        if self.stat is None:
+            return False
+        (device, inode, size, mtime_ns) = self.stat
+        return (stat.st_dev, stat.st_ino) != (device, inode) or stat.st_size < size \
+            or (stat.st_size == size and stat.st_mtime_ns != mtime_ns)
+
+    def _find_tail(self, infile, first_offset, size):
+        ''' Find the last capacity complete rows of the file, reading backwards from its end,
+            so that the first poll of a long file does not parse rows that would not be kept.
+            Returns the offset of the first of these rows and the number of rows before it. '''
+        newlines = []
+        position = size
+        while position > first_offset and sum(len(part) for part in newlines) <= self.capacity:
+            start = max(first_offset, position - TAIL_CHUNK_BYTES)
+            infile.seek(start)
+            chunk = np.frombuffer(infile.read(position - start), dtype=np.uint8)
+            newlines.insert(0, np.flatnonzero(chunk == ord('\n')) + start)
+            position = start
+
+        newlines = np.concatenate(newlines) if newlines else np.zeros(0, dtype=np.int64)
+        if len(newlines) <= self.capacity:
+            return first_offset, 0
+
+        # The rows before those that were read backwards are only counted, not parsed
+        skipped = len(newlines) - self.capacity
+        infile.seek(first_offset)
+        for start in range(first_offset, position, TAIL_CHUNK_BYTES):
+            skipped += infile.read(min(TAIL_CHUNK_BYTES, position - start)).count(b'\n')
+        return int(newlines[-self.capacity - 1]) + 1, skipped
+
+    def poll(self):
+        ''' Parse all rows that were appended since the last call.
+            Incomplete lines are left for later. Returns the number of new rows. '''
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            # The benchmark has not created it yet
+            return 0
+
+        if self._replaced(stat):
+            # E.g., by the next run
+            print(f"WARN: {self.path} was truncated or replaced; starting over")
+            self._reset()
+        self.stat = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if stat.st_size == self.offset:
+            return 0
+
+        # Nothing is consumed unless all complete lines parse, so that a failed poll
+        # does not lose any rows (and the next one reports the same error)
+        (start_time, offset, skipped) = (self.start_time, self.offset, 0)
+
+        with open(self.path, 'rb') as infile:
+            if start_time is None:
+                line = infile.readline()
+                if not line.endswith(b'\n'):
+                    return 0
+                try:
+                    start_time = parse_start_time(line.decode('utf-8'))
+                except ValueError as err:
+                    raise RuntimeError(f"{self.path} has no valid start time") from err
+                (offset, skipped) = self._find_tail(infile, len(line), stat.st_size)
+
+            infile.seek(offset)
+            chunk = infile.read(stat.st_size - offset)
+
+        # Blank lines are rows as well (which parse_rows() rejects), so that row numbers
+        # stay the same as when reading the whole file
+        end = chunk.rfind(b'\n')
+        lines = chunk[:end].decode('utf-8').split('\n') if end >= 0 else []
+        if lines:
+            local_data, global_data, num_nodes = parse_rows(self.schema, lines,
+                                                            first_line_no=self.num_rows+skipped+1)
+            if num_nodes[0] < self.last_num_nodes:
+                raise RuntimeError("Number of nodes decreased during the run")
+
+        self.offset = offset + end + 1
+        self.start_time = start_time
+        if skipped > 0:
+            self.buffer.skip(skipped)
+        if not lines:
+            return 0
+
+        self.last_num_nodes = int(num_nodes[-1])
+        self.buffer.append(local_data, global_data, num_nodes)
+        return len(lines)
+
+    def follow(self, interval=DEFAULT_INTERVAL, timeout=None):
+        ''' Poll the file until it has not grown for timeout seconds (forever if None).
+            Yields the number of new rows whenever there are any. '''
+        last_change = time.monotonic()
+
+        while True:
+            new_rows = self.poll()
+            if new_rows > 0:
+                last_change = time.monotonic()
+                yield new_rows
+            elif timeout is not None and time.monotonic() - last_change >= timeout:
+                return
+            time.sleep(interval)
+
+    def snapshot(self, first_row=0):
+        ''' Get the buffered rows (starting at first_row) in the same layout as stream_metrics(),
+            i.e., the start time, row numbers, local metrics, global metrics, and node counts '''
+        return (self.start_time, *self.buffer.snapshot(first_row))
+
+    def aggregates(self, metrics, per_node=True):
+        ''' Compute the same records as extract_batch() over the buffered rows '''
+        for metric in metrics:
+            if metric not in self.schema:
+                raise RuntimeError(f"No such metric {metric}")
+
+        (_, rows, local_data, global_data, num_nodes) = self.snapshot()
+        if len(rows) == 0:
+            return []
+
+        window = {'start_time': self.start_time + int(rows[0]) * self.report_frequency,
+                  'end_time': self.start_time + int(rows[-1]) * self.report_frequency}
+        return aggregate_rows(self.schema, local_data, global_data, num_nodes, metrics, per_node, window)
+
+def _main():
+    parser = argparse.ArgumentParser(
+        description="Print aggregates over the last minutes of a metrics file while it is written")
+    parser.add_argument('path', type=str)
+    parser.add_argument('--metrics', type=str, default='throughput',
+        help="Comma-separated list of metrics to aggregate")
+    parser.add_argument('--window-minutes', type=float, default=DEFAULT_WINDOW / 60000,
+        help="How much history to keep and aggregate over")
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL,
+        help="Seconds between checks for new rows")
+    parser.add_argument('--timeout', type=float,
+        help="Stop once the file has not grown for this many seconds")
+    parser.add_argument('--report-frequency', type=int, default=DEFAULT_REPORT_FREQUENCY)
+    parser.add_argument('--no-per-node', action='store_true',
+        help="Only report cluster-wide aggregates")
+    parser.add_argument('--format', type=str, choices=['csv', 'json'], default='csv')
+    args = parser.parse_args()
+
+    if os.path.isdir(args.path):
+        args.path = os.path.join(args.path, 'cluster-metrics.csv')
+
+    metrics = args.metrics.split(',')
+
+    try:
+        tail = MetricsTail(load_schema(args.path), args.path, int(args.window_minutes * 60000),
+                           args.report_frequency)
+        for _ in tail.follow(args.interval, args.timeout):
+            write_results(tail.aggregates(metrics, not args.no_per_node), sys.stdout, args.format)
+            sys.stdout.flush()
+    except RuntimeError as err:
+        sys.stderr.write(f"ERROR: {err}\n")
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    _main()
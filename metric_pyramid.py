@@ -0,0 +1,403 @@
+#! /bin/env python3
+
+''' Multi-resolution summaries of a metrics file, so that zooming into a window or averaging
+    over hours of data does not have to read every row.
+
+    Level k of the pyramid stores the min, max, mean, and count of every metric and node for
+    aligned buckets of 2**k rows. Levels below the minimum level are answered from the binary
+    sidecar directly (they cover only a few rows), which keeps the pyramid at about the size
+    of the sidecar. The pyramid is stored next to the metrics file and rebuilt with the sidecar. '''
+
+# pylint: disable=too-many-locals
+
+import os
+import sys
+import csv
+import json
+import argparse
+import numpy as np
+
+from cluster_metrics import DEFAULT_REPORT_FREQUENCY, DEFAULT_CHUNK_ROWS
+from cluster_metrics import load_schema, open_metrics, nodes_joined, join_mask, row_range, write_atomic
+
+# Bump this whenever the layout of the pyramid changes
+PYRAMID_VERSION = 2
+
+# Finest level that is stored (buckets of 2**DEFAULT_MIN_LEVEL rows)
+DEFAULT_MIN_LEVEL = 3
+
+STATS = ['min', 'max', 'mean', 'count']
+
+# Local metrics have one entry per node, global metrics are stored as a single node
+GROUPS = ['local', 'global']
+
+OUTPUT_FIELDS = ['metric', 'node', 'time', 'rows'] + STATS
+
+def _dtype(stat):
+    # Full precision, so that aggregates are the same as over the sidecar
+    return np.uint32 if stat == 'count' else np.float64
+
+def _rows_stats(values, valid):
+    ''' Summaries of single rows, i.e., every row is its own bucket '''
+    values = np.where(valid, values, np.nan).astype(np.float64)
+    return {'min': values, 'max': values, 'mean': values, 'count': valid.astype(np.int64)}
+
+def _reduce(stats, axis):
+    ''' Combine the buckets along the given axis into one '''
+    count = stats['count'].sum(axis=axis)
+    total = np.where(stats['count'] > 0, stats['mean'] * stats['count'], 0.0).sum(axis=axis)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(count > 0, total / count, np.nan)
+    # NaN is the identity of fmin and fmax
+    return {'min': np.fmin.reduce(stats['min'], axis=axis, initial=np.nan),
+            'max': np.fmax.reduce(stats['max'], axis=axis, initial=np.nan),
+            'mean': mean, 'count': count}
+
+def _merge(stats, factor):
+    ''' Combine every factor consecutive buckets (the last one may be partial) '''
+    num_buckets = len(stats['count'])
+    padding = -num_buckets % factor
+    merged = {}
+    for (stat, values) in stats.items():
+        if padding:
+            fill = 0 if stat == 'count' else np.nan
+            values = np.concatenate([values, np.full((padding, *values.shape[1:]), fill, values.dtype)])
+        merged[stat] = values.reshape(-1, factor, *values.shape[1:])
+    return _reduce(merged, axis=1)
+
+def _as_bucket(stats):
+    return {stat: values[None] for (stat, values) in stats.items()}
+
+def _concatenate(parts):
+    return {stat: np.concatenate([part[stat] for part in parts]) for stat in STATS}
+
+def _group_metrics(header):
+    return {group: header[f'{group}_metrics'] for group in GROUPS}
+
+class MetricPyramid:
+    ''' Power-of-two summaries of every metric and node of one metrics file.
+        Use open_pyramid() to get one. '''
+
+    def __init__(self, header, levels, sidecar):
+        self.header = header
+        self.start_time = header['start_time']
+        self.report_frequency = header['report_frequency']
+        self.num_rows = header['num_rows']
+        self.min_level = header['min_level']
+        # Level -> group -> stat -> (bucket x node x metric) array
+        self.levels = levels
+        (_, self.local_data, self.global_data) = sidecar
+        self.num_nodes = nodes_joined(sidecar[0])
+
+    @property
+    def max_level(self):
+        ''' The coarsest level, which has a single bucket '''
+        return max(self.levels, default=self.min_level)
+
+    def _lookup(self, metric):
+        for (group, metrics) in _group_metrics(self.header).items():
+            if metric in metrics:
+                return group, metrics.index(metric)
+        raise RuntimeError(f"No such metric {metric}")
+
+    def _raw(self, group, metric_idx, first_row, end_row):
+        if group == 'global':
+            values = self.global_data[first_row:end_row, metric_idx][:, None]
+            valid = np.ones(values.shape, dtype=bool)
+        else:
+            values = self.local_data[first_row:end_row, :, metric_idx]
+            valid = join_mask(self.num_nodes[first_row:end_row], values.shape[1])
+        return _rows_stats(values, valid & ~np.isnan(values))
+
+    def _buckets(self, group, metric_idx, level, first_bucket, end_bucket):
+        if level < self.min_level:
+            # Not stored, but these cover only a few rows each
+            size = 1 << level
+            return _merge(self._raw(group, metric_idx, first_bucket * size, end_bucket * size), size)
+
+        arrays = self.levels[level][group]
+        return {stat: arrays[stat][first_bucket:end_bucket, :, metric_idx].astype(
+                    np.int64 if stat == 'count' else np.float64) for stat in STATS}
+
+    def _summarize(self, group, metric_idx, first_row, end_row):
+        ''' Exact summary of the rows in [first_row, end_row) as a single bucket.
+            Reads at most two buckets per level plus a few rows at either end. '''
+        size = 1 << self.min_level
+        # Plain ints, as NumPy integers have no bit_length()
+        (first_bucket, end_bucket) = (int(-(-first_row // size)), int(end_row // size))
+        if first_bucket >= end_bucket:
+            return _reduce(self._raw(group, metric_idx, first_row, end_row), axis=0)
+
+        parts = [self._raw(group, metric_idx, first_row, first_bucket * size),
+                 self._raw(group, metric_idx, end_bucket * size, end_row)]
+
+        # Cover the remaining buckets with the largest aligned blocks that fit
+        bucket = first_bucket
+        while bucket < end_bucket:
+            shift = (bucket & -bucket).bit_length() - 1 if bucket else self.max_level - self.min_level
+            while (1 << shift) > end_bucket - bucket:
+                shift -= 1
+            index = bucket >> shift
+            parts.append(self._buckets(group, metric_idx, self.min_level + shift, index, index + 1))
+            bucket += 1 << shift
+
+        return _reduce(_concatenate(parts), axis=0)
+
+    def rows(self, start_time, end_time):
+        ''' The rows in [start_time, end_time] (in milliseconds since the epoch) '''
+        (first_row, end_row) = row_range(self.start_time, start_time, end_time, self.report_frequency)
+        return min(first_row, self.num_rows), min(end_row, self.num_rows)
+
+    def level_for(self, num_rows, max_points):
+        ''' The coarsest level whose buckets still give at least max_points points for num_rows rows.
+            Levels below the minimum level are computed from the sidecar. '''
+        if max_points <= 0 or num_rows <= max_points:
+            return 0
+        return min(int(np.log2(num_rows / max_points)), self.max_level)
+
+    def query(self, metric, start_time, end_time, max_points, per_node=True):
+        ''' Summaries of a metric in [start_time, end_time] (in milliseconds since the epoch),
+            answered from the coarsest level that still gives max_points points (i.e., between
+            max_points and twice as many). Partial buckets at either end are summarized exactly.
+            Returns the (center) time of every point in milliseconds since the epoch, the number of
+            rows each covers, and the min, max, mean, and count of each point. These are
+            (point x node) matrices for local metrics unless per_node is False. '''
+        (group, metric_idx) = self._lookup(metric)
+        (first_row, end_row) = self.rows(start_time, end_time)
+        end_row = max(first_row, end_row)
+
+        level = self.level_for(end_row - first_row, max_points)
+        size = 1 << level
+        (first_bucket, end_bucket) = (-(-first_row // size), end_row // size)
+
+        if first_row == end_row:
+            parts = [self._raw(group, metric_idx, first_row, end_row)]
+            bounds = np.array([first_row])
+        elif first_bucket >= end_bucket:
+            parts = [_as_bucket(self._summarize(group, metric_idx, first_row, end_row))]
+            bounds = np.array([first_row, end_row])
+        else:
+            parts = [self._buckets(group, metric_idx, level, first_bucket, end_bucket)]
+            bounds = np.arange(first_bucket, end_bucket + 1) * size
+            if first_row < first_bucket * size:
+                parts.insert(0, _as_bucket(self._summarize(group, metric_idx, first_row, first_bucket * size)))
+                bounds = np.concatenate([[first_row], bounds])
+            if end_bucket * size < end_row:
+                parts.append(_as_bucket(self._summarize(group, metric_idx, end_bucket * size, end_row)))
+                bounds = np.append(bounds, end_row)
+
+        stats = _concatenate(parts)
+        if group == 'global':
+            stats = {stat: values[:, 0] for (stat, values) in stats.items()}
+        elif not per_node:
+            stats = _reduce(stats, axis=1)
+
+        times = self.start_time + (bounds[:-1] + bounds[1:] - 1) / 2 * self.report_frequency
+        return times, np.diff(bounds), stats
+
+    def aggregate(self, metric, start_time, end_time, per_node=False):
+        ''' Exact min, max, mean, and count of a metric in [start_time, end_time]
+            (in milliseconds since the epoch), for every node if per_node is set '''
+        (group, metric_idx) = self._lookup(metric)
+        (first_row, end_row) = self.rows(start_time, end_time)
+        stats = self._summarize(group, metric_idx, first_row, max(first_row, end_row))
+        if group == 'global' or not per_node:
+            stats = _reduce(stats, axis=0)
+        return stats
+
+def _pyramid_paths(path):
+    return path + '.pyramid.bin', path + '.pyramid.json'
+
+def _layout(header):
+    ''' The offset, dtype, and shape of every array in the binary file '''
+    layout = []
+    offset = 0
+    for level in header['levels']:
+        for (group, metrics) in _group_metrics(header).items():
+            nodes = header['max_nodes'] if group == 'local' else 1
+            for stat in STATS:
+                shape = (level['num_buckets'], nodes, len(metrics))
+                layout.append((level['level'], group, stat, offset, _dtype(stat), shape))
+                offset += int(np.prod(shape)) * np.dtype(_dtype(stat)).itemsize
+    return layout, offset
+
+def _build_levels(sidecar, min_level):
+    (header, local_data, global_data) = sidecar
+    num_nodes = nodes_joined(header)
+    num_rows = header['num_rows']
+    size = 1 << min_level
+
+    # Build the finest level in chunks of whole buckets, so that memory stays bounded
+    chunk_rows = max(DEFAULT_CHUNK_ROWS // size, 1) * size
+    finest = {'local': [], 'global': []}
+    for first_row in range(0, num_rows, chunk_rows):
+        end_row = min(first_row + chunk_rows, num_rows)
+        values = local_data[first_row:end_row]
+        valid = join_mask(num_nodes[first_row:end_row], values.shape[1])[:, :, None] & ~np.isnan(values)
+        finest['local'].append(_merge(_rows_stats(values, valid), size))
+        values = global_data[first_row:end_row][:, None, :]
+        finest['global'].append(_merge(_rows_stats(values, ~np.isnan(values)), size))
+
+    levels = {}
+    if num_rows == 0:
+        return levels
+
+    current = {group: _concatenate(parts) for (group, parts) in finest.items()}
+    level = min_level
+    while True:
+        levels[level] = {group: {stat: values.astype(_dtype(stat)) for (stat, values) in stats.items()}
+                         for (group, stats) in current.items()}
+        if len(current['global']['count']) <= 1:
+            return levels
+        current = {group: _merge(stats, 2) for (group, stats) in current.items()}
+        level += 1
+
+def build_pyramid(schema, path, report_frequency=DEFAULT_REPORT_FREQUENCY, min_level=DEFAULT_MIN_LEVEL):
+    ''' Build the pyramid of a metrics file (and its sidecar, if needed) and store it next to the file '''
+    sidecar = open_metrics(schema, path)
+    levels = _build_levels(sidecar, min_level)
+
+    header = {
+        'version': PYRAMID_VERSION,
+        # Identifies the version of the metrics file the pyramid was built from
+        'source': sidecar[0]['source']['sha256'],
+        'start_time': sidecar[0]['start_time'],
+        'report_frequency': report_frequency,
+        'local_metrics': schema.local_metrics,
+        'global_metrics': schema.global_metrics,
+        'num_rows': sidecar[0]['num_rows'],
+        'max_nodes': sidecar[0]['max_nodes'],
+        'min_level': min_level,
+        'levels': [{'level': level, 'num_buckets': len(arrays['global']['count'])}
+                   for (level, arrays) in sorted(levels.items())],
+    }
+
+    (layout, _) = _layout(header)
+    data = b''.join(levels[level][group][stat].tobytes() for (level, group, stat, *_) in layout)
+
+    bin_path, header_path = _pyramid_paths(path)
+
+    # The header is written last, so it only ever describes a complete data file
+    try:
+        write_atomic(bin_path, data)
+        write_atomic(header_path, json.dumps(header, indent=2).encode('utf-8'))
+    except OSError as err:
+        print(f"WARN: Failed to write pyramid for {path}: {err}")
+
+    return MetricPyramid(header, levels, sidecar)
+
+def _load_pyramid(schema, path, sidecar, report_frequency, min_level):
+    bin_path, header_path = _pyramid_paths(path)
+
+    try:
+        with open(header_path, 'r', encoding='utf-8') as infile:
+            header = json.load(infile)
+    except (OSError, ValueError):
+        return None
+
+    if header.get('version') != PYRAMID_VERSION \
+            or header['source'] != sidecar[0]['source']['sha256'] \
+            or header['report_frequency'] != report_frequency \
+            or header['min_level'] != min_level \
+            or header['local_metrics'] != schema.local_metrics \
+            or header['global_metrics'] != schema.global_metrics:
+        return None
+
+    (layout, size) = _layout(header)
+    if not os.path.exists(bin_path) or os.path.getsize(bin_path) != size:
+        return None
+
+    levels = {}
+    for (level, group, stat, offset, dtype, shape) in layout:
+        # np.memmap cannot map empty arrays
+        if int(np.prod(shape)) > 0:
+            array = np.memmap(bin_path, dtype=dtype, mode='r', offset=offset, shape=shape)
+        else:
+            array = np.zeros(shape, dtype=dtype)
+        levels.setdefault(level, {}).setdefault(group, {})[stat] = array
+
+    return MetricPyramid(header, levels, sidecar)
+
+def open_pyramid(schema, path, report_frequency=DEFAULT_REPORT_FREQUENCY, min_level=DEFAULT_MIN_LEVEL):
+    ''' Memory-map the pyramid of a metrics file.
+        The pyramid is (re-)built if it is missing or the file has changed since. '''
+    sidecar = open_metrics(schema, path)
+    pyramid = _load_pyramid(schema, path, sidecar, report_frequency, min_level)
+    if pyramid is None:
+        pyramid = build_pyramid(schema, path, report_frequency, min_level)
+    return pyramid
+
+def _records(metric, times, num_rows, stats, nodes):
+    for point in range(len(times)):
+        for node in nodes:
+            values = {stat: stats[stat][point] if node == 'all' else stats[stat][point, node]
+                      for stat in STATS}
+            yield {'metric': metric, 'node': node, 'time': float(times[point]), 'rows': int(num_rows[point]),
+                   **{stat: int(value) if stat == 'count' else None if np.isnan(value) else float(value)
+                      for (stat, value) in values.items()}}
+
+def _main():
+    parser = argparse.ArgumentParser(
+        description="Print summaries of a time range of a metrics file, using a precomputed pyramid")
+    parser.add_argument('path', type=str)
+    parser.add_argument('--metrics', type=str, default='throughput',
+        help="Comma-separated list of metrics to summarize")
+    parser.add_argument('--start-at', type=int, help="Start time in milliseconds since the epoch")
+    parser.add_argument('--end-at', type=int, help="End time in milliseconds since the epoch")
+    parser.add_argument('--max-points', type=int,
+        help="Print a series of at least this many points instead of a single summary")
+    parser.add_argument('--per-node', action='store_true', help="Summarize every node on its own")
+    parser.add_argument('--report-frequency', type=int, default=DEFAULT_REPORT_FREQUENCY)
+    parser.add_argument('--min-level', type=int, default=DEFAULT_MIN_LEVEL,
+        help="Finest level to store (buckets of 2**level rows)")
+    parser.add_argument('--build', action='store_true', help="Only (re-)build the pyramid")
+    parser.add_argument('--format', type=str, choices=['csv', 'json'], default='csv')
+    args = parser.parse_args()
+
+    if os.path.isdir(args.path):
+        args.path = os.path.join(args.path, 'cluster-metrics.csv')
+
+    try:
+        schema = load_schema(args.path)
+    except RuntimeError as err:
+        sys.stderr.write(f"ERROR: {err}\n")
+        sys.exit(1)
+
+    if args.build:
+        pyramid = build_pyramid(schema, args.path, args.report_frequency, args.min_level)
+        print(f"Built {len(pyramid.levels)} levels over {pyramid.num_rows} rows for {args.path}")
+        return
+
+    pyramid = open_pyramid(schema, args.path, args.report_frequency, args.min_level)
+    start_time = pyramid.start_time if args.start_at is None else args.start_at
+    end_time = pyramid.start_time + pyramid.num_rows * pyramid.report_frequency \
+        if args.end_at is None else args.end_at
+
+    records = []
+    try:
+        for metric in args.metrics.split(','):
+            local = metric in schema.local_metrics
+            if args.max_points is None:
+                (first_row, end_row) = pyramid.rows(start_time, end_time)
+                stats = pyramid.aggregate(metric, start_time, end_time, args.per_node and local)
+                (times, num_rows) = ([(start_time + end_time) / 2], [max(end_row - first_row, 0)])
+                stats = _as_bucket(stats)
+            else:
+                (times, num_rows, stats) = pyramid.query(metric, start_time, end_time, args.max_points,
+                                                         args.per_node)
+            nodes = range(stats['count'].shape[1]) if stats['count'].ndim == 2 else ['all']
+            records += _records(metric, times, num_rows, stats, nodes)
+    except RuntimeError as err:
+        sys.stderr.write(f"ERROR: {err}\n")
+        sys.exit(1)
+
+    if args.format == 'json':
+        json.dump(records, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        writer = csv.DictWriter(sys.stdout, fieldnames=OUTPUT_FIELDS)
+        writer.writeheader()
+        writer.writerows(records)
+
+if __name__ == "__main__":
+    _main()
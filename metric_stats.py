@@ -0,0 +1,190 @@
+''' Constant-memory statistics for streaming over metrics files '''
+
+import math
+import numpy as np
+
+AGGREGATE_NAMES = ['mean', 'min', 'max', 'p50', 'p99', 'stddev']
+
+class QuantileSketch:
+    ''' Log-bucketed quantile sketch (in the style of DDSketch).
+        Quantiles are accurate to within the given relative error and the number of
+        buckets only depends on the range of the values, not on how many there are. '''
+
+    def __init__(self, relative_accuracy=0.01):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zeros = 0
+        self.count = 0
+
+    def _add_to_store(self, store, values):
+        if len(values) == 0:
+            return
+        keys = np.ceil(np.log(values) / self.log_gamma).astype(np.int64)
+        (keys, counts) = np.unique(keys, return_counts=True)
+        for (key, count) in zip(keys.tolist(), counts.tolist()):
+            store[key] = store.get(key, 0) + count
+
+    def add(self, values):
+        ''' Add a batch of (non-NaN) values '''
+        values = np.asarray(values, dtype=np.float64)
+        self._add_to_store(self.positive, values[values > 0])
+        self._add_to_store(self.negative, -values[values < 0])
+        self.zeros += int(np.count_nonzero(values == 0))
+        self.count += len(values)
+
+    def _bucket_value(self, key):
+        return 2.0 * self.gamma**key / (self.gamma + 1.0)
+
+    def quantile(self, quantile):
+        ''' Get the (approximate) value at the given quantile in [0, 1] '''
+        if self.count == 0:
+            return None
+
+        rank = quantile * (self.count - 1)
+        seen = 0
+
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self._bucket_value(key)
+
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self._bucket_value(key)
+
+        return self._bucket_value(max(self.positive))
+
+class RunningAggregate:
+    ''' Running mean, min, max, stddev, and percentiles of a stream of values '''
+
+    def __init__(self):
+        # Number of values seen, including NaN
+        self.count = 0
+        self.num_valid = 0
+        self.mean = 0.0
+        self.sum_sq_diff = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.has_nan = False
+        self.sketch = QuantileSketch()
+
+    def update(self, values):
+        ''' Add a batch of values '''
+        values = np.asarray(values, dtype=np.float64)
+        self.count += len(values)
+        if len(values) == 0:
+            return
+
+        if np.isnan(values).any():
+            # Mirror numpy, where a single NaN poisons the result
+            self.has_nan = True
+            values = values[~np.isnan(values)]
+            if len(values) == 0:
+                return
+
+        # Merge the batch statistics (Chan et al.)
+        count = len(values)
+        mean = float(np.mean(values))
+        sum_sq_diff = float(np.sum((values - mean)**2))
+
+        total = self.num_valid + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.sum_sq_diff += sum_sq_diff + delta**2 * self.num_valid * count / total
+        self.num_valid = total
+
+        self.min = min(self.min, float(np.min(values)))
+        self.max = max(self.max, float(np.max(values)))
+        self.sketch.add(values)
+
+    def result(self):
+        ''' Get the mean, min, max, p50, p99, and stddev '''
+        if self.count == 0:
+            return {name: None for name in AGGREGATE_NAMES}
+        if self.has_nan:
+            return {name: math.nan for name in AGGREGATE_NAMES}
+
+        def percentile(quantile):
+            # The sketch is only accurate to a bucket, so keep it within the observed range
+            return min(max(self.sketch.quantile(quantile), self.min), self.max)
+
+        return {
+            'mean': self.mean,
+            'min': self.min,
+            'max': self.max,
+            'p50': percentile(0.5),
+            'p99': percentile(0.99),
+            'stddev': math.sqrt(self.sum_sq_diff / self.num_valid),
+        }
+
+class DownsampledSeries:
+    ''' A (time x node) series that keeps at most max_points buckets.
+        Once full, neighbouring buckets are merged, doubling the number of rows per bucket.
+        NaN values are treated as missing. '''
+
+    def __init__(self, max_points):
+        self.max_points = max_points
+        self.rows_per_bucket = 1
+        self.sums = np.zeros((0, 0))
+        self.counts = np.zeros((0, 0), dtype=np.int64)
+
+    def _resize(self, num_buckets, width):
+        (old_buckets, old_width) = self.sums.shape
+        if (num_buckets, width) == (old_buckets, old_width):
+            return
+
+        def grow(array, fill):
+            out = np.full((num_buckets, width), fill, dtype=array.dtype)
+            out[:old_buckets, :old_width] = array
+            return out
+
+        self.sums = grow(self.sums, 0.0)
+        self.counts = grow(self.counts, 0)
+
+    def _merge(self):
+        num_buckets = len(self.sums) + len(self.sums) % 2
+        self._resize(num_buckets, self.sums.shape[1])
+
+        self.sums = self.sums[0::2] + self.sums[1::2]
+        self.counts = self.counts[0::2] + self.counts[1::2]
+        self.rows_per_bucket *= 2
+
+    def update(self, first_row, values):
+        ''' Add a (rows x node) chunk of values that starts at the given row '''
+        values = np.asarray(values, dtype=np.float64)
+        if values.ndim == 1:
+            values = values[:, None]
+        if len(values) == 0:
+            return
+
+        last_row = first_row + len(values) - 1
+        while last_row // self.rows_per_bucket >= self.max_points:
+            self._merge()
+
+        width = max(self.sums.shape[1], values.shape[1])
+        self._resize(max(len(self.sums), last_row // self.rows_per_bucket + 1), width)
+
+        buckets = (first_row + np.arange(len(values))) // self.rows_per_bucket
+        starts = np.flatnonzero(np.diff(buckets, prepend=-1))
+        ids = buckets[starts]
+        cols = values.shape[1]
+        valid = ~np.isnan(values)
+
+        self.sums[ids, :cols] += np.add.reduceat(np.where(valid, values, 0.0), starts)
+        self.counts[ids, :cols] += np.add.reduceat(valid.astype(np.int64), starts)
+
+    def first_rows(self):
+        ''' Get the first row covered by each bucket '''
+        return np.arange(len(self.sums)) * self.rows_per_bucket
+
+    def means(self):
+        ''' Get the mean of each bucket (NaN if it has no values) '''
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.counts > 0, self.sums / np.maximum(self.counts, 1), np.nan)
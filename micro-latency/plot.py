@@ -2,13 +2,25 @@
 
 # pylint: disable=missing-docstring,line-too-long
 
+import sys
+import argparse
 import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.font_manager import FontProperties, fontManager
 
-from pandas import read_csv
 from seaborn import lineplot, FacetGrid
 
+# Shared helpers live in the top-level directory
+sys.path.append('..')
+from results import load_results # pylint: disable=wrong-import-position
+from saturation import KNEE_METHODS, plot_knee # pylint: disable=wrong-import-position
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--mark-knees', action='store_true',
+    help="Mark where each curve saturates (see saturation.py)")
+parser.add_argument('--knee-method', choices=KNEE_METHODS, default='kneedle')
+args = parser.parse_args()
+
 FONT_PATH = '../LinLibertine_Rah.ttf'
 fontManager.addfont(FONT_PATH)
 
@@ -19,7 +31,7 @@ workload_labels = ["Read Only", "50% Read, 50% Write", "Write Only"]
 
 plt.rcParams.update({'font.size': 16, 'lines.markersize': 8, 'font.family':prop.get_name()})
 
-df = read_csv('results.csv', header=0, skipinitialspace=True, comment='#')
+df = load_results('results.csv')
 
 df["worker-type"] = np.where((df["worker-type"] == "lambdastore"), "LambdaStore", df["worker-type"])
 df["worker-type"] = np.where((df["worker-type"] == "ol-sock"), "OpenLambda\n(SOCK)", df["worker-type"])
@@ -48,6 +60,9 @@ g = FacetGrid(df, col="Workload", hue="worker-type", height=3, aspect=1.5,
               hue_kws=hue_kws, col_order=workload_labels)
 g.map(lineplot, "throughput", "latency-mean")
 
+if args.mark_knees:
+    g.map_dataframe(plot_knee, "throughput", "latency-mean", method=args.knee_method)
+
 g.set_titles(col_template="{col_name}")
 g.set_xlabels("Throughput (ktps)")
 g.set_ylabels("Latency\n(ms, mean)")
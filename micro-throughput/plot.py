@@ -2,15 +2,19 @@
 
 # pylint: disable=line-too-long,missing-docstring
 
+import sys
 import numpy as np
 import matplotlib.pyplot as plt
 
 import seaborn
-from pandas import read_csv
 from seaborn import barplot
 
 from matplotlib.font_manager import FontProperties, fontManager
 
+# Shared helpers live in the top-level directory
+sys.path.append('..')
+from peak_cube import load_peaks, peak_throughput # pylint: disable=wrong-import-position
+
 FONT_PATH = '../LinLibertine_Rah.ttf'
 fontManager.addfont(FONT_PATH)
 
@@ -19,7 +23,7 @@ prop = FontProperties(fname=FONT_PATH)
 
 plt.rcParams.update({'font.size': 15, 'lines.markersize': 8, 'font.family':prop.get_name()})
 
-df = read_csv('results.csv', header=0, skipinitialspace=True, comment='#')
+df = load_peaks(['results.csv'])
 df["workload"] = ""
 
 workload_names = ["0%", "25%", "50%", "75%", "100%"]
@@ -34,7 +38,7 @@ df["worker-type"] = np.where((df["worker-type"] == "apiary"), "Apiary", df["work
 for (pos, share) in enumerate([0,25,50,75,100]):
     df["workload"] = np.where((df["write-chance"] == share), workload_names[pos], df["workload"])
 
-df = df.groupby(["workload", "worker-type"])['throughput'].max().reset_index()
+df = peak_throughput(df, ["workload", "worker-type"])
 df['throughput'] = df['throughput'] / 1000.0
 
 df['reference'] = df.groupby('workload')['throughput'].transform(lambda x: x.iloc[0])
@@ -0,0 +1,284 @@
+#! /bin/env python3
+
+''' Find imbalance between nodes and nodes that are hotter than the rest of the cluster.
+    Works on the (time x node) matrix of a local metric instead of its overall mean '''
+
+import os
+import sys
+import csv
+import json
+import argparse
+import contextlib
+import numpy as np
+
+from cluster_metrics import DEFAULT_REPORT_FREQUENCY
+from cluster_metrics import load_schema, open_metrics, nodes_joined, join_mask, row_range
+
+# Analyzed by default (if the metrics file has them)
+IMBALANCE_METRICS = ['throughput', 'cpu-usage', 'ready-jobs', 'active-transactions']
+
+# A node counts as hot if it is this many times above the cluster mean (unless a threshold is given)
+DEFAULT_RELATIVE_THRESHOLD = 1.5
+
+DEFAULT_TOP_K = 1
+
+SUMMARY_FIELDS = ['metric', 'rows', 'nodes', 'mean', 'max', 'cv-mean', 'cv-p99', 'imbalance-mean',
+                  'imbalance-p99', 'imbalance-max', 'hottest-node', 'hottest-share']
+
+NODE_FIELDS = ['metric', 'node', 'rows', 'mean', 'max', 'relative-mean',
+               'hottest-share', 'top-k-share', 'time-above', 'share-above']
+
+# Summaries are reported as node "all" (like extract_batch()) in CSV output
+CSV_FIELDS = NODE_FIELDS + [field for field in SUMMARY_FIELDS if field not in NODE_FIELDS]
+
+def cluster_stats(values, valid):
+    ''' Get the mean, standard deviation, and maximum across nodes for every point in time.
+        values is a (time x node) matrix and valid tells which of its entries to use. '''
+    count = valid.sum(axis=1)
+    filled = np.where(valid, values, 0.0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = filled.sum(axis=1) / count
+        variance = np.where(valid, (values - mean[:, None])**2, 0.0).sum(axis=1) / count
+    maximum = np.where(valid, values, -np.inf).max(axis=1, initial=-np.inf)
+    maximum[count == 0] = np.nan
+
+    return mean, np.sqrt(variance), maximum
+
+def top_k(values, valid, k):
+    ''' Get a (time x node) mask of the k nodes with the highest value at every point in time '''
+    num_nodes = values.shape[1]
+    k = min(k, num_nodes)
+    if k == 0:
+        return np.zeros(values.shape, dtype=bool)
+
+    ranked = np.where(valid, values, -np.inf)
+    hottest = np.argpartition(-ranked, k - 1, axis=1)[:, :k]
+    mask = np.zeros(values.shape, dtype=bool)
+    np.put_along_axis(mask, hottest, True, axis=1)
+    return mask & valid
+
+def analyze(values, valid, report_frequency=DEFAULT_REPORT_FREQUENCY, k=DEFAULT_TOP_K,
+            threshold=None, relative_threshold=DEFAULT_RELATIVE_THRESHOLD):
+    ''' Analyze the (time x node) matrix of one metric.
+        Time above the threshold uses the given absolute threshold, or otherwise
+        relative_threshold times the cluster mean at that point in time.
+        Returns a summary for the cluster and one record per node. '''
+    values = np.asarray(values, dtype=np.float64)
+    valid = valid & ~np.isnan(values)
+    (mean, std, maximum) = cluster_stats(values, valid)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cv = np.where(mean > 0, std / mean, np.nan)
+        imbalance = np.where(mean > 0, maximum / mean, np.nan)
+
+    # Only rows with at least two nodes tell us anything about imbalance, and a node
+    # only counts as hot if it is above the mean (so that ties, e.g., all zeros, do not count)
+    compared = valid.sum(axis=1) >= 2
+    candidates = valid & compared[:, None] & (values > mean[:, None])
+    hottest = top_k(values, candidates, 1)
+    in_top_k = top_k(values, candidates, k)
+
+    if threshold is not None:
+        above = valid & (values > threshold)
+    else:
+        above = valid & (values > relative_threshold * mean[:, None]) & (mean[:, None] > 0)
+
+    def percentile(series, quantile):
+        series = series[compared & ~np.isnan(series)]
+        return float(np.percentile(series, quantile)) if len(series) > 0 else None
+
+    def average(series):
+        series = series[compared & ~np.isnan(series)]
+        return float(series.mean()) if len(series) > 0 else None
+
+    def share(counts, total):
+        return float(counts / total) if total > 0 else None
+
+    hottest_counts = hottest.sum(axis=0)
+    num_compared = int(compared.sum())
+    hottest_node = int(np.argmax(hottest_counts)) if hottest_counts.max(initial=0) > 0 else None
+    overall_mean = float(values[valid].mean()) if valid.any() else None
+
+    summary = {
+        'rows': len(values),
+        'nodes': values.shape[1],
+        'mean': overall_mean,
+        'max': float(values[valid].max()) if valid.any() else None,
+        'cv-mean': average(cv),
+        'cv-p99': percentile(cv, 99),
+        'imbalance-mean': average(imbalance),
+        'imbalance-p99': percentile(imbalance, 99),
+        'imbalance-max': percentile(imbalance, 100),
+        'hottest-node': hottest_node,
+        'hottest-share': None if hottest_node is None
+                         else share(hottest_counts[hottest_node], num_compared),
+    }
+
+    rows_per_node = valid.sum(axis=0)
+    nodes = []
+    for node_idx in range(values.shape[1]):
+        node_values = values[valid[:, node_idx], node_idx]
+        rows = int(rows_per_node[node_idx])
+        node_compared = int((valid[:, node_idx] & compared).sum())
+        node_mean = float(node_values.mean()) if rows > 0 else None
+        nodes.append({
+            'node': node_idx,
+            'rows': rows,
+            'mean': node_mean,
+            'max': float(node_values.max()) if rows > 0 else None,
+            'relative-mean': node_mean / overall_mean if node_mean is not None and overall_mean else None,
+            'hottest-share': share(hottest_counts[node_idx], node_compared),
+            'top-k-share': share(in_top_k[:, node_idx].sum(), node_compared),
+            'time-above': int(above[:, node_idx].sum()) * report_frequency / 1000,
+            'share-above': share(above[:, node_idx].sum(), rows),
+        })
+
+    return summary, nodes
+
+def load_matrix(schema, path, metric, start_time=None, end_time=None,
+                report_frequency=DEFAULT_REPORT_FREQUENCY):
+    ''' Get the (time x node) matrix of a local metric and which entries belong to joined nodes,
+        optionally limited to the given time range (in milliseconds since the epoch) '''
+    if metric not in schema.local_metrics:
+        raise RuntimeError(f"No such local metric {metric}")
+
+    header, local_data, _ = open_metrics(schema, path)
+    num_nodes = nodes_joined(header)
+
+    (first_row, end_row) = (0, len(local_data))
+    if start_time is not None or end_time is not None:
+        (first_row, end_row) = row_range(
+            header['start_time'],
+            header['start_time'] if start_time is None else start_time,
+            header['start_time'] + len(local_data) * report_frequency if end_time is None else end_time,
+            report_frequency)
+
+    values = local_data[first_row:end_row, :, schema.local_metrics.index(metric)]
+    valid = join_mask(num_nodes[first_row:end_row], local_data.shape[1])
+    times = (first_row + np.arange(len(values))) * report_frequency * 0.001
+    return times, values, valid
+
+def plot_heatmap(outfile, matrices, font_size=8, width=5, height_per_metric=1.6):
+    ''' Draw one (node x time) heatmap per metric; nodes that had not joined are left blank.
+        matrices maps metric names to their times, values, and valid mask. '''
+    # pylint: disable=import-outside-toplevel
+    import matplotlib.pyplot as plt
+    from matplotlib.font_manager import FontProperties, fontManager
+    from heatmap import draw_heatmap
+
+    font_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'LinLibertine_Rah.ttf')
+    fontManager.addfont(font_path)
+    plt.rcParams.update({'font.size': font_size, 'font.family': FontProperties(fname=font_path).get_name()})
+    (fig, axes) = plt.subplots(len(matrices), 1, squeeze=False,
+                               figsize=(width, height_per_metric * len(matrices)))
+
+    # About one cell per pixel
+    max_points = int(width * fig.dpi)
+    max_nodes = int(height_per_metric * fig.dpi)
+
+    for (axis, (metric, (times, values, valid))) in zip(axes[:, 0], matrices.items()):
+        image = draw_heatmap(axis, times, np.where(valid, values, np.nan), max_points, max_nodes,
+                             cmap='inferno')
+        axis.set_ylabel("Node")
+        axis.set_title(metric)
+        fig.colorbar(image, ax=axis, pad=0.01)
+
+    axes[-1, 0].set_xlabel("Time (s)")
+    plt.tight_layout()
+    plt.savefig(outfile)
+
+def _format(value):
+    if value is None:
+        return '-'
+    if isinstance(value, float):
+        return f'{value:.3f}'
+    return str(value)
+
+def write_table(records, fields, outfile):
+    ''' Write records as an aligned text table '''
+    rows = [fields] + [[_format(record.get(field)) for field in fields] for record in records]
+    widths = [max(len(row[column]) for row in rows) for column in range(len(fields))]
+    for row in rows:
+        outfile.write('  '.join(cell.rjust(width) for (cell, width) in zip(row, widths)) + '\n')
+
+def _parse_thresholds(text):
+    thresholds = {}
+    for entry in text.split(','):
+        if '=' not in entry:
+            raise argparse.ArgumentTypeError(f"Expected metric=value, not {entry}")
+        (metric, value) = entry.split('=', 1)
+        thresholds[metric] = float(value)
+    return thresholds
+
+def _main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', type=str)
+    parser.add_argument('--metrics', type=str,
+        help="Comma-separated list of local metrics to analyze (defaults to IMBALANCE_METRICS)")
+    parser.add_argument('--start-at', type=int, help="Start time in milliseconds since the epoch")
+    parser.add_argument('--end-at', type=int, help="End time in milliseconds since the epoch")
+    parser.add_argument('--report-frequency', type=int, default=DEFAULT_REPORT_FREQUENCY)
+    parser.add_argument('--top-k', type=int, default=DEFAULT_TOP_K,
+        help="Report how often each node was among the k hottest nodes")
+    parser.add_argument('--threshold', type=_parse_thresholds, default={},
+        help="Absolute thresholds for time above threshold (e.g., cpu-usage=90,ready-jobs=100)")
+    parser.add_argument('--relative-threshold', type=float, default=DEFAULT_RELATIVE_THRESHOLD,
+        help="Without an absolute threshold, count time above this many times the cluster mean")
+    parser.add_argument('--format', type=str, choices=['table', 'csv', 'json'], default='table')
+    parser.add_argument('--outfile', type=str, help="Write the results to this file instead of stdout")
+    parser.add_argument('--heatmap', type=str, help="Also draw a heatmap of every metric to this file")
+    parser.add_argument('--font-size', type=int, default=8)
+    args = parser.parse_args()
+
+    if os.path.isdir(args.path):
+        args.path = os.path.join(args.path, 'cluster-metrics.csv')
+
+    summaries = []
+    nodes = []
+    matrices = {}
+
+    try:
+        schema = load_schema(args.path)
+        if args.metrics is None:
+            metrics = [metric for metric in IMBALANCE_METRICS if metric in schema.local_metrics]
+        else:
+            metrics = args.metrics.split(',')
+
+        for metric in metrics:
+            (times, values, valid) = load_matrix(schema, args.path, metric, args.start_at, args.end_at,
+                                                 args.report_frequency)
+            if len(values) == 0:
+                raise RuntimeError("No data found in this time range")
+            matrices[metric] = (times, values, valid)
+
+            (summary, node_records) = analyze(values, valid, args.report_frequency, args.top_k,
+                                              args.threshold.get(metric), args.relative_threshold)
+            summaries.append({'metric': metric, **summary})
+            nodes += [{'metric': metric, **record} for record in node_records]
+    except RuntimeError as err:
+        sys.stderr.write(f"ERROR: {err}\n")
+        sys.exit(1)
+
+    with open(args.outfile, 'w', encoding='utf-8', newline='') if args.outfile \
+            else contextlib.nullcontext(sys.stdout) as outfile:
+        if args.format == 'json':
+            json.dump({'summary': summaries, 'nodes': nodes}, outfile, indent=2)
+            outfile.write('\n')
+        elif args.format == 'csv':
+            writer = csv.DictWriter(outfile, fieldnames=CSV_FIELDS)
+            writer.writeheader()
+            for summary in summaries:
+                writer.writerow({'node': 'all', **summary})
+                writer.writerows(record for record in nodes if record['metric'] == summary['metric'])
+        else:
+            write_table(summaries, SUMMARY_FIELDS, outfile)
+            outfile.write('\n')
+            write_table(nodes, NODE_FIELDS, outfile)
+
+    if args.heatmap:
+        plot_heatmap(args.heatmap, matrices, args.font_size)
+        print(f'Writing heatmap to {args.heatmap}')
+
+if __name__ == "__main__":
+    _main()
@@ -4,7 +4,7 @@
 Plots how object creation scales with the number of shards
 '''
 
-import pandas as pd
+import sys
 import matplotlib.pyplot as plt
 
 import seaborn
@@ -12,6 +12,10 @@ from seaborn import lineplot
 
 from matplotlib.font_manager import FontProperties, fontManager
 
+# Shared helpers live in the top-level directory
+sys.path.append('..')
+from peak_cube import load_peaks, peak_throughput # pylint: disable=wrong-import-position
+
 FONT_PATH = '../LinLibertine_Rah.ttf'
 fontManager.addfont(FONT_PATH)
 
@@ -21,8 +25,7 @@ prop = FontProperties(fname=FONT_PATH)
 plt.rcParams.update({'font.size': 16, 'lines.markersize': 8,
                      'font.family':prop.get_name()})
 
-df = pd.read_csv('results.csv', header=0, comment='#', skipinitialspace=True)
-df = df.groupby(["num-shards"])['throughput'].max().reset_index()
+df = peak_throughput(load_peaks(['results.csv']), ["num-shards"])
 df['throughput'] = df['throughput'] / 1000.0
 
 fig = plt.figure(figsize=(6,2))
@@ -4,13 +4,17 @@
 Plots how object partitioning affects read/write performance
 '''
 
+import sys
 import numpy as np
 import matplotlib.pyplot as plt
 
-from pandas import read_csv
 from seaborn import lineplot, FacetGrid
 from matplotlib.font_manager import FontProperties, fontManager
 
+# Shared helpers live in the top-level directory
+sys.path.append('..')
+from peak_cube import load_peaks, peak_throughput # pylint: disable=wrong-import-position
+
 FONT_PATH = '../LinLibertine_Rah.ttf'
 fontManager.addfont(FONT_PATH)
 
@@ -21,7 +25,7 @@ plt.rcParams.update({'font.size': 18, 'lines.markersize': 8,
 
 labels = ["Read Only", "50% Read, 50% Write"]#, "Write Only"]
 
-df = read_csv('results.csv', header=0, skipinitialspace=True, comment='#')
+df = load_peaks(['results.csv'])
 
 #Remove write only (for now)
 df = df[(df["write-chance"] == 0) | (df["write-chance"] == 50)]
@@ -30,7 +34,7 @@ df["workload"] = ""
 for (pos, share) in enumerate([0,50]): #,100]):
     df["workload"] = np.where((df["write-chance"] == share), labels[pos], df["workload"])
 
-df = df.groupby(["workload", "num-guards"])['throughput'].max().reset_index()
+df = peak_throughput(df, ["workload", "num-guards"])
 df['throughput'] = df['throughput'] / 1000.0
 
 hue_kws={"color":["tab:blue"], "marker":['o']}
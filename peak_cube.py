@@ -0,0 +1,232 @@
+#! /bin/env python3
+
+''' Materialized peak throughput of every configuration in every results file.
+
+    Most figures show the best throughput a configuration reached across all client counts.
+    The cube stores, for every source file and every combination of its configuration
+    parameters, the run with the highest throughput together with its latencies and
+    client count. When runs are appended to a results file, only the new rows are folded in;
+    any other change to a file rebuilds its part of the cube. '''
+
+import os
+import sys
+import fcntl
+import pickle
+import hashlib
+import argparse
+import contextlib
+
+import pandas as pd
+
+from results import load_results
+from run_store import ROOT, STORE_PATH, find_sources
+
+CUBE_PATH = os.path.join(STORE_PATH, 'peaks.pkl')
+
+# Bump this whenever the format of the cube changes
+CUBE_VERSION = 1
+
+# Parameters that are increased to find the peak (i.e., that are not part of a configuration)
+LOAD_PARAMETERS = ['uid', 'client-multiply', 'num-clients']
+
+# Measurements that are never part of a configuration
+MEASUREMENTS = ['throughput', 'latency-mean', 'latency-median', 'latency-99p',
+                'avg-job-runtime', 'abort-share']
+
+# What is kept of the run with the highest throughput
+PEAK_FIELDS = ['throughput', 'latency-mean', 'latency-median', 'latency-99p',
+               'num-clients', 'client-multiply', 'uid']
+
+def _prefix_hash(path, size):
+    ''' SHA-256 of the first size bytes of a file '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as infile:
+        remaining = size
+        while remaining > 0:
+            chunk = infile.read(min(remaining, 1 << 20))
+            if not chunk:
+                break
+            digest.update(chunk)
+            remaining -= len(chunk)
+    return digest.hexdigest()
+
+def _python_value(value):
+    if pd.isna(value):
+        return None
+    return value.item() if hasattr(value, 'item') else value
+
+class PeakCube:
+    ''' Peak throughput per configuration, for every results file '''
+
+    def __init__(self, path=CUBE_PATH, root=ROOT):
+        self.path = path
+        self.root = root
+        self.sources = {}
+
+        try:
+            with open(path, 'rb') as infile:
+                stored = pickle.load(infile)
+            if stored.get('version') == CUBE_VERSION:
+                self.sources = stored['sources']
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            pass
+
+    def save(self):
+        ''' Write the cube to disk '''
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as outfile:
+            pickle.dump({'version': CUBE_VERSION, 'sources': self.sources}, outfile,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
+
+    def _fold(self, entry, df):
+        ''' Fold new runs into the peaks of a source '''
+        keys = entry['keys']
+        for run in df.to_dict('records'):
+            key = tuple(_python_value(run.get(name)) for name in keys)
+            throughput = _python_value(run['throughput'])
+
+            peak = entry['peaks'].get(key)
+            if peak is None:
+                peak = entry['peaks'][key] = {'num-runs': 0}
+            peak['num-runs'] += 1
+
+            # Keep the first run on ties, like DataFrame.idxmax
+            if throughput is not None and ('throughput' not in peak or
+                                           peak['throughput'] is None or
+                                           throughput > peak['throughput']):
+                peak.update({name: _python_value(run.get(name)) for name in PEAK_FIELDS})
+
+    def update_source(self, source):
+        ''' Bring the peaks of a single results file (relative to the root) up to date.
+            Returns True if anything changed. '''
+        path = os.path.join(self.root, source)
+        size = os.stat(path).st_size
+        entry = self.sources.get(source)
+
+        if entry is not None and entry['size'] == size \
+                and entry['sha256'] == _prefix_hash(path, size):
+            return False
+
+        df = load_results(path)
+        excluded = set(LOAD_PARAMETERS) | set(MEASUREMENTS)
+        keys = [name for name in df.columns if name not in excluded]
+
+        # Only fold in the new rows if runs were appended to the file
+        appended = entry is not None and size > entry['size'] and entry['keys'] == keys \
+            and entry['sha256'] == _prefix_hash(path, entry['size'])
+        if not appended:
+            entry = {'keys': keys, 'peaks': {}, 'num_rows': 0}
+
+        self._fold(entry, df.iloc[entry['num_rows']:])
+        entry.update({'size': size, 'sha256': _prefix_hash(path, size), 'num_rows': len(df)})
+        self.sources[source] = entry
+        return True
+
+    def update(self, sources=None):
+        ''' Bring the cube up to date with the given results files (all of them by default).
+            Returns True if anything changed. '''
+        changed = False
+
+        if sources is None:
+            sources = find_sources(self.root)
+            for source in list(self.sources):
+                if source not in sources:
+                    del self.sources[source]
+                    changed = True
+
+        for source in sources:
+            changed |= self.update_source(source)
+
+        return changed
+
+    def frame(self, sources=None):
+        ''' Get the peaks of the given sources (all of them by default) as a DataFrame.
+            Only columns that are set for at least one of these peaks are included. '''
+        if sources is None:
+            sources = sorted(self.sources)
+
+        records = []
+        for source in sources:
+            if source not in self.sources:
+                raise KeyError(f"No such results file: {source}")
+            entry = self.sources[source]
+            for (key, peak) in entry['peaks'].items():
+                record = {'source': source}
+                record.update(zip(entry['keys'], key))
+                record.update(peak)
+                records.append(record)
+
+        columns = list(dict.fromkeys(name for record in records for name in record))
+        columns = [name for name in columns
+                   if any(record.get(name) is not None for record in records)]
+        return pd.DataFrame(records, columns=columns)
+
+@contextlib.contextmanager
+def _locked(path):
+    ''' Hold an exclusive lock on the cube at path, so that concurrent figure builds
+        do not overwrite each other's updates '''
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        lock_file = open(path + '.lock', 'ab') # pylint: disable=consider-using-with
+    except OSError:
+        # The cube is not saved on a read-only checkout either
+        yield
+        return
+
+    with lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+def load_peaks(sources=None, path=CUBE_PATH, root=ROOT):
+    ''' Get the (up-to-date) peaks of the given results files (e.g., "results.csv").
+        Paths are relative to the current directory. '''
+    if sources is not None:
+        sources = [os.path.relpath(os.path.abspath(source), root) for source in sources]
+
+    # Only look at the files we need, so that figures do not depend on all of them.
+    # The cube is loaded, updated, and saved under the lock, so that no update gets lost.
+    with _locked(path):
+        cube = PeakCube(path, root)
+        if cube.update(sources):
+            try:
+                cube.save()
+            except OSError:
+                # Saving is best effort (e.g., on a read-only checkout)
+                pass
+
+    return cube.frame(sources)
+
+def peak_throughput(df, by):
+    ''' Reduce peaks (or raw runs) to the run with the highest throughput for every value of by.
+        Keeps the latencies and client count of that run. '''
+    df = df[df['throughput'].notna()].reset_index(drop=True)
+    return df.loc[df.groupby(by)['throughput'].idxmax()].reset_index(drop=True)
+
+def _main():
+    parser = argparse.ArgumentParser(
+        description="Print the peak throughput of every configuration (e.g., for capacity reports)")
+    parser.add_argument('sources', type=str, nargs='*',
+        help="Results files to report on, relative to the repository (defaults to all of them)")
+    parser.add_argument('--by', type=str,
+        help="Comma-separated list of parameters to report the peak for (defaults to the full configuration)")
+    parser.add_argument('--cube', type=str, default=CUBE_PATH)
+    parser.add_argument('--outfile', type=str)
+    args = parser.parse_args()
+
+    try:
+        df = load_peaks(args.sources or None, path=args.cube)
+        if args.by:
+            df = peak_throughput(df, args.by.split(','))
+    except KeyError as err:
+        sys.stderr.write(f"ERROR: {err.args[0]}\n")
+        sys.exit(1)
+
+    first = (args.by.split(',') if args.by else ['source']) + PEAK_FIELDS + ['num-runs']
+    first = [name for name in first if name in df]
+    df = df[first + [name for name in df.columns if name not in first]]
+    df.to_csv(args.outfile or sys.stdout, index=False)
+
+if __name__ == "__main__":
+    _main()
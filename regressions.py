@@ -0,0 +1,272 @@
+#! /bin/env python3
+
+''' Compares two sets of results (e.g., before and after an upgrade) and reports significant changes.
+
+    A set of results is either a directory with results files (laid out like this repository),
+    a run store (see run_store.py), or a single results file. Runs are matched by their
+    results file and configuration, i.e., all parameters except the offered load. For every
+    configuration and metric, one of two tests decides whether the change is significant:
+
+      * bootstrap: resamples runs and computes a confidence interval of the change in the mean.
+        Runs of the two sets that have the same offered load are resampled as pairs.
+      * mann-whitney: Mann-Whitney U test (normal approximation with tie correction).
+
+    Changes of throughput and latencies are relative (0.1 is 10% higher),
+    changes of abort-share are absolute. The program exits with an error if any significant
+    regression is larger than the threshold, so that it can be used to gate upgrades. '''
+
+import os
+import sys
+import math
+import fnmatch
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from results import load_results
+from run_store import find_sources, load_runs, merge_sources
+from peak_cube import LOAD_PARAMETERS, MEASUREMENTS
+
+TESTS = ['bootstrap', 'mann-whitney']
+
+# Metric -> (whether higher is better, whether changes are relative)
+METRICS = {
+    'throughput': (True, True),
+    'latency-mean': (False, True),
+    'latency-99p': (False, True),
+    'abort-share': (False, False),
+}
+
+# Columns that identify a run, but not its configuration
+PROVENANCE = ['uid', 'source', 'experiment']
+
+DEFAULT_BOOTSTRAP_SAMPLES = 10000
+
+def load_result_set(path):
+    ''' Load all runs of a directory, run store, or results file, with the source of every run '''
+    if os.path.isfile(path):
+        df = load_results(path).astype(object)
+        df['source'] = os.path.basename(path)
+        return df
+    if os.path.exists(os.path.join(path, 'schema.json')):
+        # Do not refresh, as the store may belong to another checkout
+        return load_runs(store_path=path, refresh=False)
+    if os.path.isdir(path):
+        sources = find_sources(path)
+        if not sources:
+            raise ValueError(f"No results files in {path}")
+        return merge_sources(sources, path)
+    raise ValueError(f"No such file or directory: {path}")
+
+def _load_column(df):
+    for name in ['client-multiply', 'num-clients']:
+        if name in df:
+            return name
+    return None
+
+def parameters(df):
+    ''' The parameters that identify a configuration (i.e., that are not measured or load) '''
+    excluded = set(PROVENANCE) | set(LOAD_PARAMETERS) | set(MEASUREMENTS)
+    return [name for name in df.dropna(axis=1, how='all').columns if name not in excluded]
+
+def configurations(df, keys):
+    ''' Group the runs of a single source by configuration '''
+    df = df.dropna(axis=1, how='all').infer_objects()
+    if not keys:
+        return {(): df}
+    return {key if isinstance(key, tuple) else (key,): group
+            for (key, group) in df.groupby(keys, sort=True, dropna=False, observed=True)}
+
+def _ranks(values):
+    ''' Ranks of values (starting at 1), where ties get their average rank '''
+    (_, inverse, counts) = np.unique(values, return_inverse=True, return_counts=True)
+    ends = np.cumsum(counts)
+    return (ends - (counts - 1) / 2.0)[inverse], counts
+
+def mann_whitney(old, new):
+    ''' Two-sided p-value of the Mann-Whitney U test that new and old come from the same distribution '''
+    (n_old, n_new) = (len(old), len(new))
+    total = n_old + n_new
+    (ranks, ties) = _ranks(np.concatenate([old, new]))
+
+    u_new = ranks[n_old:].sum() - n_new * (n_new + 1) / 2.0
+    mean = n_old * n_new / 2.0
+    variance = n_old * n_new / 12.0 * ((total + 1) - np.sum(ties**3 - ties) / (total * (total - 1)))
+    if variance <= 0:
+        return 1.0
+
+    z = (abs(u_new - mean) - 0.5) / math.sqrt(variance)
+    return min(math.erfc(max(z, 0.0) / math.sqrt(2)), 1.0)
+
+def _change(old, new, relative):
+    ''' Change of the mean along the last axis '''
+    (old, new) = (old.mean(axis=-1), new.mean(axis=-1))
+    if not relative:
+        return new - old
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return new / old - 1.0
+
+def bootstrap(old, new, relative=True, paired=False, confidence=0.95,
+              samples=DEFAULT_BOOTSTRAP_SAMPLES, seed=0):
+    ''' Confidence interval of the change of the mean and the two-sided p-value that it is zero.
+        Paired samples (same length) are resampled together. '''
+    rng = np.random.default_rng(seed)
+    if paired:
+        picked = rng.integers(0, len(old), (samples, len(old)))
+        changes = _change(old[picked], new[picked], relative)
+    else:
+        changes = _change(old[rng.integers(0, len(old), (samples, len(old)))],
+                          new[rng.integers(0, len(new), (samples, len(new)))], relative)
+
+    changes = changes[np.isfinite(changes)]
+    if len(changes) == 0:
+        return np.nan, np.nan, np.nan
+
+    tail = (1.0 - confidence) / 2 * 100
+    p_value = min(2 * min(np.mean(changes <= 0), np.mean(changes >= 0)), 1.0)
+    return np.percentile(changes, tail), np.percentile(changes, 100 - tail), p_value
+
+def compare_metric(old, new, metric, test='bootstrap', confidence=0.95,
+                   samples=DEFAULT_BOOTSTRAP_SAMPLES):
+    ''' Compare a metric between the runs of one configuration in both sets.
+        Returns None if neither set measured it. '''
+    (higher_is_better, relative) = METRICS[metric]
+    if metric not in old or metric not in new:
+        return None
+
+    load = _load_column(old) if _load_column(old) == _load_column(new) else None
+    if load is not None:
+        matched = pd.merge(old[[load, metric]].groupby(load).mean(),
+                           new[[load, metric]].groupby(load).mean(),
+                           left_index=True, right_index=True, suffixes=('-old', '-new')).dropna()
+    else:
+        matched = pd.DataFrame()
+
+    old_values = pd.to_numeric(old[metric], errors='coerce').dropna().to_numpy(dtype=np.float64)
+    new_values = pd.to_numeric(new[metric], errors='coerce').dropna().to_numpy(dtype=np.float64)
+    if len(old_values) == 0 or len(new_values) == 0:
+        return None
+
+    # Comparing the same load levels is more precise than comparing whole sweeps
+    paired = len(matched) >= 2
+    if paired:
+        old_values = matched[f'{metric}-old'].to_numpy(dtype=np.float64)
+        new_values = matched[f'{metric}-new'].to_numpy(dtype=np.float64)
+
+    change = float(_change(old_values, new_values, relative))
+    record = {'metric': metric, 'old': old_values.mean(), 'new': new_values.mean(), 'change': change,
+              'low': np.nan, 'high': np.nan, 'p-value': np.nan,
+              'num-old': len(old_values), 'num-new': len(new_values), 'paired': paired}
+
+    if min(len(old_values), len(new_values)) >= 2:
+        if test == 'mann-whitney':
+            record['p-value'] = mann_whitney(old_values, new_values)
+        else:
+            (record['low'], record['high'], record['p-value']) = bootstrap(
+                old_values, new_values, relative, paired, confidence, samples)
+
+    worse = change < 0 if higher_is_better else change > 0
+    record['direction'] = 'regression' if worse else 'improvement' if change != 0 else 'unchanged'
+    return record
+
+def compare(old, new, metrics=None, test='bootstrap', confidence=0.95,
+            samples=DEFAULT_BOOTSTRAP_SAMPLES, sources=None):
+    ''' Compare every configuration and metric that both sets of runs have.
+        sources optionally restricts the comparison to results files matching these patterns. '''
+    metrics = metrics or list(METRICS)
+    common = sorted(set(old['source'].dropna().astype(str)) & set(new['source'].dropna().astype(str)))
+    if sources:
+        common = [source for source in common
+                  if any(fnmatch.fnmatch(source, pattern) for pattern in sources)]
+
+    records = []
+    for source in common:
+        (old_runs, new_runs) = (old[old['source'].astype(str) == source], new[new['source'].astype(str) == source])
+        keys = parameters(old_runs)
+        if set(keys) != set(parameters(new_runs)):
+            sys.stderr.write(f"WARNING: {source} has different parameters in both sets; skipping it\n")
+            continue
+
+        (old_groups, new_groups) = (configurations(old_runs, keys), configurations(new_runs, keys))
+        matched = sorted(set(old_groups) & set(new_groups), key=str)
+
+        # Only describe configurations by the parameters that differ between them
+        varying = [index for index in range(len(keys)) if len({key[index] for key in matched}) > 1]
+
+        for key in matched:
+            configuration = ', '.join(f"{keys[index]}={key[index]}" for index in varying)
+            for metric in metrics:
+                record = compare_metric(old_groups[key], new_groups[key], metric, test, confidence, samples)
+                if record is not None:
+                    records.append({'source': source, 'configuration': configuration, **record})
+
+    return pd.DataFrame(records, columns=[
+        'source', 'configuration', 'metric', 'old', 'new', 'change', 'low', 'high', 'p-value',
+        'num-old', 'num-new', 'paired', 'direction'])
+
+def significant(comparison, alpha=0.05):
+    ''' The changes that are significant at the given level '''
+    return comparison[comparison['p-value'] < alpha]
+
+def _main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('old', type=str, help="Baseline results (directory, run store, or results file)")
+    parser.add_argument('new', type=str, help="Results to compare against the baseline")
+    parser.add_argument('--test', choices=TESTS, default='bootstrap')
+    parser.add_argument('--metrics', type=str, default=','.join(METRICS),
+        help="Comma-separated list of metrics to compare")
+    parser.add_argument('--sources', type=str,
+        help="Comma-separated list of patterns of results files to compare (e.g., micro-*/results.csv,sharding/*)")
+    parser.add_argument('--alpha', type=float, default=0.05, help="Significance level")
+    parser.add_argument('--threshold', type=float, default=0.05,
+        help="Fail if a significant regression is larger than this (relative, or absolute for abort-share)")
+    parser.add_argument('--samples', type=int, default=DEFAULT_BOOTSTRAP_SAMPLES,
+        help="Number of bootstrap samples")
+    parser.add_argument('--outfile', type=str, help="Write all comparisons to this CSV file")
+    args = parser.parse_args()
+
+    metrics = args.metrics.split(',')
+    for metric in metrics:
+        if metric not in METRICS:
+            sys.stderr.write(f"ERROR: Unknown metric {metric}\n")
+            sys.exit(1)
+
+    try:
+        (old, new) = (load_result_set(args.old), load_result_set(args.new))
+    except ValueError as err:
+        sys.stderr.write(f"ERROR: {err}\n")
+        sys.exit(1)
+
+    comparison = compare(old, new, metrics, args.test, 1.0 - args.alpha, args.samples,
+                         args.sources.split(',') if args.sources else None)
+    if args.outfile:
+        comparison.to_csv(args.outfile, index=False)
+
+    # A gate that compared nothing must not pass
+    if len(comparison) == 0:
+        sys.stderr.write("ERROR: No configuration and metric is in both sets of results\n")
+        sys.exit(1)
+    for pattern in (args.sources.split(',') if args.sources else []):
+        if not any(fnmatch.fnmatch(source, pattern) for source in comparison['source'].unique()):
+            sys.stderr.write(f"WARNING: Nothing was compared for {pattern}\n")
+
+    changes = significant(comparison, args.alpha)
+    changes = changes[changes['direction'] != 'unchanged'].sort_values(['direction', 'source', 'change'])
+    columns = ['source', 'configuration', 'metric', 'old', 'new', 'change', 'p-value']
+
+    print(f"Compared {len(comparison)} metrics of "
+          f"{comparison[['source', 'configuration']].drop_duplicates().shape[0]} configurations")
+    for direction in ['regression', 'improvement']:
+        rows = changes[changes['direction'] == direction]
+        print(f"\nSignificant {direction}s: {len(rows)}")
+        if len(rows) > 0:
+            print(rows[columns].to_string(index=False))
+
+    regressions = changes[(changes['direction'] == 'regression') & (changes['change'].abs() > args.threshold)]
+    if len(regressions) > 0:
+        sys.stderr.write(f"ERROR: {len(regressions)} significant regression(s) larger than {args.threshold}\n")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,165 @@
+#! /bin/env python3
+
+''' Long-lived render daemon that keeps pandas, seaborn, and matplotlib loaded.
+
+    Start it with "./render_server.py serve" and then render figures with, e.g.,
+    "./render_server.py render timeout ./plot_metrics.py . --metrics=throughput".
+    Every request is handled in a forked copy of the warm server process,
+    so figures cannot affect each other and only pay for drawing. '''
+
+import io
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import argparse
+import tempfile
+import contextlib
+import socketserver
+
+from build import FIGURES, init_worker, run_script, figure_command
+
+DEFAULT_SOCKET = os.path.join(os.environ.get('XDG_RUNTIME_DIR', tempfile.gettempdir()),
+                              f'lambdastore-render-{os.getuid()}.sock')
+
+class RenderHandler(socketserver.StreamRequestHandler):
+    ''' Handles a single JSON request per connection '''
+
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            # E.g., another server checking whether we are still alive
+            return
+
+        try:
+            request = json.loads(line)
+        except ValueError as err:
+            self._respond({'ok': False, 'error': f"Invalid request: {err}"})
+            return
+
+        if request.get('command') == 'shutdown':
+            self._respond({'ok': True})
+            # We are in a forked child, so tell the parent to stop
+            os.kill(os.getppid(), signal.SIGTERM)
+            return
+
+        if request.get('command', 'render') != 'render':
+            self._respond({'ok': False, 'error': f"Unknown command {request.get('command')}"})
+            return
+
+        start = time.time()
+        output = io.StringIO()
+
+        try:
+            with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+                inputs = run_script(os.path.abspath(request['directory']),
+                                    request['script'], list(request.get('args', [])))
+        except Exception as err: # pylint: disable=broad-exception-caught
+            self._respond({'ok': False, 'error': str(err), 'output': output.getvalue(),
+                           'duration': time.time() - start})
+            return
+
+        self._respond({'ok': True, 'output': output.getvalue(), 'inputs': inputs,
+                       'duration': time.time() - start})
+
+    def _respond(self, response):
+        self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+class RenderServer(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    ''' Forks a copy of the (already warm) server for every request '''
+
+def serve(socket_path):
+    ''' Preload everything and then serve render requests until shut down '''
+    init_worker()
+
+    if os.path.exists(socket_path):
+        # Do not take over the socket of a server that is still running
+        with contextlib.suppress(OSError), socket.socket(socket.AF_UNIX) as sock:
+            sock.connect(socket_path)
+            raise RuntimeError(f"A render server is already listening on {socket_path}")
+        os.unlink(socket_path)
+
+    old_umask = os.umask(0o077)
+    try:
+        server = RenderServer(socket_path, RenderHandler)
+    finally:
+        os.umask(old_umask)
+
+    # Make sure the socket is removed when we are asked to stop
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"Listening on {socket_path}")
+
+    try:
+        with server:
+            server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        with contextlib.suppress(OSError):
+            os.unlink(socket_path)
+
+def request(socket_path, message):
+    ''' Send a request to a running render server and wait for its response '''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(message).encode('utf-8') + b'\n')
+
+        with sock.makefile('rb') as infile:
+            return json.loads(infile.readline())
+
+def render(socket_path, directory, script, args):
+    ''' Render a figure on a running render server '''
+    return request(socket_path, {'command': 'render', 'directory': os.path.abspath(directory),
+                                 'script': script, 'args': args})
+
+def _main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--socket', type=str, default=DEFAULT_SOCKET)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('serve', help="Start the render server")
+    commands.add_parser('shutdown', help="Stop a running render server")
+
+    render_parser = commands.add_parser('render', help="Run a plot script on the server")
+    render_parser.add_argument('directory', type=str,
+        help="Directory to run the script in (e.g., timeout)")
+    render_parser.add_argument('script', type=str, nargs='?',
+        help="Script to run, relative to the directory (defaults to the figure's own command)")
+    render_parser.add_argument('args', nargs=argparse.REMAINDER)
+
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(args.socket)
+        return
+
+    try:
+        if args.command == 'shutdown':
+            request(args.socket, {'command': 'shutdown'})
+            return
+
+        if args.script is None:
+            name = os.path.basename(os.path.abspath(args.directory))
+            if name not in FIGURES:
+                parser.error(f"{name} is not a known figure; please specify a script")
+            (script, script_args) = figure_command(name)
+        else:
+            (script, script_args) = (args.script, args.args)
+
+        response = render(args.socket, args.directory, script, script_args)
+    except (FileNotFoundError, ConnectionRefusedError):
+        sys.stderr.write(f"ERROR: No render server listening on {args.socket}\n")
+        sys.exit(1)
+
+    sys.stdout.write(response.get('output', ''))
+
+    if not response['ok']:
+        sys.stderr.write(f"ERROR: {response['error']}\n")
+        sys.exit(1)
+
+    print(f"Rendered in {response['duration']:.2f}s")
+
+if __name__ == "__main__":
+    _main()
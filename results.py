@@ -0,0 +1,183 @@
+''' Loads benchmark results (e.g., results.csv) together with the configuration they were run with.
+
+    Every results file starts with a header like the following,
+    which the benchmark script writes before the actual CSV data:
+
+        # command: ./benchmark.py toml experiments/bank.toml
+        # constants: num-client-machines=30 replica-set-size=3 workload=bank ...
+        # -----------------------------
+
+    Parsed files are cached in a pickle next to the CSV (<file>.pkl),
+    which is only used as long as the hash of the CSV matches. '''
+
+import os
+import shlex
+import pickle
+import hashlib
+
+import pandas as pd
+
+# Bump this whenever the format of the cached files changes
+CACHE_VERSION = 1
+
+CACHE_SUFFIX = '.pkl'
+
+class BenchmarkConfig:
+    ''' The configuration that was constant across all runs in a results file '''
+
+    def __init__(self, command, constants):
+        # The command line the benchmark was started with
+        self.command = command
+        # Typed values of all constants, by name (e.g., "replica-set-size": 3)
+        self.constants = constants
+
+    @property
+    def arguments(self):
+        ''' The command split into its arguments '''
+        return shlex.split(self.command) if self.command else []
+
+    @property
+    def experiment(self):
+        ''' The experiment (.toml) file, if any '''
+        for argument in self.arguments:
+            if argument.endswith('.toml'):
+                return argument
+        return None
+
+    def get(self, name, default=None):
+        ''' Get the value of a constant '''
+        return self.constants.get(name, default)
+
+    def __getitem__(self, name):
+        return self.constants[name]
+
+    def __contains__(self, name):
+        return name in self.constants
+
+    def __eq__(self, other):
+        return isinstance(other, BenchmarkConfig) \
+            and (self.command, self.constants) == (other.command, other.constants)
+
+    def __repr__(self):
+        return f"BenchmarkConfig(command={self.command!r}, constants={self.constants!r})"
+
+def parse_value(text):
+    ''' Convert a constant to a bool, int, or float if possible '''
+    if text.lower() in ['true', 'false']:
+        return text.lower() == 'true'
+
+    for convert in [int, float]:
+        try:
+            return convert(text)
+        except ValueError:
+            pass
+
+    return text
+
+def parse_constants(text):
+    ''' Parse a list of key=value pairs separated by whitespace '''
+    constants = {}
+    for pair in text.split():
+        if '=' not in pair:
+            raise ValueError(f"Invalid constant: {pair}")
+        (key, value) = pair.split('=', 1)
+        constants[key] = parse_value(value)
+    return constants
+
+def parse_header(lines):
+    ''' Parse the comment lines at the start of a results file '''
+    command = None
+    constants = {}
+
+    for line in lines:
+        line = line.lstrip('#').strip()
+        if line.startswith('command:'):
+            command = line[len('command:'):].strip()
+        elif line.startswith('constants:'):
+            constants.update(parse_constants(line[len('constants:'):]))
+
+    return BenchmarkConfig(command, constants)
+
+def read_header(path):
+    ''' Read and parse the header of a results file '''
+    lines = []
+    with open(path, 'r', encoding='utf-8') as infile:
+        for line in infile:
+            if not line.startswith('#'):
+                break
+            lines.append(line)
+    return parse_header(lines)
+
+def file_hash(path):
+    ''' Get the SHA-256 of a file's content '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _load_cached(cache_path, sha256):
+    try:
+        with open(cache_path, 'rb') as infile:
+            cached = pickle.load(infile)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        return None
+
+    if cached.get('version') != CACHE_VERSION or cached.get('sha256') != sha256:
+        return None
+    return cached
+
+def _store_cached(cache_path, cached):
+    tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as outfile:
+            pickle.dump(cached, outfile, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        # Caching is best effort (e.g., on a read-only checkout)
+        pass
+
+def add_constants(df, config):
+    ''' Add every constant that is not already a column as a (categorical) column.
+        Columns take precedence, as they hold the parameters that were varied. '''
+    columns = {}
+    for (name, value) in config.constants.items():
+        if name not in df:
+            columns[name] = pd.Categorical([value] * len(df))
+
+    if columns:
+        df = pd.concat([df, pd.DataFrame(columns, index=df.index)], axis=1)
+    return df
+
+def load_results(path, constants=True, use_cache=True):
+    ''' Load a results file as a DataFrame.
+        The parsed header is stored in df.attrs['config'].
+        If constants is set, all constants are also added as columns. '''
+
+    cache_path = path + CACHE_SUFFIX
+    sha256 = file_hash(path)
+    cached = _load_cached(cache_path, sha256) if use_cache else None
+
+    if cached is None:
+        cached = {
+            'version': CACHE_VERSION,
+            'sha256': sha256,
+            'config': read_header(path),
+            'frame': pd.read_csv(path, header=0, comment='#', skipinitialspace=True),
+        }
+        if use_cache:
+            _store_cached(cache_path, cached)
+
+    df = cached['frame']
+    config = cached['config']
+
+    if constants:
+        df = add_constants(df, config)
+
+    df.attrs['config'] = config
+    df.attrs['source'] = path
+    return df
+
+def load_config(path):
+    ''' Get only the configuration of a results file '''
+    return load_results(path, constants=False).attrs['config']
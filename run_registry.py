@@ -0,0 +1,255 @@
+#! /bin/env python3
+
+''' Finds runs by their configuration, without scanning all results files.
+
+    The registry keeps an inverted index from every value of every parameter
+    (the constants of a run, its experiment, and the parameters that were varied
+    such as client-multiply or write-chance) to the runs that have it.
+    It is built on top of the run store (see run_store.py) and rebuilt along with it.
+
+    Example:
+        ./run_registry.py select replica-set-size=3 worker-type=ol-wasm "num-shards>=4" '''
+
+import os
+import re
+import sys
+import json
+import bisect
+import argparse
+
+import numpy as np
+
+from results import parse_value
+from run_store import STORE_PATH, open_store, generation_path, load_runs
+
+# Bump this whenever the layout of the index changes
+INDEX_VERSION = 1
+
+# Columns that hold measurements rather than configuration; these are not indexed
+MEASUREMENTS = ['throughput', 'latency-mean', 'latency-median', 'latency-99p',
+                'avg-job-runtime', 'abort-share']
+
+OPERATORS = ['>=', '<=', '!=', '=', '<', '>']
+
+class RunRegistry:
+    ''' Inverted index over the configuration of all runs in the run store '''
+
+    def __init__(self, store_path=STORE_PATH, refresh=True):
+        self.store_path = store_path
+        self.schema = open_store(store_path, refresh=refresh)
+
+        directory = generation_path(store_path, self.schema)
+        index_path = os.path.join(directory, 'index.json')
+        postings_path = os.path.join(directory, 'index.postings.npy')
+
+        try:
+            with open(index_path, 'r', encoding='utf-8') as infile:
+                self.index = json.load(infile)
+            if self.index.get('version') != INDEX_VERSION:
+                raise ValueError("Outdated index")
+        except (OSError, ValueError):
+            (self.index, postings) = self._build()
+            np.save(postings_path, postings)
+            tmp_path = f'{index_path}.{os.getpid()}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as outfile:
+                json.dump(self.index, outfile)
+            os.replace(tmp_path, index_path)
+
+        self.postings = np.load(postings_path, mmap_mode='r')
+
+    @property
+    def num_runs(self):
+        ''' Total number of runs in the store '''
+        return self.schema['num_rows']
+
+    @property
+    def parameters(self):
+        ''' Names of all indexed parameters '''
+        return list(self.index['parameters'])
+
+    def _build(self):
+        ''' Build the index from the run store.
+            Postings of all parameters are stored in a single array of row numbers;
+            every value points to a contiguous (sorted) slice of it. '''
+        names = [name for name in self.schema['columns'] if name not in MEASUREMENTS]
+        df = load_runs(names, store_path=self.store_path, refresh=False)
+
+        parameters = {}
+        postings = []
+        offset = 0
+
+        for name in names:
+            column = df[name].dropna()
+            if len(column) == 0:
+                continue
+
+            kind = self.schema['columns'][name]['kind']
+            values = column.astype(str if kind == 'string' else object).to_numpy()
+            (keys, inverse) = np.unique(values, return_inverse=True)
+            order = np.argsort(inverse, kind='stable')
+
+            rows = column.index.to_numpy()[order].astype(np.int32)
+            counts = np.bincount(inverse, minlength=len(keys))
+
+            parameters[name] = {
+                'kind': kind,
+                'values': keys.tolist(),
+                'offsets': (offset + np.concatenate([[0], np.cumsum(counts)])).tolist(),
+            }
+            postings.append(rows)
+            offset += len(rows)
+
+        postings = np.concatenate(postings) if postings else np.zeros(0, dtype=np.int32)
+        return {'version': INDEX_VERSION, 'parameters': parameters}, postings
+
+    def _convert(self, name, value):
+        kind = self.index['parameters'][name]['kind']
+        if kind == 'string':
+            return str(value)
+        if kind == 'bool':
+            return bool(value)
+        if kind == 'int' and float(value).is_integer():
+            return int(value)
+        return float(value)
+
+    def values(self, name):
+        ''' Get every value of a parameter and how many runs have it '''
+        entry = self._entry(name)
+        return dict(zip(entry['values'], np.diff(entry['offsets']).tolist()))
+
+    def _entry(self, name):
+        if name not in self.index['parameters']:
+            raise KeyError(f"No such parameter: {name}")
+        return self.index['parameters'][name]
+
+    def _rows_between(self, entry, first, last):
+        ''' Rows for the values at positions [first, last) '''
+        if first >= last:
+            return np.zeros(0, dtype=np.int32)
+        return np.sort(np.asarray(self.postings[entry['offsets'][first]:entry['offsets'][last]]))
+
+    def match(self, name, operator, value):
+        ''' Get the (sorted) row numbers of all runs where the parameter matches.
+            Runs that do not have the parameter never match.
+            For "=" and "!=", value can also be a list of values. '''
+        entry = self._entry(name)
+        keys = entry['values']
+
+        if operator in ['=', '!=']:
+            candidates = value if isinstance(value, (list, tuple, set)) else [value]
+            positions = set()
+            for candidate in candidates:
+                candidate = self._convert(name, candidate)
+                pos = bisect.bisect_left(keys, candidate)
+                if pos < len(keys) and keys[pos] == candidate:
+                    positions.add(pos)
+            if operator == '!=':
+                positions = set(range(len(keys))) - positions
+            parts = [self._rows_between(entry, pos, pos + 1) for pos in sorted(positions)]
+            return np.unique(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int32)
+
+        if entry['kind'] == 'string':
+            raise ValueError(f"Cannot compare {name} with {operator}, as it is not a number")
+
+        value = self._convert(name, value)
+        if operator == '<':
+            return self._rows_between(entry, 0, bisect.bisect_left(keys, value))
+        if operator == '<=':
+            return self._rows_between(entry, 0, bisect.bisect_right(keys, value))
+        if operator == '>':
+            return self._rows_between(entry, bisect.bisect_right(keys, value), len(keys))
+        if operator == '>=':
+            return self._rows_between(entry, bisect.bisect_left(keys, value), len(keys))
+
+        raise ValueError(f"Unknown operator {operator}")
+
+    def select(self, predicates):
+        ''' Get the row numbers of all runs that match all (name, operator, value) predicates '''
+        rows = None
+        for (name, operator, value) in predicates:
+            matches = self.match(name, operator, value)
+            rows = matches if rows is None else np.intersect1d(rows, matches, assume_unique=True)
+            if len(rows) == 0:
+                break
+
+        if rows is None:
+            return np.arange(self.num_runs)
+        return rows
+
+    def runs(self, predicates, columns=None):
+        ''' Load the given columns of all runs that match all predicates '''
+        return load_runs(columns, rows=self.select(predicates),
+                         store_path=self.store_path, refresh=False)
+
+def parse_predicate(text):
+    ''' Parse a predicate such as "num-shards>=4" or "worker-type=lambdastore,ol-wasm" '''
+    match = re.fullmatch(r'([^<>=!]+)(' + '|'.join(re.escape(op) for op in OPERATORS) + r')(.*)', text)
+    if match is None:
+        raise ValueError(f"Invalid predicate: {text}")
+
+    (name, operator, value) = match.groups()
+    if operator in ['=', '!=']:
+        return name.strip(), operator, [parse_value(part) for part in value.split(',')]
+    return name.strip(), operator, parse_value(value)
+
+def find_runs(*predicates, columns=None, store_path=STORE_PATH):
+    ''' Convenience function to load all runs matching the given predicates (as strings) '''
+    registry = RunRegistry(store_path)
+    return registry.runs([parse_predicate(predicate) for predicate in predicates], columns)
+
+def _main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--store', type=str, default=STORE_PATH)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    select_parser = commands.add_parser('select', help="Print all runs matching the given predicates")
+    select_parser.add_argument('predicates', type=str, nargs='*',
+        help="Predicates such as replica-set-size=3, worker-type=lambdastore,ol-wasm, or num-shards>=4")
+    select_parser.add_argument('--columns', type=str,
+        help="Comma-separated list of columns to print (defaults to uid, source, and the predicates)")
+    select_parser.add_argument('--count', action='store_true',
+        help="Only print the number of matching runs")
+
+    commands.add_parser('parameters', help="List all indexed parameters")
+
+    values_parser = commands.add_parser('values', help="List the values of a parameter")
+    values_parser.add_argument('parameter', type=str)
+
+    args = parser.parse_args()
+
+    try:
+        registry = RunRegistry(args.store)
+
+        if args.command == 'parameters':
+            for name in registry.parameters:
+                print(f"{name:<32} {len(registry.values(name))} value(s)")
+            return
+
+        if args.command == 'values':
+            for (value, count) in registry.values(args.parameter).items():
+                print(f"{value!s:<32} {count} run(s)")
+            return
+
+        predicates = [parse_predicate(predicate) for predicate in args.predicates]
+        rows = registry.select(predicates)
+
+        if args.count:
+            print(len(rows))
+            return
+
+        if args.columns:
+            columns = args.columns.split(',')
+        else:
+            columns = ['uid', 'source'] + [name for (name, _, _) in predicates
+                                           if name not in ['uid', 'source']]
+            columns = list(dict.fromkeys(columns))
+
+        df = load_runs(columns, rows=rows, store_path=args.store, refresh=False)
+    except (KeyError, ValueError) as err:
+        sys.stderr.write(f"ERROR: {err.args[0]}\n")
+        sys.exit(1)
+
+    df.to_csv(sys.stdout, index=False)
+
+if __name__ == "__main__":
+    _main()
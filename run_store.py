@@ -0,0 +1,292 @@
+#! /bin/env python3
+
+''' Merges the runs of all experiments into a single columnar store, keyed by results file and uid.
+
+    Every column is stored in its own .npy file, so that queries only read the columns they need.
+    Columns that do not exist for some experiment are null for its runs.
+    String columns (e.g., worker-type or workload) are dictionary-encoded.
+
+    The store is rebuilt automatically whenever one of the results files changes. '''
+
+import os
+import sys
+import glob
+import json
+import shutil
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from results import load_results, file_hash, parse_value
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+STORE_PATH = os.path.join(ROOT, '.run-store')
+
+# Bump this whenever the layout of the store changes
+STORE_VERSION = 2
+
+# Results files to ingest, relative to the repository
+SOURCE_PATTERNS = ['*/results.csv', 'sharding/*.csv']
+
+def find_sources(root=ROOT):
+    ''' Get all results files (relative to root) '''
+    paths = set()
+    for pattern in SOURCE_PATTERNS:
+        paths.update(glob.glob(pattern, root_dir=root))
+    return sorted(paths)
+
+def _source_state(path, previous=None):
+    stat = os.stat(path)
+    if previous and (previous['mtime_ns'], previous['size']) == (stat.st_mtime_ns, stat.st_size):
+        return previous
+    return {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'sha256': file_hash(path)}
+
+def _column_kind(values):
+    kind = pd.api.types.infer_dtype(values, skipna=True)
+    if kind == 'integer':
+        return 'int'
+    if kind in ['floating', 'mixed-integer-float', 'empty']:
+        return 'float'
+    if kind == 'boolean':
+        return 'bool'
+    return 'string'
+
+def _encode_column(values, kind):
+    ''' Convert an (object) column into the arrays that are stored for it and its metadata '''
+    missing = values.isna().to_numpy()
+
+    if kind == 'int':
+        data = np.where(missing, 0, values.fillna(0)).astype(np.int64)
+        return {'values': data, 'valid': ~missing}, {}
+    if kind == 'float':
+        return {'values': values.astype(np.float64).to_numpy()}, {}
+    if kind == 'bool':
+        data = np.where(missing, -1, values.fillna(False).astype(bool)).astype(np.int8)
+        return {'values': data}, {}
+
+    strings = values.where(missing, values.astype(str))
+    categories = sorted(strings[~missing].unique())
+    codes = pd.Categorical(strings, categories=categories).codes.astype(np.int32)
+    return {'codes': codes}, {'categories': categories}
+
+def _decode_column(arrays, column, rows):
+    kind = column['kind']
+    if kind == 'int':
+        return pd.arrays.IntegerArray(np.asarray(arrays['values'][rows]),
+                                      ~np.asarray(arrays['valid'][rows]))
+    if kind == 'float':
+        return np.asarray(arrays['values'][rows])
+    if kind == 'bool':
+        values = np.asarray(arrays['values'][rows])
+        return pd.arrays.BooleanArray(values == 1, values < 0)
+    return pd.Categorical.from_codes(np.asarray(arrays['codes'][rows]), column['categories'])
+
+def merge_sources(sources, root=ROOT):
+    ''' Load the given results files (relative to root) as a single DataFrame
+        with one row per run and results file '''
+    frames = []
+    for path in sources:
+        df = load_results(os.path.join(root, path))
+        config = df.attrs['config']
+        df = df.astype(object)
+        df['source'] = path
+        df['experiment'] = config.experiment
+        frames.append(df)
+
+    merged = pd.concat(frames, ignore_index=True, sort=False)
+    merged['uid'] = merged['uid'].astype(str).str.strip()
+
+    # The same runs can be used by more than one figure (e.g., micro-throughput and micro-latency),
+    # so they are kept for every file, and only repeated rows within a file are dropped
+    duplicates = merged.duplicated(['source', 'uid'], keep='first')
+    if duplicates.any():
+        conflicting = merged[merged.duplicated(['source', 'uid'], keep=False)] \
+            .drop_duplicates().duplicated(['source', 'uid'])
+        if conflicting.any():
+            sys.stderr.write(f"WARNING: {conflicting.sum()} run(s) appear with different values "
+                             "in the same file; keeping the first\n")
+        merged = merged[~duplicates].reset_index(drop=True)
+
+    # Put the key and provenance first
+    first = ['uid', 'source', 'experiment']
+    return merged[first + [name for name in merged.columns if name not in first]]
+
+def _read_schema(store_path):
+    try:
+        with open(os.path.join(store_path, 'schema.json'), 'r', encoding='utf-8') as infile:
+            schema = json.load(infile)
+    except (OSError, ValueError):
+        return None
+    if schema.get('version') != STORE_VERSION:
+        return None
+    return schema
+
+def _write_schema(store_path, schema):
+    tmp_path = os.path.join(store_path, f'schema.json.{os.getpid()}.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as outfile:
+        json.dump(schema, outfile, indent=2)
+    os.replace(tmp_path, os.path.join(store_path, 'schema.json'))
+
+def ingest(store_path=STORE_PATH, root=ROOT):
+    ''' (Re-)build the store from all results files '''
+    sources = find_sources(root)
+    merged = merge_sources(sources, root)
+
+    previous = _read_schema(store_path)
+    generation = previous['generation'] + 1 if previous else 0
+    directory = os.path.join(store_path, str(generation))
+    os.makedirs(directory, exist_ok=True)
+
+    columns = {}
+    for (index, name) in enumerate(merged.columns):
+        kind = _column_kind(merged[name])
+        (arrays, meta) = _encode_column(merged[name], kind)
+
+        files = {}
+        for (part, array) in arrays.items():
+            files[part] = f'{index}.{part}.npy'
+            np.save(os.path.join(directory, files[part]), array)
+
+        columns[name] = {'kind': kind, 'files': files, **meta}
+
+    schema = {
+        'version': STORE_VERSION,
+        'generation': generation,
+        'num_rows': len(merged),
+        'sources': {path: _source_state(os.path.join(root, path)) for path in sources},
+        'columns': columns,
+    }
+
+    # Readers only ever see complete generations
+    _write_schema(store_path, schema)
+
+    for entry in os.listdir(store_path):
+        if entry.isdigit() and int(entry) != generation:
+            shutil.rmtree(os.path.join(store_path, entry), ignore_errors=True)
+
+    return schema
+
+def _unchanged_sources(schema, root=ROOT):
+    ''' Check whether any results file was added, removed, or changed since the store was built.
+        Returns the updated state of the sources (or None if the store is stale). '''
+    sources = find_sources(root)
+    if sorted(schema['sources']) != sources:
+        return None
+
+    states = {}
+    for path in sources:
+        previous = schema['sources'][path]
+        state = _source_state(os.path.join(root, path), previous)
+        if state['sha256'] != previous['sha256']:
+            return None
+        states[path] = state
+    return states
+
+def open_store(store_path=STORE_PATH, root=ROOT, refresh=True):
+    ''' Get the schema of the store, (re-)building it if needed '''
+    schema = _read_schema(store_path)
+    if schema is None:
+        return ingest(store_path, root)
+    if not refresh:
+        return schema
+
+    states = _unchanged_sources(schema, root)
+    if states is None:
+        return ingest(store_path, root)
+
+    if states != schema['sources']:
+        # Only the timestamps changed
+        schema['sources'] = states
+        _write_schema(store_path, schema)
+    return schema
+
+def generation_path(store_path, schema):
+    ''' Get the directory that holds the columns of the current generation of the store '''
+    return os.path.join(store_path, str(schema['generation']))
+
+def load_runs(columns=None, where=None, rows=None, store_path=STORE_PATH, refresh=True):
+    ''' Load the given columns (all of them by default) of all runs as a DataFrame.
+        where maps column names to the value (or list of values) a run must have.
+        rows optionally restricts the result to the given row numbers of the store. '''
+    schema = open_store(store_path, refresh=refresh)
+    directory = generation_path(store_path, schema)
+
+    if columns is None:
+        columns = list(schema['columns'])
+    where = where or {}
+
+    for name in list(columns) + list(where):
+        if name not in schema['columns']:
+            raise KeyError(f"No such column: {name}")
+
+    def open_column(name):
+        return {part: np.load(os.path.join(directory, filename), mmap_mode='r')
+                for (part, filename) in schema['columns'][name]['files'].items()}
+
+    selected = np.zeros(schema['num_rows'], dtype=bool)
+    selected[slice(None) if rows is None else np.asarray(rows, dtype=np.int64)] = True
+
+    for (name, expected) in where.items():
+        if not isinstance(expected, (list, tuple, set)):
+            expected = [expected]
+        values = pd.Series(_decode_column(open_column(name), schema['columns'][name], slice(None)))
+        selected &= values.isin(list(expected)).to_numpy(dtype=bool, na_value=False)
+
+    rows = np.flatnonzero(selected)
+    return pd.DataFrame({name: _decode_column(open_column(name), schema['columns'][name], rows)
+                         for name in columns})
+
+def get_run(uid, store_path=STORE_PATH):
+    ''' Get all (non-null) values of a single run '''
+    df = load_runs(where={'uid': uid}, store_path=store_path)
+    if len(df) == 0:
+        raise KeyError(f"No such run: {uid}")
+    return df.iloc[0].dropna().to_dict()
+
+def _parse_filter(text):
+    if '=' not in text:
+        raise argparse.ArgumentTypeError(f"Expected column=value, not {text}")
+    (name, value) = text.split('=', 1)
+    return name, [parse_value(part) for part in value.split(',')]
+
+def _main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--store', type=str, default=STORE_PATH)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('ingest', help="Rebuild the store from all results files")
+    commands.add_parser('schema', help="List all columns and their types")
+
+    query_parser = commands.add_parser('query', help="Print runs as CSV")
+    query_parser.add_argument('--columns', type=str,
+        help="Comma-separated list of columns to print (defaults to all of them)")
+    query_parser.add_argument('--where', type=_parse_filter, action='append', default=[],
+        help="Only print runs where a column has one of the given values (e.g., worker-type=lambdastore,ol-wasm)")
+    query_parser.add_argument('--outfile', type=str)
+
+    args = parser.parse_args()
+
+    if args.command == 'ingest':
+        schema = ingest(args.store)
+        print(f"Ingested {schema['num_rows']} runs from {len(schema['sources'])} files")
+        return
+
+    if args.command == 'schema':
+        schema = open_store(args.store)
+        for (name, column) in schema['columns'].items():
+            extra = f" ({len(column['categories'])} values)" if 'categories' in column else ''
+            print(f"{name:<32} {column['kind']}{extra}")
+        return
+
+    columns = args.columns.split(',') if args.columns else None
+    try:
+        df = load_runs(columns, dict(args.where), store_path=args.store)
+    except KeyError as err:
+        sys.stderr.write(f"ERROR: {err.args[0]}\n")
+        sys.exit(1)
+
+    df.to_csv(args.outfile or sys.stdout, index=False)
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,193 @@
+#! /bin/env python3
+
+''' Finds where throughput-latency curves saturate.
+
+    A curve is the set of runs of one configuration, ordered by the offered load
+    (client-multiply or, if that was not recorded, the number of clients).
+    Two ways of finding its knee are supported:
+
+      * kneedle: Kneedle (Satopää et al., 2011) on the normalized curve. For latency over
+        throughput, this is the run that maximizes normalized throughput minus normalized latency.
+      * doubling: the last run before latency first exceeds twice the latency at the lowest load.
+
+    A curve counts as saturated if the runs past its knee gained (almost) no throughput,
+    i.e., at most a small share of the throughput at the knee.
+
+    Additionally, the maximum sustainable throughput is the highest throughput of any run
+    that stayed within a latency SLO (e.g., 100ms at the 99th percentile). '''
+
+import sys
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from results import load_results
+from peak_cube import LOAD_PARAMETERS, MEASUREMENTS
+
+KNEE_METHODS = ['kneedle', 'doubling']
+
+LATENCIES = ['latency-mean', 'latency-median', 'latency-99p']
+
+# Columns that define the order of a curve, in order of preference
+LOAD_COLUMNS = ['client-multiply', 'num-clients']
+
+# Fields of the knee run that are reported
+KNEE_FIELDS = ['throughput'] + LATENCIES + LOAD_COLUMNS
+
+# Share of the throughput at the knee that runs past it may gain for the curve to count as saturated
+DEFAULT_SATURATION_GAIN = 0.1
+
+def configuration_columns(df):
+    ''' The columns that identify a configuration, i.e., all but the load and measurements '''
+    excluded = set(LOAD_PARAMETERS) | set(MEASUREMENTS)
+    return [name for name in df.columns if name not in excluded]
+
+def order_by_load(curve):
+    ''' Sort the runs of a curve by their offered load '''
+    load = [name for name in LOAD_COLUMNS if name in curve]
+    if not load:
+        raise ValueError(f"Need one of {', '.join(LOAD_COLUMNS)} to order runs")
+    return curve.sort_values(load + ['throughput'], kind='stable')
+
+def kneedle(throughput, latency):
+    ''' Index of the knee of a (throughput, latency) curve that is ordered by load '''
+    throughput = np.asarray(throughput, dtype=np.float64)
+    latency = np.asarray(latency, dtype=np.float64)
+
+    def normalize(values):
+        span = np.nanmax(values) - np.nanmin(values)
+        if span == 0:
+            return np.zeros_like(values)
+        return (values - np.nanmin(values)) / span
+
+    difference = normalize(throughput) - normalize(latency)
+    return int(np.nanargmax(difference))
+
+def latency_doubling(latency, factor=2.0):
+    ''' Index of the last run before latency exceeds factor times the latency at the lowest load '''
+    latency = np.asarray(latency, dtype=np.float64)
+    exceeded = np.flatnonzero(latency > factor * latency[0])
+    if len(exceeded) == 0:
+        return len(latency) - 1
+    return max(int(exceeded[0]) - 1, 0)
+
+def find_knee(curve, latency='latency-mean', method='kneedle', max_gain=DEFAULT_SATURATION_GAIN):
+    ''' Get the run at the knee of a single curve.
+        Returns the run and whether the curve saturated, i.e., whether there are runs past the knee
+        and none of them reached more than (1 + max_gain) times the throughput at the knee. '''
+    curve = order_by_load(curve[curve['throughput'].notna() & curve[latency].notna()])
+    if len(curve) == 0:
+        return None, False
+
+    if method == 'kneedle':
+        index = kneedle(curve['throughput'], curve[latency])
+    elif method == 'doubling':
+        index = latency_doubling(curve[latency])
+    else:
+        raise ValueError(f"Unknown knee detection method {method}")
+
+    knee = curve.iloc[index]
+    after = curve['throughput'].iloc[index + 1:]
+    saturated = len(after) > 0 and after.max() <= (1 + max_gain) * knee['throughput']
+    return knee, bool(saturated)
+
+def sustainable_throughput(curve, slo, latency='latency-99p'):
+    ''' Highest throughput of any run whose latency stayed within the SLO (in ms) '''
+    within = curve[curve[latency] <= slo]['throughput']
+    return within.max() if len(within) > 0 else np.nan
+
+def find_knees(df, by=None, latency='latency-mean', method='kneedle', slo=None, slo_latency='latency-99p',
+               max_gain=DEFAULT_SATURATION_GAIN):
+    ''' Find the knee of every curve, where curves are the runs grouped by the given columns
+        (by default, all configuration columns, of which only those that vary are reported).
+        If an SLO (in ms) is given, also reports the maximum sustainable throughput.
+        See find_knee() for max_gain. '''
+    reported = by
+    if by is None:
+        by = configuration_columns(df)
+        reported = [name for name in by if df[name].nunique(dropna=False) > 1]
+
+    records = []
+    curves = df.groupby(by, sort=True, dropna=False) if by else [((), df)]
+    for (key, curve) in curves:
+        if not isinstance(key, tuple):
+            key = (key,)
+
+        record = {name: value for (name, value) in zip(by, key) if name in reported}
+        (knee, saturated) = find_knee(curve, latency, method, max_gain)
+        record['num-runs'] = len(curve)
+        record['saturated'] = saturated
+        for name in KNEE_FIELDS:
+            record[f'knee-{name}'] = knee[name] if knee is not None and name in knee else np.nan
+
+        if slo is not None:
+            record['sustainable-throughput'] = sustainable_throughput(curve, slo, slo_latency)
+
+        records.append(record)
+
+    return pd.DataFrame(records)
+
+def plot_knee(x, y, data=None, color=None, method='kneedle', **kwargs):
+    ''' Mark the knee of a curve. Meant to be used with FacetGrid.map_dataframe, e.g.,
+        g.map_dataframe(plot_knee, "throughput", "latency-mean") '''
+    import matplotlib.pyplot as plt # pylint: disable=import-outside-toplevel
+
+    curve = data.rename(columns={x: 'throughput'}) if x != 'throughput' else data
+    (knee, _) = find_knee(curve, latency=y, method=method)
+    if knee is None:
+        return
+
+    # The grid passes the marker and label of the curve; knees should not show up in the legend
+    kwargs.pop('marker', None)
+    kwargs.pop('label', None)
+    style = {'marker': '*', 'markersize': 16, 'markeredgecolor': 'black', 'zorder': 5}
+    style.update(kwargs)
+    plt.gca().plot([knee['throughput']], [knee[y]], color=color, linestyle='', **style)
+
+def _main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('infiles', type=str, nargs='+',
+        help="Results files to analyze (e.g., micro-latency/results.csv)")
+    parser.add_argument('--by', type=str,
+        help="Comma-separated subset of the configuration columns that identify a curve "
+             "(by default, every configuration is its own curve)")
+    parser.add_argument('--method', choices=KNEE_METHODS, default='kneedle')
+    parser.add_argument('--latency', choices=LATENCIES, default='latency-mean',
+        help="Latency used to find the knee")
+    parser.add_argument('--slo', type=float,
+        help="Latency SLO in ms to compute the maximum sustainable throughput for")
+    parser.add_argument('--slo-latency', choices=LATENCIES, default='latency-99p',
+        help="Latency the SLO applies to")
+    parser.add_argument('--saturation-gain', type=float, default=DEFAULT_SATURATION_GAIN,
+        help="A curve is saturated if runs past its knee gain at most this share of throughput")
+    parser.add_argument('--outfile', type=str)
+    args = parser.parse_args()
+
+    df = pd.concat([load_results(path) for path in args.infiles], ignore_index=True)
+    by = None
+    if args.by:
+        by = args.by.split(',')
+        columns = configuration_columns(df)
+        for name in by:
+            if name not in columns:
+                sys.stderr.write(f"ERROR: {name} is not a configuration column "
+                                 f"(one of {', '.join(columns)})\n")
+                sys.exit(1)
+
+        mixed = [name for name in columns if name not in by
+                 and (df.groupby(by, dropna=False)[name].nunique(dropna=False) > 1).any()]
+        if mixed:
+            sys.stderr.write(f"WARNING: curves mix runs with different {', '.join(mixed)}\n")
+
+    try:
+        knees = find_knees(df, by, args.latency, args.method, args.slo, args.slo_latency,
+                           args.saturation_gain)
+    except (KeyError, ValueError) as err:
+        sys.stderr.write(f"ERROR: {err}\n")
+        sys.exit(1)
+
+    knees.to_csv(args.outfile or sys.stdout, index=False)
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,202 @@
+#! /bin/env python3
+
+''' Fits the Universal Scalability Law (Gunther, 2007) to throughput over the number of shards.
+
+        X(N) = lambda * N / (1 + sigma * (N - 1) + kappa * N * (N - 1))
+
+    lambda is the throughput of a single shard, sigma the cost of contention,
+    and kappa the cost of coherency (i.e., of shards having to coordinate).
+    The model is fitted on the peak throughput of every shard count (see peak_cube.py),
+    using the linearized form N / X(N) = (1 + sigma * (N - 1) + kappa * N * (N - 1)) / lambda.
+    Confidence bands are computed by bootstrapping the measured points. '''
+
+import sys
+import argparse
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from peak_cube import load_peaks, peak_throughput
+
+DEFAULT_BOOTSTRAP_SAMPLES = 1000
+
+class USLModel:
+    ''' A fitted Universal Scalability Law '''
+
+    def __init__(self, lambda_, sigma, kappa):
+        self.lambda_ = float(lambda_)
+        self.sigma = float(sigma)
+        self.kappa = float(kappa)
+
+    def predict(self, num_shards):
+        ''' Expected throughput for the given number(s) of shards '''
+        num_shards = np.asarray(num_shards, dtype=np.float64)
+        return self.lambda_ * num_shards / self.overhead(num_shards)
+
+    def overhead(self, num_shards):
+        ''' The denominator of the USL '''
+        num_shards = np.asarray(num_shards, dtype=np.float64)
+        return 1 + self.sigma * (num_shards - 1) + self.kappa * num_shards * (num_shards - 1)
+
+    def efficiency(self, num_shards):
+        ''' Throughput per shard relative to a single shard (1.0 means linear scaling) '''
+        return 1.0 / self.overhead(num_shards)
+
+    @property
+    def peak_shards(self):
+        ''' Number of shards after which adding more decreases throughput (inf if never) '''
+        if self.kappa <= 0:
+            return np.inf
+        return np.sqrt(max(1.0 - self.sigma, 0.0) / self.kappa)
+
+    def __repr__(self):
+        return f"USLModel(lambda_={self.lambda_!r}, sigma={self.sigma!r}, kappa={self.kappa!r})"
+
+def fit_usl(num_shards, throughput):
+    ''' Fit the USL with linear least squares.
+        sigma and kappa are constrained to be non-negative by trying every subset of the two terms
+        and keeping the feasible fit with the smallest squared error in throughput.
+        As a result, superlinear scaling is modeled as linear (sigma = kappa = 0). '''
+    num_shards = np.asarray(num_shards, dtype=np.float64)
+    throughput = np.asarray(throughput, dtype=np.float64)
+    valid = (throughput > 0) & (num_shards > 0)
+    (num_shards, throughput) = (num_shards[valid], throughput[valid])
+
+    if len(np.unique(num_shards)) < 2:
+        raise ValueError("Need at least two different shard counts to fit the USL")
+
+    terms = {'sigma': num_shards - 1, 'kappa': num_shards * (num_shards - 1)}
+    target = num_shards / throughput
+
+    best = None
+    for count in range(len(terms), -1, -1):
+        for names in itertools.combinations(terms, count):
+            design = np.column_stack([np.ones_like(num_shards)] + [terms[name] for name in names])
+            (coefficients, _, rank, _) = np.linalg.lstsq(design, target, rcond=None)
+            if rank < design.shape[1] or coefficients[0] <= 0 or np.any(coefficients[1:] < 0):
+                continue
+
+            params = dict(zip(names, coefficients[1:] / coefficients[0]))
+            model = USLModel(1.0 / coefficients[0], params.get('sigma', 0.0), params.get('kappa', 0.0))
+            error = np.sum((model.predict(num_shards) - throughput)**2)
+            if best is None or error < best[0]:
+                best = (error, model)
+
+    return best[1]
+
+def bootstrap_usl(num_shards, throughput, samples=DEFAULT_BOOTSTRAP_SAMPLES, seed=0):
+    ''' Fit the USL to resampled (with replacement) points.
+        Resamples with fewer than two different shard counts are skipped. '''
+    num_shards = np.asarray(num_shards, dtype=np.float64)
+    throughput = np.asarray(throughput, dtype=np.float64)
+    rng = np.random.default_rng(seed)
+
+    models = []
+    for _ in range(samples):
+        picked = rng.integers(0, len(num_shards), len(num_shards))
+        if len(np.unique(num_shards[picked])) < 2:
+            continue
+        models.append(fit_usl(num_shards[picked], throughput[picked]))
+    return models
+
+def confidence_band(models, num_shards, confidence=0.9):
+    ''' Lower and upper bound of the predicted throughput across bootstrapped models '''
+    predictions = np.array([model.predict(num_shards) for model in models])
+    tail = (1.0 - confidence) / 2 * 100
+    return np.percentile(predictions, tail, axis=0), np.percentile(predictions, 100 - tail, axis=0)
+
+def fit_groups(df, by, confidence=0.9, samples=DEFAULT_BOOTSTRAP_SAMPLES):
+    ''' Fit the USL to the peak throughput per shard count of every group (e.g., workload and worker type) '''
+    peaks = peak_throughput(df, by + ['num-shards'])
+
+    records = []
+    for (key, group) in peaks.groupby(by, sort=True):
+        if not isinstance(key, tuple):
+            key = (key,)
+        record = dict(zip(by, key))
+        (shards, throughput) = (group['num-shards'].to_numpy(), group['throughput'].to_numpy())
+        record['num-points'] = len(group)
+
+        try:
+            model = fit_usl(shards, throughput)
+        except ValueError:
+            records.append(record)
+            continue
+
+        models = bootstrap_usl(shards, throughput, samples)
+        peak = model.peak_shards
+        tail = (1.0 - confidence) / 2 * 100
+
+        record.update({
+            'lambda': model.lambda_,
+            'sigma': model.sigma,
+            'kappa': model.kappa,
+            'peak-shards': peak,
+            'peak-throughput': model.predict(peak) if np.isfinite(peak) else np.nan,
+            'max-measured-shards': shards.max(),
+            'efficiency-at-max': model.efficiency(shards.max()),
+            'sigma-low': np.percentile([m.sigma for m in models], tail),
+            'sigma-high': np.percentile([m.sigma for m in models], 100 - tail),
+            'kappa-low': np.percentile([m.kappa for m in models], tail),
+            'kappa-high': np.percentile([m.kappa for m in models], 100 - tail),
+        })
+        records.append(record)
+
+    return pd.DataFrame(records)
+
+def plot_usl(x, y, data=None, color=None, max_shards=None, confidence=0.9,
+             samples=DEFAULT_BOOTSTRAP_SAMPLES, **_):
+    ''' Overlay the fitted USL and its confidence band. Meant to be used with
+        FacetGrid.map_dataframe, e.g., g.map_dataframe(plot_usl, "num-shards", "throughput").
+        Other arguments passed by the grid (e.g., the marker or label of the curve) are ignored. '''
+    import matplotlib.pyplot as plt # pylint: disable=import-outside-toplevel
+
+    peaks = data.groupby(x)[y].max().reset_index()
+    (shards, throughput) = (peaks[x].to_numpy(), peaks[y].to_numpy())
+    try:
+        model = fit_usl(shards, throughput)
+    except ValueError:
+        return
+
+    max_shards = max_shards or shards.max()
+    xs = np.linspace(shards.min(), max_shards, 200)
+    (low, high) = confidence_band(bootstrap_usl(shards, throughput, samples), xs, confidence)
+
+    axes = plt.gca()
+    axes.fill_between(xs, low, high, color=color, alpha=0.15, linewidth=0)
+    axes.plot(xs, model.predict(xs), color=color, linestyle='--', linewidth=1)
+
+def _main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('infiles', type=str, nargs='+',
+        help="Results files with a num-shards column (e.g., sharding/forum.csv)")
+    parser.add_argument('--by', type=str, default='workload,worker-type',
+        help="Comma-separated list of columns to fit a separate model for")
+    parser.add_argument('--confidence', type=float, default=0.9)
+    parser.add_argument('--samples', type=int, default=DEFAULT_BOOTSTRAP_SAMPLES,
+        help="Number of bootstrap samples for the confidence intervals")
+    parser.add_argument('--predict', type=str,
+        help="Comma-separated list of shard counts to predict the throughput for")
+    parser.add_argument('--outfile', type=str)
+    args = parser.parse_args()
+
+    df = load_peaks(args.infiles)
+    by = [name for name in args.by.split(',') if name in df]
+
+    if 'num-shards' not in df:
+        sys.stderr.write("ERROR: The results files do not have a num-shards column\n")
+        sys.exit(1)
+
+    fits = fit_groups(df, by, args.confidence, args.samples)
+
+    if args.predict:
+        for shards in [int(value) for value in args.predict.split(',')]:
+            fits[f'throughput-at-{shards}'] = [
+                USLModel(row['lambda'], row['sigma'], row['kappa']).predict(shards)
+                if pd.notna(row.get('lambda')) else np.nan for (_, row) in fits.iterrows()]
+
+    fits.to_csv(args.outfile or sys.stdout, index=False)
+
+if __name__ == "__main__":
+    _main()
@@ -2,15 +2,29 @@
 
 ''' Plots application scalability as the number of shards increases '''
 
+import sys
+import argparse
 import matplotlib.pyplot as plt
 
 import numpy as np
-from pandas import read_csv, concat
+from pandas import concat
 
 from seaborn import lineplot, FacetGrid
 
 from matplotlib.font_manager import FontProperties, fontManager
 
+# Shared helpers live in the top-level directory
+sys.path.append('..')
+from peak_cube import load_peaks, peak_throughput # pylint: disable=wrong-import-position
+from scalability import plot_usl # pylint: disable=wrong-import-position
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--usl', action='store_true',
+    help="Overlay the fitted Universal Scalability Law with confidence bands (see scalability.py)")
+parser.add_argument('--usl-max-shards', type=int,
+    help="Extrapolate the fitted model up to this many shards")
+args = parser.parse_args()
+
 FONT_PATH = '../LinLibertine_Rah.ttf'
 fontManager.addfont(FONT_PATH)
 
@@ -34,14 +48,14 @@ col_order = [val for (_,val) in workloads.items()]
 data = []
 
 for name in workloads:
-    df = read_csv(f'{name}.csv', header=0, comment="#", skipinitialspace=True)
+    df = load_peaks([f'{name}.csv'])
     if 'workload' not in df:
         df["workload"] = name
     data.append(df)
 
 df = concat(data)
 
-df = df.groupby(["workload", "worker-type", "num-shards"])['throughput'].max().reset_index()
+df = peak_throughput(df, ["workload", "worker-type", "num-shards"])
 df['throughput'] = df['throughput'] / 1000.0
 
 for (key, name) in workloads.items():
@@ -60,6 +74,9 @@ g = FacetGrid(df, col="Workload", height=3, aspect=len(workloads)*0.5,
               col_order=col_order)
 g.map(lineplot, "num-shards", "throughput")
 
+if args.usl:
+    g.map_dataframe(plot_usl, "num-shards", "throughput", max_shards=args.usl_max_shards)
+
 g.set_titles(col_template="{col_name}")
 g.set_ylabels('Throughput (ktps)')
 g.set_xlabels('Replica Sets')
@@ -0,0 +1,254 @@
+#! /bin/env python3
+
+''' Proposes which client-multiply values to run next, so that peak throughput is found with few runs.
+
+    Throughput is expected to grow until the system saturates and then stay flat or drop.
+    The planner first grows (or shrinks) client-multiply geometrically until the best run has
+    a neighbour with lower throughput on both sides and the largest client-multiply tried is
+    clearly worse than the best run, and then bisects the larger of the two gaps around the best
+    run. Where throughput rises again further out, that gap is bisected as well, as the curve
+    may have a dip before the actual peak. A configuration is done once both neighbours are
+    within the resolution or, with lower runs on both sides, within the tolerance of the best run.
+
+    Proposed runs are printed as the benchmark command recorded in the header of the results file,
+    with the parameters of the configuration and the new client-multiply appended. '''
+
+import sys
+import copy
+import json
+import shlex
+import argparse
+
+import numpy as np
+
+from results import load_results, parse_value
+from peak_cube import LOAD_PARAMETERS, MEASUREMENTS
+
+LOAD = 'client-multiply'
+
+# How a parameter is passed to the benchmark; must match what benchmark.py accepts
+DEFAULT_OVERRIDE_FORMAT = '--{name}={value}'
+
+class SweepPlanner:
+    ''' Bracketing search for the client-multiply with the highest throughput '''
+
+    def __init__(self, min_value=1, max_value=None, growth=2.0, step=1,
+                 resolution=0.1, tolerance=0.02, batch=2, initial=3):
+        self.min_value = min_value
+        self.max_value = max_value
+        # Factor to grow or shrink client-multiply by while the peak is not bracketed
+        self.growth = growth
+        # Proposed values are multiples of this
+        self.step = step
+        # Stop bisecting once a gap is smaller than this share of the best client-multiply
+        self.resolution = resolution
+        # Stop bisecting once throughput of a neighbour is within this share of the best
+        self.tolerance = tolerance
+        # Maximum number of values to propose at once
+        self.batch = batch
+        # Number of values to start with if there are no runs yet
+        self.initial = initial
+
+    def _round(self, value):
+        value = max(int(round(value / self.step)) * self.step, self.min_value)
+        if self.max_value is not None:
+            value = min(value, self.max_value)
+        return value
+
+    def propose(self, loads, throughputs):
+        ''' Get the next client-multiply values to run (empty if the peak has been found)
+            and the state of the search '''
+        # Runs without a throughput (e.g., failed ones) count as tried, so they are not proposed again
+        raw_loads = np.asarray(loads, dtype=np.float64)
+        tried = {int(load) for load in raw_loads[~np.isnan(raw_loads)]}
+
+        def untried(values):
+            return [value for value in dict.fromkeys(values) if value not in tried]
+
+        (loads, throughputs) = _mean_per_load(loads, throughputs)
+
+        if len(loads) == 0:
+            upper = self.max_value or self.min_value * self.growth**(self.initial + 1)
+            values = np.geomspace(max(self.min_value, 1), upper, self.initial + 2)[1:-1]
+            return untried(sorted({self._round(value) for value in values})), 'starting'
+
+        best = int(np.argmax(throughputs))
+        last = len(loads) - 1
+
+        def close(idx):
+            return throughputs[best] - throughputs[idx] <= self.tolerance * throughputs[best]
+
+        proposals = []
+
+        # The peak may lie beyond the tested range as long as its top is about as good as the best run
+        if best == last or close(last):
+            state = 'searching up'
+            value = loads[-1]
+            for _ in range(self.batch):
+                value = self._round(value * self.growth)
+                proposals.append(value)
+            proposals = untried(proposals)
+        elif best == 0 and loads[0] > self.min_value:
+            state = 'searching down'
+            value = loads[0]
+            for _ in range(self.batch):
+                value = self._round(value / self.growth)
+                proposals.append(value)
+            proposals = untried(proposals)
+
+        if not proposals:
+            state = 'bracketed'
+            # Neighbours within the tolerance only end the search once lower runs enclose the peak
+            enclosed = 0 < best < last
+            gaps = []
+            for neighbour in [best - 1, best + 1]:
+                if neighbour < 0 or neighbour > last:
+                    continue
+                width = abs(loads[neighbour] - loads[best])
+                if width > max(self.resolution * loads[best], self.step) and not (enclosed and close(neighbour)):
+                    gaps.append((width, (loads[neighbour] + loads[best]) / 2))
+
+            # Where throughput rises again further out, the curve is not unimodal
+            # and a higher peak may hide between the two runs
+            for side in [-1, 1]:
+                inner = best + side
+                while 0 <= inner + side <= last and throughputs[inner + side] <= throughputs[inner]:
+                    inner += side
+                outer = inner + side
+                if 0 <= inner <= last and 0 <= outer <= last:
+                    width = abs(loads[outer] - loads[inner])
+                    if width > max(self.resolution * loads[best], self.step):
+                        gaps.append((width, (loads[outer] + loads[inner]) / 2))
+
+            proposals = untried([self._round(middle) for (_, middle) in sorted(gaps, reverse=True)])
+
+        if not proposals:
+            state = 'done'
+        return proposals[:self.batch], state
+
+    def simulate(self, loads, throughputs, max_rounds=100):
+        ''' Replay the search against an existing sweep, interpolating the throughput of values
+            that were not measured. The search is limited to the range that was measured.
+            Returns the client-multiply values that would have been run and their throughput. '''
+        (loads, throughputs) = _mean_per_load(loads, throughputs)
+        planner = copy.copy(self)
+        (planner.min_value, planner.max_value) = (int(loads[0]), int(loads[-1]))
+        if len(loads) > 1:
+            # Steps coarser than the sweep would round every proposal to the same value
+            planner.step = max(min(self.step, int(np.diff(loads).min())), 1)
+        (tried, measured) = ([], [])
+
+        for _ in range(max_rounds):
+            (proposals, _) = planner.propose(tried, measured)
+            if not proposals:
+                break
+            tried.extend(proposals)
+            measured.extend(np.interp(proposals, loads, throughputs))
+
+        return _mean_per_load(tried, measured)
+
+def _mean_per_load(loads, throughputs):
+    ''' Sort runs by client-multiply and average repeated runs '''
+    loads = np.asarray(loads, dtype=np.float64)
+    throughputs = np.asarray(throughputs, dtype=np.float64)
+    valid = ~np.isnan(loads) & ~np.isnan(throughputs)
+    (unique, inverse) = np.unique(loads[valid], return_inverse=True)
+    means = np.bincount(inverse, weights=throughputs[valid], minlength=len(unique)) \
+        / np.maximum(np.bincount(inverse, minlength=len(unique)), 1)
+    return unique.astype(np.int64), means
+
+def configurations(df):
+    ''' Group the runs of a results file by the parameters that identify a configuration '''
+    excluded = set(LOAD_PARAMETERS) | set(MEASUREMENTS)
+    keys = [name for name in df.columns if name not in excluded]
+    if not keys:
+        return [({}, df)]
+    return [(dict(zip(keys, key if isinstance(key, tuple) else (key,))), runs)
+            for (key, runs) in df.groupby(keys, sort=True, dropna=False)]
+
+def command_line(command, parameters, override_format=DEFAULT_OVERRIDE_FORMAT):
+    ''' The benchmark command with the given parameters appended '''
+    overrides = [override_format.format(name=name, value=value) for (name, value) in parameters.items()]
+    return ' '.join([command] + [shlex.quote(override) for override in overrides])
+
+def _parse_filter(text):
+    if '=' not in text:
+        raise argparse.ArgumentTypeError(f"Expected column=value, not {text}")
+    (name, value) = text.split('=', 1)
+    return name, parse_value(value)
+
+def _main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('infile', type=str, help="Results file to plan the next runs for")
+    parser.add_argument('--where', type=_parse_filter, action='append', default=[],
+        help="Only plan for configurations where a column has the given value (e.g., worker-type=lambdastore)")
+    parser.add_argument('--min', type=int, default=1, help="Smallest client-multiply to run")
+    parser.add_argument('--max', type=int, help="Largest client-multiply to run")
+    parser.add_argument('--growth', type=float, default=2.0,
+        help="Factor to change client-multiply by while the peak is not bracketed")
+    parser.add_argument('--step', type=int, default=10, help="Proposed values are multiples of this")
+    parser.add_argument('--resolution', type=float, default=0.1,
+        help="Stop once the gaps around the peak are at most this share of its client-multiply")
+    parser.add_argument('--tolerance', type=float, default=0.02,
+        help="Stop once the neighbours of the peak are within this share of its throughput")
+    parser.add_argument('--batch', type=int, default=2, help="Number of runs to propose per configuration")
+    parser.add_argument('--override-format', type=str, default=DEFAULT_OVERRIDE_FORMAT,
+        help="How to pass a parameter to the benchmark")
+    parser.add_argument('--format', choices=['commands', 'json'], default='commands')
+    parser.add_argument('--simulate', action='store_true',
+        help="Instead of planning, replay the search against the existing runs and report how many it needs")
+    args = parser.parse_args()
+
+    df = load_results(args.infile, constants=False)
+    if LOAD not in df:
+        sys.stderr.write(f"ERROR: {args.infile} has no {LOAD} column\n")
+        sys.exit(1)
+
+    for (name, value) in args.where:
+        if name not in df:
+            sys.stderr.write(f"ERROR: {args.infile} has no {name} column\n")
+            sys.exit(1)
+        df = df[df[name] == value]
+
+    planner = SweepPlanner(args.min, args.max, args.growth, args.step,
+                           args.resolution, args.tolerance, args.batch)
+    command = df.attrs['config'].command or './benchmark.py'
+    plans = []
+
+    for (parameters, runs) in configurations(df):
+        loads = runs[LOAD].to_numpy()
+        throughputs = runs['throughput'].to_numpy()
+        parameters = {name: value for (name, value) in parameters.items()
+                      if value is not None and value == value}
+
+        if args.simulate:
+            (unique, means) = _mean_per_load(loads, throughputs)
+            (tried, measured) = planner.simulate(loads, throughputs)
+            plans.append({'parameters': parameters, 'runs': len(unique), 'needed': len(tried),
+                          'peak': float(means.max()), 'peak-load': int(unique[np.argmax(means)]),
+                          'found': float(measured.max()), 'found-load': int(tried[np.argmax(measured)])})
+            continue
+
+        (proposals, state) = planner.propose(loads, throughputs)
+        plans.append({'parameters': parameters, 'state': state, 'runs': len(runs),
+                      'proposals': proposals,
+                      'commands': [command_line(command, {**parameters, LOAD: value}, args.override_format)
+                                   for value in proposals]})
+
+    if args.format == 'json':
+        json.dump(plans, sys.stdout, indent=2, default=str)
+        print()
+        return
+
+    for plan in plans:
+        description = ', '.join(f"{name}={value}" for (name, value) in plan['parameters'].items())
+        if args.simulate:
+            print(f"# {description}: {plan['needed']} of {plan['runs']} runs needed, found "
+                  f"{plan['found']:.1f} at {plan['found-load']} (peak {plan['peak']:.1f} at {plan['peak-load']})")
+            continue
+        print(f"# {description} ({plan['runs']} runs, {plan['state']})")
+        for line in plan['commands']:
+            print(line)
+
+if __name__ == "__main__":
+    _main()
@@ -13,7 +13,15 @@ import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib.font_manager import FontProperties, fontManager
 
-from extract_metrics import parse_start_time
+from extract_metrics import SCHEMA, LOCAL_METRICS, GLOBAL_METRICS
+
+sys.path.append('..')
+
+# pylint: disable=wrong-import-position
+from cluster_metrics import DEFAULT_CHUNK_ROWS, load_metrics, stream_metrics, join_mask
+from decimate import DECIMATION_METHODS, decimate
+from heatmap import draw_heatmap
+from live_metrics import MetricsTail, DEFAULT_WINDOW, DEFAULT_INTERVAL
 
 
 def _main():
@@ -41,6 +49,26 @@ def _main():
     parser.add_argument('hide_legend', action='store_true')
     parser.add_argument('--height', type=float, default=6)
     parser.add_argument('--width', type=float, default=3)
+    parser.add_argument('--zero-fill', action='store_true',
+        help="Show nodes as zero before they joined instead of leaving a gap")
+    parser.add_argument('--stream', action='store_true',
+        help="Stream over the file in chunks and plot a downsampled version (bounded memory)")
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS,
+        help="Number of rows to parse at once in streaming mode")
+    parser.add_argument('--decimate', type=str, choices=DECIMATION_METHODS,
+        help="Reduce each series before plotting (mean smooths out spikes)")
+    parser.add_argument('--max-points', type=int,
+        help="Maximum number of points per series (defaults to the figure width in pixels)")
+    parser.add_argument('--heatmap', action='store_true',
+        help="Draw each local metric as a (node x time) heatmap instead of one line per node")
+    parser.add_argument('--follow', action='store_true',
+        help="Keep reading the file while it is written and redraw the output whenever it grows")
+    parser.add_argument('--window-minutes', type=float, default=DEFAULT_WINDOW / 60000,
+        help="How much history to keep and plot in follow mode")
+    parser.add_argument('--refresh', type=float, default=DEFAULT_INTERVAL,
+        help="Seconds between checks for new rows in follow mode")
+    parser.add_argument('--follow-timeout', type=float,
+        help="Stop following once the file has not grown for this many seconds")
 
     args = parser.parse_args()
 
@@ -68,17 +96,8 @@ def _main():
         'mem-usage': "Memory Usage",
     }
 
-    all_local_metrics = [
-        'cpu-usage', 'mem-usage', 'compute-utilization', 'active-transactions',
-        'running-jobs', 'blocked-jobs', 'ready-jobs', 'num-objects',
-        'total-commits', 'total-aborts',
-        'throughput', 'abort-rate', 'job-runtime',
-    ]
-
-    all_global_metrics = [
-        'total-job-runtime', 'total-throughput', 'num-full-replicas',
-        'num-light-replicas', 'num-shards', 'coord-cpu-usage',
-    ]
+    all_local_metrics = LOCAL_METRICS
+    all_global_metrics = GLOBAL_METRICS
 
     all_metrics = all_local_metrics + all_global_metrics
 
@@ -120,7 +139,6 @@ def _main():
         stderr.write(f'ERROR: No such metric "{key}"\n')
         sys.exit(1)
 
-    num_global_metrics = len(all_global_metrics)
     num_local_metrics = len(all_local_metrics)
     num_metrics = len(labels)
 
@@ -132,8 +150,9 @@ def _main():
         stderr.write("ERROR: one-plot needs exactly two metrics\n")
         sys.exit(1)
 
-    times = []
-    data = [[] for _ in range(num_metrics)]
+    if args.one_plot and args.heatmap:
+        stderr.write("ERROR: heatmap cannot be combined with one-plot\n")
+        sys.exit(1)
 
     if os.path.isdir(args.path):
         path = args.path + '/cluster-metrics.csv'
@@ -141,180 +160,184 @@ def _main():
     else:
         path = args.path
 
-    start_time = None
-    num_nodes = 0
-    last_num_nodes = 0
+    def render(start_time, rows, local_data, global_data, node_counts):
+        num_nodes = local_data.shape[1]
+        joined = join_mask(node_counts, num_nodes)
+        times = rows * args.report_frequency * 0.001
 
-    with open(path, 'r', encoding='utf-8') as infile:
-        for (line_no, line) in enumerate(infile.readlines()):
-            if line_no == 0:
-                start_time = parse_start_time(line)
+        # Select the requested metrics (in the order specified by the user)
+        data = [None for _ in range(num_metrics)]
+        for (total_metric_idx, idx) in enumerate(metric_filter):
+            if idx < 0:
                 continue
+            if total_metric_idx < num_local_metrics:
+                data[idx] = local_data[:, :, total_metric_idx]
+                if args.zero_fill:
+                    data[idx] = np.where(joined, data[idx], 0.0)
+            else:
+                data[idx] = global_data[:, total_metric_idx - num_local_metrics]
 
-            line = line.replace('\n', '')
-            entries = [float(v) for v in line.split(',')]
-
-            if len(entries) == 0 or (len(entries)-num_global_metrics) % num_local_metrics != 0:
-                stderr.write(f"Line #{line_no} is invalid: {line}\n")
-                sys.exit(1)
-
-            line_no = line_no-1 # first line is only metadata
-            times.append(line_no * args.report_frequency * 0.001)
-
-            num_nodes = int((len(entries)-num_global_metrics) / num_local_metrics)
-            assert num_nodes >= last_num_nodes
-
-            #For each node metric, we need to add zeros for the time period
-            # where the node was not connected yet
-            for node_idx in range(last_num_nodes, num_nodes):
-                for total_metric_idx in range(num_local_metrics):
-                    idx = metric_filter[total_metric_idx]
+        if len(times) == 0:
+            stderr.write("ERROR: No data found\n")
+            sys.exit(1)
 
-                    if idx >= 0:
-                        assert len(data[idx]) == line_no
-                        for lno, _ in enumerate(data[idx]):
-                            assert len(data[idx][lno]) == node_idx
-                            data[idx][lno].append(0.0)
+        node_labels = []
+        for node_idx in range(num_nodes):
+            node_labels.append(f"Node #{node_idx}")
 
-            last_num_nodes = num_nodes
+        if args.one_plot:
+            _fig, axis = plt.subplots(1, 1, figsize=(args.width, args.height))
+            axes = [axis, axis.twinx()]
+        else:
+            _fig, axes = plt.subplots(num_metrics, 1, figsize=(args.width, args.height))
+            if num_metrics == 1:
+                axes = [axes]
+
+        start_at = 0
+
+        if args.start_at:
+            if args.absolute_time:
+                assert start_time
+                assert args.start_at >= start_time
+                start_at = (args.start_at - start_time) / 1000.0
+                print(f"Relative start time is: {start_at}")
+            else:
+                start_at = args.start_at / 1000.0
+
+            # remove data until we are at the start point
+            # (slices are views, so this does not copy any data)
+            first = np.searchsorted(times, start_at, side='left')
+            times = times[first:]
+            data = [metric[first:] for metric in data]
+
+        if args.end_at:
+            if args.absolute_time:
+                assert start_time
+                assert args.end_at >= start_time
+                end_at = (args.end_at - start_time) / 1000.0
+            else:
+                end_at = args.end_at / 1000.0
 
-            # Process local metrics
-            # builds an array with an entry for each node
-            for total_metric_idx in range(num_local_metrics):
-                idx = metric_filter[total_metric_idx]
+            last = np.searchsorted(times, end_at, side='right')
+            times = times[:last]
+            data = [metric[:last] for metric in data]
 
-                if idx >= 0:
-                    data_points = []
+        if args.marker_at:
+            if args.absolute_time:
+                assert start_time
+                assert args.marker_at >= start_time
+                marker_at = (args.marker_at - start_time) / 1000.0
+            else:
+                marker_at = args.marker_at / 1000.0
+        else:
+            marker_at = None
+
+        if args.start_at:
+            # Make time relative to the start of the graph
+            times = times - start_at
+            if marker_at:
+                marker_at = marker_at - start_at
+
+        # Only plot about as many points as the figure has pixels (if requested)
+        method = args.decimate or ('minmax' if args.max_points else None)
+        max_points = args.max_points or int(args.width * plt.rcParams['figure.dpi'])
+
+        def series(values):
+            if method is None:
+                return times, values
+            return decimate(times, values, max_points, method)
+
+        def heatmap(axis, values, label, log_scale):
+            # About one cell per pixel (nodes that had not joined are left blank)
+            max_nodes = int(args.height * plt.rcParams['figure.dpi'] / num_metrics)
+            image = draw_heatmap(axis, times, values, max_points, max_nodes, log_scale)
+            # Keep the colorbar outside of the axis, so that time stays aligned across plots
+            colorbar = plt.colorbar(image, cax=axis.inset_axes([1.01, 0.0, 0.02, 1.0]))
+            colorbar.set_label(label)
+
+        for (metric_idx, metric_name) in enumerate(metrics):
+            axis = axes[metric_idx]
+            log_scale = metric_name in ["job-runtime", "total-job-runtime", "num-objects"]
+            as_heatmap = args.heatmap and metric_name not in all_global_metrics
+
+            if log_scale and not as_heatmap:
+                # show runtime in log scale (first instance spawn takes long)
+                axis.set_yscale("log")
+            else:
+                axis.set_yscale("linear")
+
+            if metric_name in ["throughput", "total-throughput"]:
+                data[metric_idx] = data[metric_idx] / 1000
+
+            if metric_name in all_global_metrics:
+                # this is a global metric
+                if metric_idx > 0 and args.one_plot:
+                    axis.plot(*series(data[metric_idx]), linewidth=args.linewidth,
+                              color='red', linestyle='--')
+                else:
+                    axis.plot(*series(data[metric_idx]), linewidth=args.linewidth)
+            else:
+                # this is a per node metric
+                assert len(times) == len(data[metric_idx])
+                if as_heatmap:
+                    heatmap(axis, data[metric_idx], labels[metric_idx], log_scale)
+                else:
                     for node_idx in range(num_nodes):
-                        pos = node_idx * num_local_metrics + total_metric_idx
-                        data_points.append(entries[pos])
-                    data[idx].append(data_points)
-
-            # Process global metrics
-            for global_idx in range(num_global_metrics):
-                total_metric_idx = num_local_metrics + global_idx
-                idx = metric_filter[total_metric_idx]
-                if idx >= 0:
-                    pos = num_nodes * num_local_metrics + global_idx
-                    data[idx].append(entries[pos])
-
-    if len(times) == 0:
-        stderr.write("ERROR: No data found\n")
-        sys.exit(1)
+                        axis.plot(*series(data[metric_idx][:, node_idx]),
+                                  label=node_labels[node_idx], linewidth=args.linewidth)
 
-    node_labels = []
-    for node_idx in range(num_nodes):
-        node_labels.append(f"Node #{node_idx}")
-
-    if args.one_plot:
-        _fig, axis = plt.subplots(1, 1, figsize=(args.width, args.height))
-        axes = [axis, axis.twinx()]
-    else:
-        _fig, axes = plt.subplots(num_metrics, 1, figsize=(args.width, args.height))
-        if num_metrics == 1:
-            axes = [axes]
-
-    start_at = 0
-
-    if args.start_at:
-        if args.absolute_time:
-            assert start_time
-            assert args.start_at >= start_time
-            start_at = (args.start_at - start_time) / 1000.0
-            print(f"Relative start time is: {start_at}")
-        else:
-            start_at = args.start_at / 1000.0
-
-        # remove data until we are at the start point
-        while len(times) > 0 and times[0] < start_at:
-            times.pop(0)
-            for metric in data:
-                metric.pop(0)
-
-    if args.end_at:
-        if args.absolute_time:
-            assert start_time
-            assert args.end_at >= start_time
-            end_at = (args.end_at - start_time) / 1000.0
-        else:
-            end_at = args.end_at / 1000.0
-
-        while len(times) > 0 and times[-1] > end_at:
-            times.pop()
-            for metric in data:
-                metric.pop()
-
-    if args.marker_at:
-        if args.absolute_time:
-            assert start_time
-            assert args.marker_at >= start_time
-            marker_at = (args.marker_at - start_time) / 1000.0
-        else:
-            marker_at = args.marker_at / 1000.0
-    else:
-        marker_at = None
+                    if not args.hide_legend:
+                        axis.legend()
 
-    if args.start_at:
-        # Make time relative to the start of the graph
-        times[:] = [time-start_at for time in times]
-        if marker_at:
-            marker_at = marker_at - start_at
+            if marker_at:
+                axis.vlines(marker_at, 0, 200)
 
-    for (metric_idx, metric_name) in enumerate(metrics):
-        axis = axes[metric_idx]
+            if metric_idx+1 == len(metrics) or args.one_plot:
+                # only label x axis once
+                axis.set_xlabel("Time (s)")
+            elif not args.one_plot:
+                xax = axis.get_xaxis()
+                xax.set_visible(False)
 
-        if metric_name in ["job-runtime", "total-job-runtime", "num-objects"]:
-            # show runtime in log scale (first instance spawn takes long)
-            axis.set_yscale("log")
-        else:
-            axis.set_yscale("linear")
-
-        if metric_name in ["throughput", "total-throughput"]:
-            for i in range(len(data[metric_idx])):
-                for j in range(len(data[metric_idx][i])):
-                    data[metric_idx][i][j] /= 1000
-
-        if metric_name in all_global_metrics:
-            # this is a global metric
-            if metric_idx > 0 and args.one_plot:
-                axis.plot(times, data[metric_idx], linewidth=args.linewidth,
-                          color='red', linestyle='--')
+            if as_heatmap:
+                axis.set(ylim=(num_nodes - 0.5, -0.5))
+                axis.set_ylabel("Node")
             else:
-                axis.plot(times, data[metric_idx], linewidth=args.linewidth)
+                axis.set(ylim=(0, 110))
+                axis.set_ylabel(labels[metric_idx])
+            axis.set(xlim=(min(times), max(times)))
+
+        plt.tight_layout()
+
+        print(f'Writing output to {args.outfile}')
+        plt.savefig(args.outfile)
+
+    if args.follow:
+        tail = MetricsTail(SCHEMA, path, int(args.window_minutes * 60000), args.report_frequency)
+        try:
+            # Redraw the output whenever new rows were appended
+            for _ in tail.follow(args.refresh, args.follow_timeout):
+                plt.close('all')
+                render(*tail.snapshot())
+        except RuntimeError as err:
+            stderr.write(f"ERROR: {err}\n")
+            sys.exit(1)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    try:
+        if args.stream:
+            start_time, rows, local_data, global_data, node_counts = stream_metrics(
+                SCHEMA, path, metrics, chunk_rows=args.chunk_rows)
         else:
-            # this is a per node metric
-            assert len(times) == len(data[metric_idx])
-            per_node = [[] for _ in range(num_nodes)]
-            for data_point in data[metric_idx]:
-                assert len(data_point) == num_nodes
-                for (idx, val) in enumerate(data_point):
-                    per_node[idx].append(val)
-
-            for (node_idx, node_data) in enumerate(per_node):
-                axis.plot(times, node_data, label=node_labels[node_idx],
-                        linewidth=args.linewidth)
-
-            if not args.hide_legend:
-                axis.legend()
-
-        if marker_at:
-            axis.vlines(marker_at, 0, 200)
-
-        if metric_idx+1 == len(metrics) or args.one_plot:
-            # only label x axis once
-            axis.set_xlabel("Time (s)")
-        elif not args.one_plot:
-            xax = axis.get_xaxis()
-            xax.set_visible(False)
-
-        axis.set(ylim=(0, 110))
-        axis.set_ylabel(labels[metric_idx])
-        axis.set(xlim=(min(times), max(times)))
-
-    plt.tight_layout()
-
-    print(f'Writing output to {args.outfile}')
-    plt.savefig(args.outfile)
+            start_time, local_data, global_data, node_counts = load_metrics(SCHEMA, path)
+            rows = np.arange(len(local_data))
+    except RuntimeError as err:
+        stderr.write(f"ERROR: {err}\n")
+        sys.exit(1)
+
+    render(start_time, rows, local_data, global_data, node_counts)
 
 if __name__ == "__main__":
     _main()